@@ -0,0 +1,5 @@
+#!/bin/bash
+# Pending and running jobs. Delimited by | to keep the full job name.
+# %A is unique for each job array task and %i is ARRAYJOBNUM_TASKNUM.
+
+squeue -u ekoch --noheader --format="%A|%i|%j|%T"
@@ -2,4 +2,6 @@
 arguments=($SSH_ORIGINAL_COMMAND)
 # arg0 = start_time_str
 
-sacct --format="JobID,JobName%110,State%20" --starttime=${arguments[0]} | grep -v "^[0-9]*\."
+# Keep the job steps (e.g., 1234.batch). These hold the memory and disk usage.
+# Field names must match SACCT_FIELDS in job_monitor.py
+sacct --parsable2 --format="JobID,JobIDRaw,JobName,State,Elapsed,TotalCPU,MaxRSS,MaxDiskRead,MaxDiskWrite,ReqMem,AllocCPUS,Timelimit,End" --starttime=${arguments[0]}
@@ -0,0 +1,37 @@
+#!/bin/bash
+arguments=($SSH_ORIGINAL_COMMAND)
+# arg0 = directory
+# arg1 = tar file with the job scripts
+# arg2 = dependency type (afterok, or aftercorr for job arrays)
+# arg3 = import/split job script
+# arg4+ = job scripts that depend on the import/split job
+
+echo Switching to directory: ${arguments[0]}
+cd ${arguments[0]} || exit 1
+
+tar -xf ${arguments[1]} || exit 1
+
+# Hold the first job until the whole chain is submitted so a partial
+# submission can be cancelled before anything runs.
+split_jobid=$(sbatch --parsable --hold --account=rrg-eros-ab ${arguments[3]}) || exit 1
+split_jobid=${split_jobid%%;*}
+
+jobids=(${split_jobid})
+
+for script in "${arguments[@]:4}"; do
+    jobid=$(sbatch --parsable --account=rrg-eros-ab --dependency=${arguments[2]}:${split_jobid} ${script})
+    if [ $? -ne 0 ]; then
+        echo Failed to submit ${script}. Cancelling jobs: ${jobids[@]} >&2
+        scancel ${jobids[@]}
+        exit 1
+    fi
+    jobids+=(${jobid%%;*})
+done
+
+if ! scontrol release ${split_jobid}; then
+    echo Failed to release job ${split_jobid}. Cancelling jobs: ${jobids[@]} >&2
+    scancel ${jobids[@]}
+    exit 1
+fi
+
+echo Submitted jobs: ${jobids[@]}
@@ -0,0 +1,211 @@
+'''
+Submit the re-reduction of many tracks at once as slurm job arrays.
+
+The tracks are listed in a manifest file, one "TARGET CONFIG TRACKNAME" line per
+track. Each job template is submitted once as a job array and each array task
+reads its track from the manifest using SLURM_ARRAY_TASK_ID. The pipeline
+array depends on the import/split array with `aftercorr`, so each track's
+pipeline job starts as soon as its own split job finishes.
+'''
+
+import tarfile
+from pathlib import Path
+from datetime import datetime
+
+from .cluster_configs import JOB_CREATION_FUNCTIONS, ENDPOINT_INFO
+from .gsheet_tracker.gsheet_functions import update_cells, update_track_status
+from .ssh_utils import run_command, setup_ssh_connection
+from .submission_journal import reserve_submission, record_submission
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+# Job creation function, sheet column of the job ID and journal job type for
+# each data type.
+CAMPAIGN_JOB_INFO = {'continuum': ('CONTINUUM_PIPE', "Continuum job ID",
+                                   'continuum_pipeline_default'),
+                     'speclines': ('LINE_PIPE', "Line job ID",
+                                   'line_pipeline_default')}
+
+
+def write_campaign_manifest(auto_pipes, filename):
+    '''
+    Write the manifest of tracks for a job array. Line N is the track for
+    array task N.
+    '''
+
+    with open(filename, 'w') as f:
+        for auto_pipe in auto_pipes:
+            target_name, config, trackname = auto_pipe.track_folder_name.split('_')[:3]
+            f.write(f"{target_name} {config} {trackname}\n")
+
+
+async def campaign_job_submission(auto_pipes,
+                                  data_type='continuum',
+                                  campaign_name=None,
+                                  clustername='cc-cedar',
+                                  scripts_dir=Path('reduction_job_scripts/'),
+                                  reindex=False,
+                                  casa_version="6.2",
+                                  split_time=None,
+                                  pipeline_time=None,
+                                  split_mem=None,
+                                  pipeline_mem=None,
+                                  max_running_tasks=None,
+                                  pipeline_branch='main'):
+    '''
+    Re-run the import/split and pipeline for many tracks with two job arrays.
+
+    Each track is prepared as in `AutoPipeline.rerun_job_submission`. The array job
+    scripts and the manifest are moved to the cluster in one transfer and both
+    arrays are submitted with one call to the bundle submission robot.
+
+    Parameters
+    ----------
+    auto_pipes : list of AutoPipeline
+        Tracks with a RESTART requested for `data_type`.
+    data_type : str, optional
+        'continuum' or 'speclines'.
+    campaign_name : str, optional
+        Name used for the manifest and job scripts. Defaults to one with the
+        data type and the current time.
+    max_running_tasks : int, optional
+        Limit on the number of array tasks running at once.
+
+    Returns
+    -------
+    auto_pipes : list of AutoPipeline
+        The tracks that were submitted.
+    '''
+
+    if data_type not in CAMPAIGN_JOB_INFO:
+        raise ValueError(f"Unknown data_type passed: {data_type}")
+
+    if campaign_name is None:
+        campaign_name = f"campaign_{data_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    # Clean up and setup each track. Skip tracks without a RESTART requested.
+    submit_pipes = []
+    for auto_pipe in auto_pipes:
+        is_restart = await auto_pipe.rerun_job_submission(clustername=clustername,
+                                                          data_type=data_type,
+                                                          pipeline_branch=pipeline_branch,
+                                                          submit_jobs=False)
+        if is_restart:
+            submit_pipes.append(auto_pipe)
+
+    if len(submit_pipes) == 0:
+        log.info(f"No tracks to submit for {campaign_name}")
+        return []
+
+    log.info(f"Submitting {len(submit_pipes)} tracks as job arrays in {campaign_name}")
+
+    campaign_dir = scripts_dir / campaign_name
+    if not campaign_dir.exists():
+        campaign_dir.mkdir(parents=True)
+
+    data_path = ENDPOINT_INFO[clustername]["data_path"]
+
+    manifest_filename = f"{campaign_name}_manifest.txt"
+    write_campaign_manifest(submit_pipes, campaign_dir / manifest_filename)
+
+    array_str = f"0-{len(submit_pipes) - 1}"
+    if max_running_tasks is not None:
+        array_str += f"%{max_running_tasks}"
+
+    # Request enough for the largest track.
+    data_sizes = [auto_pipe.data_size for auto_pipe in submit_pipes
+                  if auto_pipe.data_size is not None]
+    data_size = max(data_sizes) if len(data_sizes) > 0 else None
+
+    pipeline_func, pipeline_colname, pipeline_job_type = CAMPAIGN_JOB_INFO[data_type]
+
+    # Each array task is a new submission attempt for its track.
+    entries = [(reserve_submission(auto_pipe.ebid, 'import_and_split', new_attempt=True),
+                reserve_submission(auto_pipe.ebid, pipeline_job_type, new_attempt=True))
+               for auto_pipe in submit_pipes]
+
+    job_info = [(f"{campaign_name}_job_import_and_split.sh", 'IMPORT_SPLIT',
+                 {'job_time': split_time, 'mem': split_mem},
+                 {'split_type': data_type, 'reindex': reindex}),
+                (f"{campaign_name}_job_{data_type}.sh", pipeline_func,
+                 {'job_time': pipeline_time, 'mem': pipeline_mem},
+                 {})]
+
+    for job_filename, job_func, slurm_kwargs, job_kwargs in job_info:
+
+        slurm_kwargs = {key: val for key, val in slurm_kwargs.items() if val is not None}
+        slurm_kwargs['job_name'] = campaign_name
+        slurm_kwargs['array'] = array_str
+
+        with open(campaign_dir / job_filename, 'w') as f:
+            print(JOB_CREATION_FUNCTIONS[clustername][job_func](
+                    slurm_kwargs=slurm_kwargs,
+                    setup_kwargs={},
+                    casa_version=casa_version,
+                    data_size=data_size,
+                    array_manifest=f"/home/ekoch/{data_path}/{manifest_filename}",
+                    **job_kwargs),
+                file=f)
+
+    bundle_filename = f"{campaign_name}_job_bundle.tar"
+
+    with tarfile.open(campaign_dir / bundle_filename, 'w') as tar:
+        tar.add(campaign_dir / manifest_filename, arcname=manifest_filename)
+        for info in job_info:
+            tar.add(campaign_dir / info[0], arcname=info[0])
+
+    cluster_key = "cedar-robot-generic"
+
+    log.info(f"Moving {bundle_filename} to {cluster_key}")
+    connect = setup_ssh_connection(cluster_key)
+    connect.put(campaign_dir / bundle_filename, remote=f'{data_path}/')
+    connect.close()
+
+    cluster_key_submit = 'cedar-bundle-submitter'
+
+    # Each pipeline array task depends on the same import/split array task.
+    submit_args = [f'{data_path}/', bundle_filename, 'aftercorr'] + [info[0] for info in job_info]
+
+    connect_submit = setup_ssh_connection(cluster_key_submit)
+    try:
+        result = run_command(connect_submit, " ".join(submit_args))
+    except ValueError as exc:
+        raise ValueError(f"Failed to submit job arrays for {campaign_name}! {exc}")
+    finally:
+        connect_submit.close()
+
+    # Last line is "Submitted jobs: SPLITID PIPELINEID"
+    jobids = result.stdout.strip().split("\n")[-1].split(":")[-1].split()
+
+    if len(jobids) != len(job_info):
+        raise ValueError(f"Unable to parse job IDs for {campaign_name} from: {result.stdout}")
+
+    split_jobid, pipeline_jobid = jobids
+
+    log.info(f"Submitted {campaign_name} as job arrays {split_jobid} and {pipeline_jobid}")
+
+    # Array task IDs are recorded in the sheet as CLUSTERNAME:ARRAYID_TASKID
+    for task_id, (auto_pipe, (split_entry, pipeline_entry)) in enumerate(zip(submit_pipes, entries)):
+
+        record_submission(split_entry['Token'], f"{split_jobid}_{task_id}")
+        record_submission(pipeline_entry['Token'], f"{pipeline_jobid}_{task_id}")
+
+        auto_pipe.importsplit_jobid = f"{split_jobid}_{task_id}"
+        if data_type == 'continuum':
+            auto_pipe.continuum_jobid = f"{pipeline_jobid}_{task_id}"
+        else:
+            auto_pipe.line_jobid = f"{pipeline_jobid}_{task_id}"
+
+        update_cells(auto_pipe.ebid,
+                     {"Split Job ID": f"{clustername}:{split_jobid}_{task_id}",
+                      pipeline_colname: f"{clustername}:{pipeline_jobid}_{task_id}"},
+                     sheetname=auto_pipe.sheetname)
+
+        update_track_status(auto_pipe.ebid,
+                            message=f"Reduction running on {clustername} after QA check",
+                            sheetname=auto_pipe.sheetname,
+                            status_col=1 if data_type == 'continuum' else 2)
+
+    return submit_pipes
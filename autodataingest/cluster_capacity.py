@@ -0,0 +1,277 @@
+'''
+Admission control for starting new tracks on the cluster.
+
+The scratch quota and the job queue are sampled at most once per `ttl` and
+shared by all checks. Each admitted track reserves its projected scratch
+footprint, so tracks that are still staging or splitting are accounted for
+before their data lands on scratch. Once data lands it is counted in the quota
+sample, so the reservation shrinks by the size of the transferred data (see
+`shrink_capacity`) and is released when the split has finished or the track
+is removed from scratch.
+
+Restarts of tracks that are already on scratch do not reserve storage.
+'''
+
+import os
+import time
+import sqlite3
+from datetime import datetime
+import astropy.units as u
+
+from .job_monitor import (get_slurm_queue, number_of_active_jobs,
+                          get_lustre_storage_avail)
+from .ssh_utils import setup_ssh_connection
+from .cluster_configs import local_db_path
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+CLUSTER_CAPACITY_DB = local_db_path('cluster_capacity.db')
+
+
+def _connect_db(db_path):
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    conn = sqlite3.connect(db_path)
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS reservations (
+                    EBID INTEGER PRIMARY KEY, Storage_TB REAL, NumFiles REAL,
+                    Created TEXT)''')
+
+    return conn
+
+
+def release_capacity(ebid, db_path=CLUSTER_CAPACITY_DB):
+    '''
+    Release the scratch reservation of a track.
+    '''
+
+    with _connect_db(db_path) as conn:
+        conn.execute("DELETE FROM reservations WHERE EBID = ?", (int(ebid),))
+    conn.close()
+
+    log.info(f"Released scratch reservation for {ebid}")
+
+
+def shrink_capacity(ebid, storage, numfiles=0, db_path=CLUSTER_CAPACITY_DB):
+    '''
+    Reduce the scratch reservation of a track by data that is now on scratch.
+
+    Parameters
+    ----------
+    storage : astropy.units.Quantity
+        Storage that has landed on scratch.
+    numfiles : int, optional
+        Number of files that have landed on scratch.
+    '''
+
+    with _connect_db(db_path) as conn:
+        conn.execute('''UPDATE reservations SET
+                        Storage_TB = MAX(Storage_TB - ?, 0),
+                        NumFiles = MAX(NumFiles - ?, 0)
+                        WHERE EBID = ?''',
+                     (storage.to(u.TB).value, numfiles, int(ebid)))
+    conn.close()
+
+    log.info(f"Reduced scratch reservation for {ebid} by {storage.to(u.TB):.2f}")
+
+
+class ClusterCapacityGate(object):
+    '''
+    Decide whether new tracks can start on the cluster.
+
+    Parameters
+    ----------
+    min_storage : astropy.units.Quantity, optional
+        Free scratch space to keep after the reservations.
+    min_numfiles : int, optional
+        Number of free files to keep after the reservations.
+    max_numjobs : int, optional
+        Maximum number of pending and running jobs.
+    ttl : float, optional
+        Time in seconds to reuse a quota and queue sample.
+    storage_per_datasize : float, optional
+        Scratch footprint of a new track relative to its data size. This covers the
+        SDM tar file, the SDM and the split continuum and line MSs.
+    files_per_track : int, optional
+        Projected number of files for each track.
+    default_data_size : float, optional
+        Data size in GB to assume when the sheet does not give one.
+    '''
+
+    def __init__(self, min_storage=3 * u.TB, min_numfiles=1e5, max_numjobs=35,
+                 ttl=900,
+                 storage_per_datasize=4.,
+                 files_per_track=2e4,
+                 default_data_size=100.,
+                 diskname='/scratch',
+                 db_path=CLUSTER_CAPACITY_DB):
+
+        self.min_storage = min_storage.to(u.TB)
+        self.min_numfiles = min_numfiles
+        self.max_numjobs = max_numjobs
+
+        self.ttl = ttl
+
+        self.storage_per_datasize = storage_per_datasize
+        self.files_per_track = files_per_track
+        self.default_data_size = default_data_size
+
+        self.diskname = diskname
+        self.db_path = db_path
+
+        self._sample = None
+        self._sample_time = None
+
+        # Jobs admitted since the last queue sample.
+        self._admitted_jobs = 0
+
+    def sample(self, force=False):
+        '''
+        Return the free scratch space, free file number and number of active jobs.
+        The values are cached for `ttl` seconds.
+        '''
+
+        if not force and self._sample is not None and \
+                (time.time() - self._sample_time) < self.ttl:
+            return self._sample
+
+        connect = setup_ssh_connection('cedar-robot-queuestatus')
+        num_jobs_active = number_of_active_jobs(get_slurm_queue(connect))
+        connect.close()
+
+        connect = setup_ssh_connection('cedar-robot-lfsquota')
+        free_space, free_filenum = get_lustre_storage_avail(connect,
+                                                            diskname=self.diskname)
+        connect.close()
+
+        log.info(f"Free storage: {free_space} Free file num: {free_filenum} "
+                 f"Active jobs: {num_jobs_active}")
+
+        self._sample = (free_space, free_filenum, num_jobs_active)
+        self._sample_time = time.time()
+        self._admitted_jobs = 0
+
+        return self._sample
+
+    def projected_footprint(self, data_size=None, new_track=True):
+        '''
+        Projected scratch storage and file number for a track with `data_size` in GB.
+        Restarts reuse the data already on scratch and have no projected footprint.
+        '''
+
+        if not new_track:
+            return 0 * u.TB, 0
+
+        if data_size is None:
+            data_size = self.default_data_size
+
+        return (data_size * self.storage_per_datasize * u.GB).to(u.TB), self.files_per_track
+
+    def reserved(self):
+        '''
+        Total reserved storage and file number.
+        '''
+
+        with _connect_db(self.db_path) as conn:
+            storage, numfiles = conn.execute('''SELECT COALESCE(SUM(Storage_TB), 0),
+                                                COALESCE(SUM(NumFiles), 0)
+                                                FROM reservations''').fetchone()
+        conn.close()
+
+        return storage * u.TB, numfiles
+
+    def available(self):
+        '''
+        Free storage, file number and job slots after the reservations.
+        '''
+
+        free_space, free_filenum, num_jobs_active = self.sample()
+
+        reserved_space, reserved_filenum = self.reserved()
+
+        return (free_space - reserved_space - self.min_storage,
+                free_filenum - reserved_filenum - self.min_numfiles,
+                self.max_numjobs - num_jobs_active - self._admitted_jobs)
+
+    def has_capacity(self):
+        '''
+        Check if any new jobs can start.
+        '''
+
+        avail_space, avail_filenum, avail_jobs = self.available()
+
+        return (avail_space >= 0 * u.TB) & (avail_filenum >= 0) & (avail_jobs > 0)
+
+    def admit(self, ebid, data_size=None, num_jobs=3, new_track=True):
+        '''
+        Check if a track fits on the cluster and, if so, reserve its projected
+        footprint. Restarts only need job slots and do not reserve storage.
+
+        Parameters
+        ----------
+        ebid : int
+            EBID of the track.
+        data_size : float, optional
+            Data size of the track in GB.
+        num_jobs : int, optional
+            Number of jobs the track will submit.
+        new_track : bool, optional
+            False for restarts of tracks that are already on scratch.
+
+        Returns
+        -------
+        is_admitted : bool
+        '''
+
+        avail_space, avail_filenum, avail_jobs = self.available()
+
+        storage, numfiles = self.projected_footprint(data_size=data_size,
+                                                     new_track=new_track)
+
+        with _connect_db(self.db_path) as conn:
+            prev = conn.execute("SELECT Storage_TB, NumFiles FROM reservations WHERE EBID = ?",
+                                (int(ebid),)).fetchone()
+        conn.close()
+
+        # Only the difference from an existing reservation is needed.
+        if prev is not None:
+            storage = max(storage - prev[0] * u.TB, 0 * u.TB)
+            numfiles = max(numfiles - prev[1], 0)
+
+        if storage > avail_space or numfiles > avail_filenum or num_jobs > avail_jobs:
+            log.info(f"Not admitting {ebid}. Needs {storage:.2f}, {numfiles} files and "
+                     f"{num_jobs} jobs. Available: {avail_space:.2f}, {avail_filenum} files "
+                     f"and {avail_jobs} jobs.")
+            return False
+
+        if not new_track:
+            self._admitted_jobs += num_jobs
+
+            log.info(f"Admitted restart of {ebid} with {num_jobs} jobs.")
+
+            return True
+
+        with _connect_db(self.db_path) as conn:
+            conn.execute('''INSERT INTO reservations VALUES (?, ?, ?, ?)
+                            ON CONFLICT(EBID) DO UPDATE SET
+                            Storage_TB = Storage_TB + excluded.Storage_TB,
+                            NumFiles = NumFiles + excluded.NumFiles''',
+                         (int(ebid), storage.to(u.TB).value, numfiles,
+                          datetime.now().isoformat()))
+        conn.close()
+
+        self._admitted_jobs += num_jobs
+
+        log.info(f"Admitted {ebid} with {storage:.2f}, {numfiles} files and {num_jobs} jobs.")
+
+        return True
+
+    def release(self, ebid):
+        '''
+        Release the reservation of a track.
+        '''
+
+        release_capacity(ebid, db_path=self.db_path)
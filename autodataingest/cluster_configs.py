@@ -4,11 +4,29 @@ These are dictionaries containing the info required about the clusters
 that are used to do the reduction and to produce job scripts.
 '''
 
+import os
+
 import autodataingest.job_templates.job_import_and_merge as jobs_import
 import autodataingest.job_templates.job_continuum_pipeline as jobs_continuum
 import autodataingest.job_templates.job_line_pipeline as jobs_line
 
 
+# Folder for the local sqlite stores (job accounting, scratch reservations,
+# submission journal, transfer metrics and the notification index). The
+# stores are shared by all of the main*.py scripts, wherever they are run from.
+LOCAL_DB_DIR = os.path.expanduser(os.environ.get("AUTODATAINGEST_DB_DIR",
+                                                 "~/.autodataingest"))
+
+
+def local_db_path(filename):
+    '''
+    Absolute path of a local sqlite store in `LOCAL_DB_DIR`. The folder is
+    made when the store is first opened.
+    '''
+
+    return os.path.join(LOCAL_DB_DIR, filename)
+
+
 # Add new locations here so we can refer to each location by 1 name:
 ENDPOINT_INFO = {'cc-cedar': {'endpoint_id': "8dec4129-9ab4-451d-a45f-5b4b8471f7a3",
                            'data_path': "scratch/rrg-eros-ab/ekoch/VLAXL/VLAXL_reduction/"},
@@ -32,8 +50,10 @@ JOB_CREATION_FUNCTIONS = \
 
 CLUSTERADDRS = \
     {'cedar-submitter': 'cedar-submitter',
+     'cedar-bundle-submitter': 'cedar-bundle-submitter',
      'cedar-robot-generic': 'cedar-robot-generic',
      'cedar-robot-jobsetup': 'cedar-robot-jobsetup',
      'cedar-robot-jobstatus': 'cedar-robot-jobstatus',
+     'cedar-robot-queuestatus': 'cedar-robot-queuestatus',
      'cedar-robot-lfsquota': 'cedar-robot-lfsquota',
      }
@@ -0,0 +1,395 @@
+'''
+Local index of the archive and job notification emails.
+
+Each message is downloaded and parsed once into a record keyed by the EBID
+(archive notifications) or job ID (job notifications). After the first full
+sync of a label, only messages added since the last seen Gmail historyId are
+fetched.
+'''
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import ezgmail
+from googleapiclient.errors import HttpError
+
+from ..cluster_configs import local_db_path
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+NOTIFICATION_INDEX_DB = local_db_path('notification_index.db')
+
+# ezgmail.SERVICE_GMAIL is shared and not thread-safe. Syncs run from the
+# notification watcher's executor thread and from the event loop thread.
+_GMAIL_LOCK = threading.RLock()
+
+NOTIFICATION_COLUMNS = ['MessageID', 'Label', 'Kind', 'Key', 'Status', 'Runtime',
+                        'Path', 'MSName', 'Subject', 'Timestamp', 'IsRead']
+
+# SDM names are PROJECT.sbNUM.ebNUM.MJD
+EBID_PATTERN = re.compile(r"\.eb(\d+)\.")
+
+# Slurm subjects start with e.g. "Slurm Job_id=1234 Name=..." or
+# "Slurm Array Task Job_id=1234_5 (1240) Name=...". Array tasks are keyed
+# by their raw job ID (1240), as in sacct's JobIDRaw.
+JOBID_PATTERN = re.compile(r"Job_id=(\d+)(?:_\d+ \((\d+)\))?")
+
+
+def parse_archive_message(body, project_id):
+    '''
+    Return the EBID, path and MS name from an archive notification.
+    '''
+
+    from .receive_gmail_notifications import extract_path_and_name
+
+    if "ftp://ftp.aoc.nrao.edu/" not in body:
+        return None, None, None
+
+    path_to_data, ms_name = extract_path_and_name(body, project_id)
+
+    match = EBID_PATTERN.search(ms_name)
+
+    return (None if match is None else match.group(1)), path_to_data, ms_name
+
+
+def parse_job_message(subject):
+    '''
+    Return the job ID, status and run time from a slurm notification subject.
+    '''
+
+    match = JOBID_PATTERN.search(subject)
+    jobid = None if match is None else (match.group(2) or match.group(1))
+
+    jobinfo = subject.split(",")
+
+    if len(jobinfo) < 3:
+        return jobid, None, None
+
+    status = jobinfo[2].replace(' ', '')
+
+    runtime = jobinfo[1].split(" ")[-1]
+
+    return jobid, status, runtime
+
+
+class NotificationIndex(object):
+    '''
+    sqlite index of the notification messages.
+
+    Parameters
+    ----------
+    db_path : str, optional
+        Local sqlite file for the index.
+    project_id : str, optional
+        Project ID used to find the MS names in archive notifications.
+    '''
+
+    def __init__(self, db_path=NOTIFICATION_INDEX_DB, project_id="20A-346"):
+
+        self.db_path = db_path
+        self.project_id = project_id
+
+        self._label_ids = None
+
+    def _connect_db(self):
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS messages (
+                        MessageID TEXT PRIMARY KEY, Label TEXT, Kind TEXT, Key TEXT,
+                        Status TEXT, Runtime TEXT, Path TEXT, MSName TEXT,
+                        Subject TEXT, Timestamp TEXT, IsRead INTEGER)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_messages_key
+                        ON messages (Kind, Key)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                        Label TEXT PRIMARY KEY, HistoryID TEXT, Updated TEXT)''')
+
+        return conn
+
+    def index_message(self, message_id, label, kind, subject, body, timestamp,
+                      is_read=False):
+        '''
+        Parse a message and add it to the index.
+
+        Returns
+        -------
+        record : dict
+        '''
+
+        record = dict(MessageID=message_id, Label=label, Kind=kind, Key=None,
+                      Status=None, Runtime=None, Path=None, MSName=None,
+                      Subject=subject, Timestamp=timestamp.isoformat(),
+                      IsRead=int(is_read))
+
+        if kind == 'archive':
+            record['Key'], record['Path'], record['MSName'] = \
+                parse_archive_message(body, self.project_id)
+        elif kind == 'job':
+            record['Key'], record['Status'], record['Runtime'] = parse_job_message(subject)
+        else:
+            raise ValueError(f"Unknown notification kind {kind}")
+
+        with self._connect_db() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO messages VALUES "
+                         f"({','.join(['?'] * len(NOTIFICATION_COLUMNS))})",
+                         [record[col] for col in NOTIFICATION_COLUMNS])
+        conn.close()
+
+        return record
+
+    def _has_message(self, conn, message_id):
+        return conn.execute("SELECT 1 FROM messages WHERE MessageID = ?",
+                            (message_id,)).fetchone() is not None
+
+    def _label_id(self, labelname):
+
+        if self._label_ids is None:
+            labels = ezgmail.SERVICE_GMAIL.users().labels().list(userId='me').execute()
+            self._label_ids = {label['name']: label['id'] for label in labels['labels']}
+
+        if labelname not in self._label_ids:
+            raise ValueError(f"Cannot find the gmail label {labelname}")
+
+        return self._label_ids[labelname]
+
+    def _fetch_message(self, message_id, labelname, kind):
+
+        message_obj = ezgmail.SERVICE_GMAIL.users().messages().get(userId='me',
+                                                                   id=message_id).execute()
+        message = ezgmail.GmailMessage(message_obj)
+
+        self.index_message(message_id, labelname, kind,
+                           getattr(message, 'subject', ''),
+                           getattr(message, 'originalBody', ''),
+                           message.timestamp,
+                           is_read='UNREAD' not in message_obj.get('labelIds', []))
+
+        return message_obj['historyId']
+
+    def _new_message_ids(self, label_id, history_id):
+        '''
+        IDs of the messages added to a label since `history_id`.
+        '''
+
+        message_ids = []
+        page_token = None
+
+        while True:
+            response = ezgmail.SERVICE_GMAIL.users().history().list(
+                userId='me', startHistoryId=history_id, labelId=label_id,
+                historyTypes=['messageAdded', 'labelAdded'],
+                pageToken=page_token).execute()
+
+            for record in response.get('history', []):
+                for change in record.get('messagesAdded', []) + record.get('labelsAdded', []):
+                    message_ids.append(change['message']['id'])
+
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+
+        return message_ids, response['historyId']
+
+    def _all_message_ids(self, label_id):
+
+        message_ids = []
+        page_token = None
+
+        while True:
+            response = ezgmail.SERVICE_GMAIL.users().messages().list(
+                userId='me', labelIds=[label_id], pageToken=page_token).execute()
+
+            message_ids.extend([message['id'] for message in response.get('messages', [])])
+
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+
+        return message_ids
+
+    def sync(self, labelname, kind, **kwargs):
+        '''
+        Add the messages on a gmail label that are not indexed yet. `kwargs` are
+        passed to `do_authentication_gmail`. Only one sync runs at a time.
+
+        Returns
+        -------
+        num_new : int
+            Number of messages added to the index.
+        '''
+
+        with _GMAIL_LOCK:
+            return self._sync(labelname, kind, **kwargs)
+
+    def _sync(self, labelname, kind, **kwargs):
+
+        from .receive_gmail_notifications import do_authentication_gmail
+
+        if ezgmail.SERVICE_GMAIL is None and not do_authentication_gmail(**kwargs):
+            raise ValueError("Cannot login with ezgmail. Check credentials.")
+
+        label_id = self._label_id(labelname)
+
+        with self._connect_db() as conn:
+            row = conn.execute("SELECT HistoryID FROM sync_state WHERE Label = ?",
+                               (labelname,)).fetchone()
+        conn.close()
+
+        history_id = None
+        message_ids = None
+
+        if row is not None:
+            try:
+                message_ids, history_id = self._new_message_ids(label_id, row['HistoryID'])
+            except HttpError as exc:
+                # Gmail only keeps the history for about a week.
+                if exc.resp.status != 404:
+                    raise
+                log.info(f"History for {labelname} expired. Running a full sync.")
+
+        if message_ids is None:
+            history_id = ezgmail.SERVICE_GMAIL.users().getProfile(userId='me').execute()['historyId']
+            message_ids = self._all_message_ids(label_id)
+
+        with self._connect_db() as conn:
+            message_ids = [message_id for message_id in dict.fromkeys(message_ids)
+                           if not self._has_message(conn, message_id)]
+        conn.close()
+
+        for message_id in message_ids:
+            self._fetch_message(message_id, labelname, kind)
+
+        with self._connect_db() as conn:
+            conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                         (labelname, str(history_id), datetime.now().isoformat()))
+        conn.close()
+
+        if len(message_ids) > 0:
+            log.info(f"Indexed {len(message_ids)} new messages from {labelname}")
+
+        return len(message_ids)
+
+    def lookup(self, kind, keys, labelname=None):
+        '''
+        Latest indexed record for each key.
+
+        Parameters
+        ----------
+        kind : str
+            'archive' or 'job'.
+        keys : list of str
+            EBIDs or job IDs.
+
+        Returns
+        -------
+        records : dict
+            Record for each key found in the index.
+        '''
+
+        keys = [str(key) for key in keys]
+
+        if len(keys) == 0:
+            return {}
+
+        query = (f"SELECT * FROM messages WHERE Kind = ? AND "
+                 f"Key IN ({','.join(['?'] * len(keys))})")
+        params = [kind] + keys
+
+        if labelname is not None:
+            query += " AND Label = ?"
+            params.append(labelname)
+
+        query += " ORDER BY Timestamp"
+
+        with self._connect_db() as conn:
+            rows = conn.execute(query, params).fetchall()
+        conn.close()
+
+        # Later messages replace earlier ones.
+        return {row['Key']: dict(row) for row in rows}
+
+    def has_message(self, message_id):
+        '''
+        Check if a message is in the index.
+        '''
+
+        with self._connect_db() as conn:
+            found = self._has_message(conn, message_id)
+        conn.close()
+
+        return found
+
+    def last_rowid(self):
+        '''
+        Row ID of the latest indexed message.
+        '''
+
+        with self._connect_db() as conn:
+            rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages").fetchone()[0]
+        conn.close()
+
+        return rowid
+
+    def records_after(self, rowid):
+        '''
+        Records indexed after `rowid`, in the order they were added.
+
+        Returns
+        -------
+        records : list of dict
+        last_rowid : int
+        '''
+
+        with self._connect_db() as conn:
+            rows = conn.execute("SELECT rowid, * FROM messages WHERE rowid > ? ORDER BY rowid",
+                                (rowid,)).fetchall()
+        conn.close()
+
+        if len(rows) == 0:
+            return [], rowid
+
+        return [dict(row) for row in rows], rows[-1]['rowid']
+
+    def mark_as_read(self, message_ids):
+        '''
+        Mark messages as read in gmail and in the index.
+        '''
+
+        message_ids = list(message_ids)
+
+        if len(message_ids) == 0:
+            return
+
+        if ezgmail.SERVICE_GMAIL is not None:
+            with _GMAIL_LOCK:
+                ezgmail.SERVICE_GMAIL.users().messages().batchModify(
+                    userId='me', body={'ids': message_ids, 'removeLabelIds': ['UNREAD']}).execute()
+
+        with self._connect_db() as conn:
+            conn.executemany("UPDATE messages SET IsRead = 1 WHERE MessageID = ?",
+                             [(message_id,) for message_id in message_ids])
+        conn.close()
+
+
+_NOTIFICATION_INDEX = None
+
+
+def get_notification_index():
+    '''
+    Return the shared notification index.
+    '''
+
+    global _NOTIFICATION_INDEX
+
+    if _NOTIFICATION_INDEX is None:
+        _NOTIFICATION_INDEX = NotificationIndex()
+
+    return _NOTIFICATION_INDEX
@@ -0,0 +1,304 @@
+'''
+Watch for new notification emails and turn them into events.
+
+The watcher syncs its sources into the `NotificationIndex` every `interval`
+seconds (the Gmail history API makes this cheap) and dispatches the new
+records as `NotificationEvent`s. Pipeline stages can await the archive or
+job notification they need instead of re-scanning the mailbox.
+
+`MaildirSource` reads a local maildir and can stand in for Gmail in tests.
+'''
+
+import asyncio
+import mailbox
+from collections import namedtuple
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from .notification_index import get_notification_index
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+ARCHIVE_LABEL = 'Telescope Notifications/20A-346 Archive Notifications'
+JOB_LABEL = 'Telescope Notifications/20A-346 Cedar Jobs'
+
+# kind is 'archive' or 'job'. key is the EBID or job ID.
+NotificationEvent = namedtuple('NotificationEvent',
+                               ['kind', 'key', 'status', 'runtime', 'path', 'ms_name',
+                                'timestamp', 'message_id'])
+
+
+def _record_to_event(record):
+
+    return NotificationEvent(kind=record['Kind'], key=record['Key'],
+                             status=record['Status'], runtime=record['Runtime'],
+                             path=record['Path'], ms_name=record['MSName'],
+                             timestamp=datetime.fromisoformat(record['Timestamp']),
+                             message_id=record['MessageID'])
+
+
+class GmailHistorySource(object):
+    '''
+    Sync a gmail label into the index.
+    '''
+
+    def __init__(self, labelname, kind):
+
+        self.labelname = labelname
+        self.kind = kind
+
+    def sync(self, index):
+        return index.sync(self.labelname, self.kind)
+
+
+class MaildirSource(object):
+    '''
+    Index the messages in a local maildir.
+
+    Parameters
+    ----------
+    path : str
+        Path to the maildir.
+    kind : str
+        'archive' or 'job'.
+    '''
+
+    def __init__(self, path, kind):
+
+        self.path = path
+        self.kind = kind
+
+    def sync(self, index):
+
+        num_new = 0
+
+        for key, message in mailbox.Maildir(self.path, create=False).iteritems():
+
+            message_id = f"maildir:{key}"
+
+            if index.has_message(message_id):
+                continue
+
+            if message.is_multipart():
+                parts = [part for part in message.walk()
+                         if part.get_content_type() == 'text/plain']
+                body = parts[0].get_payload(decode=True).decode() if len(parts) > 0 else ""
+            else:
+                body = message.get_payload(decode=True).decode()
+
+            if message['Date'] is not None:
+                timestamp = parsedate_to_datetime(message['Date']).astimezone().replace(tzinfo=None)
+            else:
+                timestamp = datetime.now()
+
+            index.index_message(message_id, self.path, self.kind,
+                                message['Subject'] or "", body, timestamp)
+
+            num_new += 1
+
+        return num_new
+
+
+class NotificationWatcher(object):
+    '''
+    Poll the notification sources and dispatch the new messages as events.
+
+    Parameters
+    ----------
+    sources : list
+        `GmailHistorySource` or `MaildirSource` instances.
+    index : NotificationIndex, optional
+        Defaults to the shared index.
+    interval : float, optional
+        Time in seconds between syncs.
+    '''
+
+    def __init__(self, sources, index=None, interval=30):
+
+        self.sources = list(sources)
+        self.index = get_notification_index() if index is None else index
+        self.interval = interval
+
+        # Only messages indexed after this become events.
+        self._last_rowid = self.index.last_rowid()
+
+        self._loop = None
+        self._runner = None
+        self._waiters = []
+        self._subscribers = []
+
+    def _check_loop(self):
+
+        loop = asyncio.get_running_loop()
+
+        if loop is not self._loop:
+            self._loop = loop
+            self._runner = None
+            self._waiters = []
+            self._subscribers = []
+
+        if self._runner is None or self._runner.done():
+            self._runner = self._loop.create_task(self.run())
+
+    def poll(self):
+        '''
+        Sync all sources and return the new events.
+        '''
+
+        for source in self.sources:
+            try:
+                source.sync(self.index)
+            except Exception:
+                log.exception(f"Failed to sync notifications from {source}.")
+
+        records, self._last_rowid = self.index.records_after(self._last_rowid)
+
+        return [_record_to_event(record) for record in records if record['Key'] is not None]
+
+    def _dispatch(self, events):
+
+        for event in events:
+
+            log.info(f"Notification event: {event.kind} {event.key} {event.status}")
+
+            for queue in self._subscribers:
+                queue.put_nowait(event)
+
+            for waiter in list(self._waiters):
+                match_func, future = waiter
+
+                if future.done():
+                    self._waiters.remove(waiter)
+                elif match_func(event):
+                    future.set_result(event)
+                    self._waiters.remove(waiter)
+
+    async def run(self):
+        '''
+        Sync the sources every `interval` while there is someone waiting.
+        '''
+
+        while True:
+
+            # Drop waiters that timed out or were cancelled.
+            self._waiters = [waiter for waiter in self._waiters if not waiter[1].done()]
+
+            if len(self._waiters) == 0 and len(self._subscribers) == 0:
+                break
+
+            events = await self._loop.run_in_executor(None, self.poll)
+
+            self._dispatch(events)
+
+            await asyncio.sleep(self.interval)
+
+    def subscribe(self):
+        '''
+        Return a queue that receives every new event.
+        '''
+
+        self._check_loop()
+
+        queue = asyncio.Queue()
+
+        self._subscribers.append(queue)
+
+        return queue
+
+    def unsubscribe(self, queue):
+
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    async def wait_for(self, kind, key=None, statuses=None, finished_only=False,
+                       since=None, timeout=None):
+        '''
+        Wait for a notification.
+
+        Parameters
+        ----------
+        kind : str
+            'archive' or 'job'.
+        key : str or int, optional
+            EBID or job ID. If None, any notification of this kind matches.
+        statuses : list of str, optional
+            Job states to wait for, e.g. ['COMPLETED', 'FAILED', 'TIMEOUT'].
+        finished_only : bool, optional
+            Skip job notifications without a state, i.e., job start messages.
+        since : datetime, optional
+            Also match notifications already in the index that are newer than this.
+        timeout : float, optional
+            Raise `asyncio.TimeoutError` after this many seconds.
+
+        Returns
+        -------
+        event : NotificationEvent
+        '''
+
+        def match_func(event):
+            if event.kind != kind:
+                return False
+            if key is not None and event.key != str(key):
+                return False
+            if statuses is not None and event.status not in statuses:
+                return False
+            if finished_only and event.status is None:
+                return False
+            return since is None or event.timestamp >= since
+
+        if since is not None and key is not None:
+            record = self.index.lookup(kind, [key]).get(str(key))
+            if record is not None and match_func(_record_to_event(record)):
+                return _record_to_event(record)
+
+        self._check_loop()
+
+        future = self._loop.create_future()
+        self._waiters.append((match_func, future))
+
+        return await asyncio.wait_for(future, timeout)
+
+    async def wait_for_archive(self, ebid, since=None, timeout=None):
+        '''
+        Wait for the archive notification of an EBID.
+        '''
+
+        return await self.wait_for('archive', key=ebid, since=since, timeout=timeout)
+
+    async def wait_for_job(self, jobid, since=None, timeout=None):
+        '''
+        Wait for the end notification (COMPLETED, FAILED, TIMEOUT, etc.) of a job.
+        '''
+
+        return await self.wait_for('job', key=jobid, finished_only=True,
+                                   since=since, timeout=timeout)
+
+
+_NOTIFICATION_WATCHER = None
+
+
+def set_notification_watcher(watcher):
+    '''
+    Set the watcher returned by `get_notification_watcher`, e.g. one with a
+    `MaildirSource` for tests.
+    '''
+
+    global _NOTIFICATION_WATCHER
+
+    _NOTIFICATION_WATCHER = watcher
+
+
+def get_notification_watcher():
+    '''
+    Return the shared watcher of the archive and job gmail labels.
+    '''
+
+    global _NOTIFICATION_WATCHER
+
+    if _NOTIFICATION_WATCHER is None:
+        _NOTIFICATION_WATCHER = NotificationWatcher([GmailHistorySource(ARCHIVE_LABEL, 'archive'),
+                                                     GmailHistorySource(JOB_LABEL, 'job')])
+
+    return _NOTIFICATION_WATCHER
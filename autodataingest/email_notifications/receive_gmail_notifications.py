@@ -7,6 +7,8 @@ import os
 from ..logging import setup_logging
 log = setup_logging()
 
+from .notification_index import get_notification_index
+
 PROJECTID = "20A-346"
 
 USERNAME = "ekoch"
@@ -43,41 +45,33 @@ def check_for_archive_notification(ebid,
     Given en execution block ID, search for a notification that the archive has
     sent an email for the staged data. Return the whole MS name and lustre path on AOC.
 
+    New messages on the label are added to the local `NotificationIndex` first.
+
     Parameters
     ----------
     timewindow: float or int, optional
         Time window to consider notification within. Default is 48 hr.
     """
 
-    if not do_authentication_gmail(**kwargs):
-        raise ValueError("Cannot login with ezgmail. Check credentials.")
-
-    notification_emails = ezgmail.search(f"label:{labelname}")
-
-    # Loop through and see if we find that EBID:
-    for email in notification_emails:
+    index = get_notification_index()
 
-        # Emails can have multiple messages (replies/grouped emails)
-        for message in email.messages:
+    index.sync(labelname, 'archive', **kwargs)
 
-            if str(ebid) not in message.originalBody:
-                continue
+    record = index.lookup('archive', [ebid], labelname=labelname).get(str(ebid))
 
-            if (datetime.now() - message.timestamp).total_seconds() > timewindow:
-                if verbose:
-                    log.info(f"Found notification older than {timewindow / 3600.} hr. Skipping.")
-                continue
+    if record is None:
+        return None
 
-            # Grab and return the full MS name from the archive email:
-            path_to_data, ms_name = extract_path_and_name(message.originalBody,
-                                                          project_id)
+    if (datetime.now() - datetime.fromisoformat(record['Timestamp'])).total_seconds() > timewindow:
+        if verbose:
+            log.info(f"Found notification older than {timewindow / 3600.} hr. Skipping.")
+        return None
 
-            if markasread:
-                message.markAsRead()
+    if markasread:
+        index.mark_as_read([record['MessageID']])
 
-            return path_to_data, ms_name
-
-    return None
+    # Return the full MS name from the archive email:
+    return record['Path'], record['MSName']
 
 
 def extract_path_and_name(message, project_id):
@@ -96,74 +90,38 @@ def check_for_job_notification(jobid,
                                labelname='Telescope Notifications/20A-346 Cedar Jobs',
                                markasread=True):
 
-    if not do_authentication_gmail():
-        raise ValueError("Cannot login with ezgmail. Check credentials.")
-
-    notification_emails = ezgmail.search(f"label:{labelname}")
-
-    # Loop through and see if we find that job ID:
-    for email in notification_emails:
+    index = get_notification_index()
 
-        # Emails can have multiple messages (replies/grouped emails)
-        for message in email.messages:
+    index.sync(labelname, 'job')
 
-            if str(jobid) not in message.subject:
-                continue
+    record = index.lookup('job', [jobid], labelname=labelname).get(str(jobid))
 
-            # Grab completion, run time for job.
-            jobinfo = message.subject.split(",")
+    if record is None or record['Status'] is None:
+        return None
 
-            status = jobinfo[2].replace(' ', '')
+    if markasread:
+        index.mark_as_read([record['MessageID']])
 
-            runtime = jobinfo[1].split(" ")[-1]
-
-            if markasread:
-                message.markAsRead()
-
-            return status, runtime
-
-    return None
+    return record['Status'], record['Runtime']
 
 
 def add_jobtimes(times):
+    '''
+    Sum slurm run times (e.g., "1-02:03:04", "02:03:04", "03:04") and return
+    the total as a D-HH:MM:SS string.
+    '''
 
-    from datetime import timedelta
-
-    tdeltas = []
-
-    for timestr in times:
-
-        # Check for days
-        nday = float(timestr.split('-')[0])
-
-        subday_str = timestr.split('-')[-1].split(':')
-        if len(subday_str) == 3:
-            nhr = float(subday_str[0])
-            nmin = float(subday_str[1])
-            nsec = float(subday_str[2])
-        elif len(subday_str) == 2:
-            nhr = 0
-            nmin = float(subday_str[0])
-            nsec = float(subday_str[1])
-        elif len(subday_str) == 1:
-            nhr = 0
-            nmin = 0
-            nsec = float(subday_str[0])
-        else:
-            raise ValueError(f"Input time string {timestr} could not be understood.")
+    from ..job_monitor import parse_slurm_timedelta
+    from ..job_accounting import format_slurm_timedelta
 
-        tdeltas.append(timedelta(days=nday, hours=nhr, minutes=nmin, seconds=nsec))
+    times = list(times)
 
-    total_time = sum(tdeltas, timedelta())
+    tdeltas = parse_slurm_timedelta(times)
 
-    # Convert to original format:
-    days = int(total_time.total_seconds() // (24 * 3600))
-    remainder = total_time.total_seconds() % (24 * 3600)
-    hrs = int(remainder // 3600)
-    remainder = remainder % 3600
-    mins = int(remainder // 60)
-    secs = int(remainder % 60)
+    if tdeltas.isnull().any():
+        bad_times = [timestr for timestr, is_bad in zip(times, tdeltas.isnull()) if is_bad]
+        raise ValueError(f"Input time strings {bad_times} could not be understood.")
 
-    total_timestr = f"{days}-{hrs:02d}:{mins:02d}:{secs:02d}"
+    total_timestr = format_slurm_timedelta([tdeltas.sum()]).iloc[0]
 
     return total_timestr
@@ -0,0 +1,167 @@
+'''
+In-process file system operations.
+
+These replace `chmod -R`, `rm -r`, `mv` and `cp` subprocesses. Failures raise
+an `OSError` instead of only showing up in a return code, and the time spent
+in each kind of operation is recorded (see `get_fs_timings`).
+'''
+
+import os
+import time
+import errno
+import shutil
+from functools import wraps
+from collections import defaultdict
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+# Number of calls and total time in seconds for each operation.
+_FS_TIMINGS = defaultdict(lambda: [0, 0.])
+
+
+def _timed(func):
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        t0 = time.time()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            delta = time.time() - t0
+
+            _FS_TIMINGS[func.__name__][0] += 1
+            _FS_TIMINGS[func.__name__][1] += delta
+
+            log.debug(f"{func.__name__}{args} took {delta:.2f} s")
+
+    return wrapper
+
+
+def get_fs_timings():
+    '''
+    Return the number of calls and total time in seconds of each operation.
+    '''
+
+    return {name: tuple(values) for name, values in _FS_TIMINGS.items()}
+
+
+def reset_fs_timings():
+    _FS_TIMINGS.clear()
+
+
+def walk_entries(path, topdown=True):
+    '''
+    Yield `os.DirEntry` objects for everything below `path`. Symbolic links
+    are returned but not followed.
+
+    With `topdown=False`, the contents of each folder are returned before the
+    folder itself.
+    '''
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            is_dir = entry.is_dir(follow_symlinks=False)
+
+            if is_dir and topdown:
+                yield entry
+
+            if is_dir:
+                yield from walk_entries(entry.path, topdown=topdown)
+
+            if not is_dir or not topdown:
+                yield entry
+
+
+@_timed
+def chmod_recursive(path, mode=0o775):
+    '''
+    Set `mode` on `path` and everything below it, like `chmod -R`. Symbolic
+    links are skipped.
+    '''
+
+    os.chmod(path, mode)
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+
+    for entry in walk_entries(path):
+        if entry.is_symlink():
+            continue
+
+        os.chmod(entry.path, mode)
+
+
+@_timed
+def remove_tree(path, missing_ok=False):
+    '''
+    Remove a file or a folder and its contents, like `rm -r`.
+
+    Parameters
+    ----------
+    missing_ok : bool, optional
+        Do not raise an error when `path` does not exist.
+    '''
+
+    if not os.path.lexists(path):
+        if missing_ok:
+            return
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(path))
+
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+
+    for entry in walk_entries(path, topdown=False):
+        if entry.is_dir(follow_symlinks=False):
+            os.rmdir(entry.path)
+        else:
+            os.unlink(entry.path)
+
+    os.rmdir(path)
+
+
+@_timed
+def move_path(src, dst):
+    '''
+    Move a file or folder to `dst`, like `mv`. On the same file system this is
+    a single rename. Otherwise the data is copied and the source removed.
+
+    `dst` is the new path, not a folder to move into. An existing file at `dst`
+    is replaced.
+    '''
+
+    try:
+        os.replace(src, dst)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+
+        log.debug(f"{src} and {dst} are on different file systems. Copying.")
+        shutil.move(os.fspath(src), os.fspath(dst))
+
+
+@_timed
+def copy_file(src, dst):
+    '''
+    Copy a file with its permissions, like `cp`. The copy is written next to
+    `dst` and renamed into place, so `dst` is never partly written.
+    '''
+
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+
+    tmp_dst = f"{dst}.tmp{os.getpid()}"
+
+    try:
+        shutil.copy(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    except OSError:
+        if os.path.exists(tmp_dst):
+            os.unlink(tmp_dst)
+        raise
+
+    return dst
@@ -1,3 +1,9 @@
-from .globus_wrappers import (transfer_file, transfer_pipeline,
+from .globus_wrappers import (transfer_file, transfer_pipeline, transfer_batch,
                               cleanup_source, globus_wait_for_completion,
                               transfer_general, globus_ebid_check_exists)
+from .globus_backends import (get_backend, set_backend, SDKTransferBackend,
+                              CLITransferBackend, FakeTransferBackend)
+from .task_monitor import GlobusTaskMonitor, get_task_monitor, task_progress
+from .listing_cache import ListingCache, get_listing_cache
+from .deletion_queue import DeletionQueue, get_deletion_queue
+from .transfer_queue import TransferQueue, get_transfer_queue
@@ -0,0 +1,176 @@
+'''
+Deferred, batched globus deletions.
+
+Paths queued for deletion on the same endpoint within `batch_window` seconds
+are removed with one delete task. Queuing does not block the event loop, and
+the returned futures resolve when the delete task finishes.
+'''
+
+import asyncio
+
+from .globus_backends import get_backend
+from .task_monitor import get_task_monitor
+from .listing_cache import get_listing_cache
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+class DeletionQueue(object):
+    '''
+    Queue of paths to delete, submitted as one delete task per endpoint.
+
+    Parameters
+    ----------
+    batch_window : float, optional
+        Time in seconds to collect paths before submitting the delete task.
+    max_batch : int, optional
+        Submit right away once this many paths are queued for an endpoint.
+
+    Notes
+    -----
+    Queued paths that are not submitted before the event loop stops are lost.
+    Use `flush` to submit them early, and `close` before the event loop stops.
+    '''
+
+    def __init__(self, batch_window=60, max_batch=100):
+
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self._loop = None
+        self._pending = {}
+        self._full = {}
+        self._flushers = {}
+
+    def _check_loop(self):
+
+        loop = asyncio.get_running_loop()
+
+        if loop is not self._loop:
+            self._loop = loop
+            self._pending = {}
+            self._full = {}
+            self._flushers = {}
+
+    def enqueue(self, endpoint_id, path, recursive=False):
+        '''
+        Queue a path for deletion. Returns a future that resolves to the delete
+        task document.
+        '''
+
+        self._check_loop()
+
+        key = (endpoint_id, recursive)
+
+        future = self._loop.create_future()
+
+        self._pending.setdefault(key, []).append((path, future))
+
+        if key not in self._full:
+            self._full[key] = asyncio.Event()
+
+        if len(self._pending[key]) >= self.max_batch:
+            self._full[key].set()
+
+        if key not in self._flushers or self._flushers[key].done():
+            self._flushers[key] = self._loop.create_task(self._flush_later(key))
+
+        return future
+
+    async def _flush_later(self, key):
+
+        try:
+            await asyncio.wait_for(self._full[key].wait(), self.batch_window)
+        except asyncio.TimeoutError:
+            pass
+
+        await self._flush_key(key)
+
+        # Paths queued while the delete task was running need their own flush.
+        if len(self._pending.get(key, [])) > 0:
+            self._flushers[key] = self._loop.create_task(self._flush_later(key))
+
+    async def _flush_key(self, key):
+
+        entries = self._pending.pop(key, [])
+        self._full.pop(key, None)
+
+        if len(entries) == 0:
+            return
+
+        endpoint_id, recursive = key
+        paths = [path for path, future in entries]
+
+        log.info(f"Submitting deletion of {len(paths)} paths on {endpoint_id}")
+
+        try:
+            # The submission is a blocking call.
+            result = await self._loop.run_in_executor(
+                None, lambda: get_backend().submit_delete(endpoint_id, paths,
+                                                          label=f"cleanup of {len(paths)} paths",
+                                                          recursive=recursive,
+                                                          ignore_missing=True))
+
+            if result is None or result.get('code') != 'Accepted':
+                raise ValueError(f"Deletion was not accepted: {result}")
+
+            for path in paths:
+                get_listing_cache().invalidate(endpoint_id, path.rpartition("/")[0])
+
+            task = await get_task_monitor().wait(result['task_id'], max_interval=300)
+
+        except Exception as exc:
+            log.exception(f"Deletion of {paths} on {endpoint_id} failed.")
+            for path, future in entries:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for path, future in entries:
+            if not future.done():
+                future.set_result(task)
+
+    async def flush(self):
+        '''
+        Submit all queued deletions now and wait for them to finish.
+        '''
+
+        self._check_loop()
+
+        await asyncio.gather(*[self._flush_key(key) for key in list(self._pending)])
+
+    async def close(self):
+        '''
+        Submit all queued deletions without waiting for the batch window, and
+        wait until every delete task has finished.
+        '''
+
+        self._check_loop()
+
+        num_paths = sum([len(entries) for entries in self._pending.values()])
+        if num_paths > 0:
+            log.info(f"Submitting {num_paths} queued deletions before shutdown.")
+
+        # Flushers re-queue themselves while paths are pending.
+        while any([not flusher.done() for flusher in self._flushers.values()]):
+            for event in self._full.values():
+                event.set()
+
+            await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+
+
+_DELETION_QUEUE = None
+
+
+def get_deletion_queue():
+    '''
+    Return the shared deletion queue.
+    '''
+
+    global _DELETION_QUEUE
+
+    if _DELETION_QUEUE is None:
+        _DELETION_QUEUE = DeletionQueue()
+
+    return _DELETION_QUEUE
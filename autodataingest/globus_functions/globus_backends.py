@@ -0,0 +1,585 @@
+'''
+Backends for talking to the Globus transfer service.
+
+`SDKTransferBackend` uses one authorized `globus_sdk.TransferClient` for all calls.
+`CLITransferBackend` wraps the `globus` command line tools and is the fallback
+when globus_sdk or its tokens are not available. `FakeTransferBackend` copies
+files between local directories and is meant for testing.
+
+All backends return the Transfer API documents (dicts) for tasks and listings.
+'''
+
+import os
+import json
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+from datetime import datetime, timezone
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+USERNAME = "ekoch"
+
+# Native app client ID used for the SDK login.
+GLOBUS_CLIENT_ID = os.environ.get("GLOBUS_CLIENT_ID", "")
+
+GLOBUS_TOKEN_FILE = os.path.expanduser('~/globus_tokens.json')
+
+TRANSFER_RESOURCE_SERVER = 'transfer.api.globus.org'
+
+# Final task statuses. Cancelled tasks are reported as FAILED by the API.
+TASK_DONE_STATUSES = ['SUCCEEDED', 'FAILED', 'CANCELLED']
+
+# Number of task IDs per task list query.
+TASK_LIST_CHUNK = 50
+
+
+class TransferBackend(object):
+    '''
+    Interface shared by the transfer backends.
+    '''
+
+    name = None
+
+    def check_login(self):
+        '''
+        Raise a ValueError if we are not logged in.
+        '''
+        raise NotImplementedError
+
+    def activate(self, endpoint_id, interactive=False):
+        '''
+        Activate an endpoint. Returns True if the endpoint is activated.
+        '''
+        raise NotImplementedError
+
+    def ls(self, endpoint_id, path, name_filter=None):
+        '''
+        List a directory. Returns a list of dicts with 'name', 'type' and 'size'.
+        '''
+        raise NotImplementedError
+
+    def mkdir(self, endpoint_id, path):
+        raise NotImplementedError
+
+    def submit_transfer(self, source_endpoint, destination_endpoint, items,
+                        label=None, verify_checksum=False):
+        '''
+        Submit one transfer task.
+
+        Parameters
+        ----------
+        items : list of tuple
+            (source_path, destination_path, recursive) for each item.
+
+        Returns
+        -------
+        result : dict
+            The submission document, with 'task_id' and 'code'.
+        '''
+        raise NotImplementedError
+
+    def submit_delete(self, endpoint_id, paths, label=None, recursive=False,
+                      ignore_missing=False):
+        '''
+        Submit one delete task. Returns the submission document. With
+        `ignore_missing=True`, paths that do not exist are not errors.
+        '''
+        raise NotImplementedError
+
+    def get_task(self, task_id):
+        '''
+        Return the task document, with 'status', 'bytes_transferred', etc.
+        '''
+        raise NotImplementedError
+
+    def get_tasks(self, task_ids):
+        '''
+        Return the task documents for many tasks.
+        '''
+        return [self.get_task(task_id) for task_id in task_ids]
+
+
+class SDKTransferBackend(TransferBackend):
+    '''
+    Backend using `globus_sdk.TransferClient`.
+
+    Tokens are read from `token_file`, written once by `login`. The refresh
+    token keeps the client authorized, so the same client is reused for the
+    whole session.
+    '''
+
+    name = 'sdk'
+
+    def __init__(self, client_id=GLOBUS_CLIENT_ID, token_file=GLOBUS_TOKEN_FILE):
+
+        self.client_id = client_id
+        self.token_file = token_file
+
+        self._client = None
+
+    def _auth_client(self):
+        import globus_sdk
+
+        return globus_sdk.NativeAppAuthClient(self.client_id)
+
+    def _save_tokens(self, tokens):
+        with open(self.token_file, 'w') as f:
+            json.dump(tokens, f)
+
+    def login(self):
+        '''
+        Run the native app login flow and save the transfer tokens.
+        '''
+
+        auth_client = self._auth_client()
+        auth_client.oauth2_start_flow(refresh_tokens=True)
+
+        print(f"Login at: {auth_client.oauth2_get_authorize_url()}")
+        auth_code = input("Authorization code:").strip()
+
+        token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
+
+        self._save_tokens(token_response.by_resource_server[TRANSFER_RESOURCE_SERVER])
+
+        self._client = None
+
+    @property
+    def client(self):
+        '''
+        The authorized TransferClient, created on first use.
+        '''
+
+        if self._client is not None:
+            return self._client
+
+        import globus_sdk
+
+        if not os.path.exists(self.token_file):
+            raise ValueError(f"No globus tokens found at {self.token_file}. "
+                             "Run SDKTransferBackend.login() first.")
+
+        with open(self.token_file, 'r') as f:
+            tokens = json.load(f)
+
+        def _on_refresh(token_response):
+            self._save_tokens(token_response.by_resource_server[TRANSFER_RESOURCE_SERVER])
+
+        authorizer = globus_sdk.RefreshTokenAuthorizer(tokens['refresh_token'],
+                                                       self._auth_client(),
+                                                       access_token=tokens['access_token'],
+                                                       expires_at=tokens['expires_at_seconds'],
+                                                       on_refresh=_on_refresh)
+
+        self._client = globus_sdk.TransferClient(authorizer=authorizer)
+
+        return self._client
+
+    def check_login(self):
+        # Creating the client checks for the tokens. Failed API calls after
+        # this raise globus_sdk errors.
+        self.client
+
+    def activate(self, endpoint_id, interactive=False):
+
+        # Endpoint activation was removed from newer versions of the transfer API.
+        if not hasattr(self.client, 'endpoint_autoactivate'):
+            return True
+
+        result = self.client.endpoint_autoactivate(endpoint_id, if_expires_in=3600)
+
+        if result['code'] == 'AutoActivationFailed':
+            log.warning(f"Auto-activation of {endpoint_id} failed. Activate it manually.")
+            return False
+
+        return True
+
+    def ls(self, endpoint_id, path, name_filter=None):
+
+        kwargs = {}
+        if name_filter is not None:
+            kwargs['filter'] = f"name:{name_filter}"
+
+        result = self.client.operation_ls(endpoint_id, path=path, **kwargs)
+
+        return [dict(entry) for entry in result]
+
+    def mkdir(self, endpoint_id, path):
+
+        import globus_sdk
+
+        try:
+            self.client.operation_mkdir(endpoint_id, path)
+        except globus_sdk.TransferAPIError as exc:
+            if exc.code != 'ExternalError.MkdirFailed.Exists':
+                raise
+
+    def submit_transfer(self, source_endpoint, destination_endpoint, items,
+                        label=None, verify_checksum=False):
+
+        import globus_sdk
+
+        tdata = globus_sdk.TransferData(self.client, source_endpoint, destination_endpoint,
+                                        label=label, verify_checksum=verify_checksum)
+
+        for source_path, destination_path, recursive in items:
+            tdata.add_item(source_path, destination_path, recursive=recursive)
+
+        return self.client.submit_transfer(tdata).data
+
+    def submit_delete(self, endpoint_id, paths, label=None, recursive=False,
+                      ignore_missing=False):
+
+        import globus_sdk
+
+        ddata = globus_sdk.DeleteData(self.client, endpoint_id, label=label,
+                                      recursive=recursive,
+                                      ignore_missing=ignore_missing)
+
+        for path in paths:
+            ddata.add_item(path)
+
+        return self.client.submit_delete(ddata).data
+
+    def get_task(self, task_id):
+        return self.client.get_task(task_id).data
+
+    def get_tasks(self, task_ids):
+
+        tasks = []
+
+        # Query in chunks to keep the filter short.
+        for i in range(0, len(task_ids), TASK_LIST_CHUNK):
+            chunk = task_ids[i:i + TASK_LIST_CHUNK]
+            result = self.client.task_list(filter=f"task_id:{','.join(chunk)}",
+                                           limit=len(chunk))
+            tasks.extend([dict(task) for task in result])
+
+        return tasks
+
+
+class CLITransferBackend(TransferBackend):
+    '''
+    Backend wrapping the `globus` command line tools. Output is requested as JSON.
+    '''
+
+    name = 'cli'
+
+    def __init__(self, username=USERNAME):
+
+        self.username = username
+
+        self._logged_in = False
+
+    def _run(self, cmd, stdin=None, check=True):
+
+        out = subprocess.run(cmd + ['--format', 'json'], capture_output=True,
+                             input=stdin.encode('utf-8') if stdin is not None else None)
+
+        if out.returncode != 0:
+            if check:
+                raise ValueError(f"Command {cmd} failed with: {out.stderr.decode('utf-8')}")
+            return None
+
+        return json.loads(out.stdout.decode('utf-8'))
+
+    def check_login(self):
+
+        # Only check the first time.
+        if self._logged_in:
+            return
+
+        out = subprocess.run(['globus', 'whoami'], capture_output=True)
+
+        if out.returncode != 0:
+            raise ValueError(f"Login failed with {out.stderr.decode('utf-8')}")
+
+        user = out.stdout.decode('utf-8')
+
+        if user.split('@')[0] != self.username:
+            raise ValueError(f"Unexpected login user? {user}")
+
+        self._logged_in = True
+
+    def activate(self, endpoint_id, interactive=False):
+
+        # Check if logged in.
+        out = subprocess.run(['globus', 'endpoint', 'is-activated', endpoint_id],
+                             capture_output=True)
+
+        # If logged in, don't bother with another login.
+        if 'is activated' in out.stdout.decode('utf-8'):
+            return True
+
+        if interactive:
+            from getpass import unix_getpass
+
+            log.info(f"Require manual login to {endpoint_id}")
+
+            username = input("Username:")
+            password = unix_getpass()
+
+            cmd = ['globus', 'endpoint', 'activate', '--myproxy', endpoint_id,
+                   '--myproxy-username', username, '--myproxy-password', password]
+
+            out = subprocess.run(cmd, capture_output=True)
+
+        return True
+
+    def ls(self, endpoint_id, path, name_filter=None):
+
+        cmd = ['globus', 'ls', f"{endpoint_id}:{path}"]
+        if name_filter is not None:
+            cmd += ['--filter', name_filter]
+
+        result = self._run(cmd, check=False)
+
+        if result is None:
+            return []
+
+        return result['DATA']
+
+    def mkdir(self, endpoint_id, path):
+        # Fails if the directory exists, which is fine.
+        self._run(['globus', 'mkdir', f"{endpoint_id}:{path}"], check=False)
+
+    def submit_transfer(self, source_endpoint, destination_endpoint, items,
+                        label=None, verify_checksum=False):
+
+        cmd = ['globus', 'transfer', source_endpoint, destination_endpoint, '--batch', '-']
+        if label is not None:
+            cmd += ['--label', label]
+        if verify_checksum:
+            cmd += ['--verify-checksum']
+
+        batch = "\n".join([f"{'--recursive ' if recursive else ''}\"{source_path}\" \"{destination_path}\""
+                           for source_path, destination_path, recursive in items])
+
+        return self._run(cmd, stdin=batch)
+
+    def submit_delete(self, endpoint_id, paths, label=None, recursive=False,
+                      ignore_missing=False):
+
+        cmd = ['globus', 'delete', endpoint_id, '--batch', '-']
+        if label is not None:
+            cmd += ['--label', label]
+        if recursive:
+            cmd += ['--recursive']
+        if ignore_missing:
+            cmd += ['--ignore-missing']
+
+        return self._run(cmd, stdin="\n".join([f"\"{path}\"" for path in paths]))
+
+    def get_task(self, task_id):
+        return self._run(['globus', 'task', 'show', f"{task_id}"])
+
+    def get_tasks(self, task_ids):
+
+        tasks = []
+
+        for i in range(0, len(task_ids), TASK_LIST_CHUNK):
+            chunk = task_ids[i:i + TASK_LIST_CHUNK]
+
+            cmd = ['globus', 'task', 'list', '--limit', f"{len(chunk)}"]
+            for task_id in chunk:
+                cmd += ['--filter-task-id', task_id]
+
+            tasks.extend(self._run(cmd)['DATA'])
+
+        return tasks
+
+
+class FakeTransferBackend(TransferBackend):
+    '''
+    Local stand-in for the transfer service. Each endpoint ID is a directory
+    under `root` and tasks complete immediately.
+
+    Parameters
+    ----------
+    root : str or Path
+        Directory holding the endpoint directories.
+    fail_paths : list of str, optional
+        Tasks with a source path containing any of these strings fail.
+    '''
+
+    name = 'fake'
+
+    def __init__(self, root, fail_paths=[]):
+
+        self.root = Path(root)
+        self.fail_paths = list(fail_paths)
+
+        self.tasks = {}
+
+    def _path(self, endpoint_id, path):
+        return self.root / endpoint_id / str(path).lstrip('/')
+
+    def _new_task(self, task_type, label, status, **kwargs):
+
+        task_id = str(uuid.uuid4())
+
+        now = datetime.now(timezone.utc).isoformat()
+
+        task = {'task_id': task_id, 'type': task_type, 'label': label,
+                'status': status, 'request_time': now, 'completion_time': now,
+                'bytes_transferred': 0, 'files': 0, 'files_transferred': 0,
+                'subtasks_succeeded': 0, 'subtasks_failed': 0, 'faults': 0,
+                'effective_bytes_per_second': 0}
+        task.update(kwargs)
+
+        self.tasks[task_id] = task
+
+        return {'code': 'Accepted', 'task_id': task_id,
+                'message': f"The {task_type.lower()} has been accepted"}
+
+    def check_login(self):
+        pass
+
+    def activate(self, endpoint_id, interactive=False):
+        return True
+
+    def ls(self, endpoint_id, path, name_filter=None):
+
+        this_path = self._path(endpoint_id, path)
+
+        if not this_path.is_dir():
+            return []
+
+        entries = []
+        for entry in sorted(os.scandir(this_path), key=lambda entry: entry.name):
+            if name_filter is not None and name_filter.strip('~*') not in entry.name:
+                continue
+
+            entries.append({'name': entry.name,
+                            'type': 'dir' if entry.is_dir() else 'file',
+                            'size': entry.stat().st_size})
+
+        return entries
+
+    def mkdir(self, endpoint_id, path):
+        self._path(endpoint_id, path).mkdir(parents=True, exist_ok=True)
+
+    def submit_transfer(self, source_endpoint, destination_endpoint, items,
+                        label=None, verify_checksum=False):
+
+        nbytes = 0
+        nfiles = 0
+        nfailed = 0
+
+        for source_path, destination_path, recursive in items:
+
+            source = self._path(source_endpoint, source_path)
+            destination = self._path(destination_endpoint, destination_path)
+
+            if not source.exists() or any(fail in str(source_path) for fail in self.fail_paths):
+                nfailed += 1
+                continue
+
+            destination.parent.mkdir(parents=True, exist_ok=True)
+
+            if source.is_dir():
+                if not recursive:
+                    nfailed += 1
+                    continue
+
+                shutil.copytree(source, destination, dirs_exist_ok=True)
+                sizes = [this_file.stat().st_size for this_file in destination.rglob("*")
+                         if this_file.is_file()]
+            else:
+                shutil.copy2(source, destination)
+                sizes = [destination.stat().st_size]
+
+            nbytes += sum(sizes)
+            nfiles += len(sizes)
+
+        return self._new_task('TRANSFER', label,
+                              'FAILED' if nfailed > 0 else 'SUCCEEDED',
+                              source_endpoint_id=source_endpoint,
+                              destination_endpoint_id=destination_endpoint,
+                              verify_checksum=verify_checksum,
+                              bytes_transferred=nbytes, files=nfiles,
+                              files_transferred=nfiles,
+                              subtasks_succeeded=len(items) - nfailed,
+                              subtasks_failed=nfailed)
+
+    def submit_delete(self, endpoint_id, paths, label=None, recursive=False,
+                      ignore_missing=False):
+
+        nfailed = 0
+        for path in paths:
+            this_path = self._path(endpoint_id, path)
+
+            if this_path.is_dir() and recursive:
+                shutil.rmtree(this_path)
+            elif this_path.is_file():
+                this_path.unlink()
+            elif not this_path.exists() and ignore_missing:
+                continue
+            else:
+                nfailed += 1
+
+        return self._new_task('DELETE', label,
+                              'FAILED' if nfailed > 0 else 'SUCCEEDED',
+                              source_endpoint_id=endpoint_id,
+                              subtasks_succeeded=len(paths) - nfailed,
+                              subtasks_failed=nfailed)
+
+    def get_task(self, task_id):
+
+        if task_id not in self.tasks:
+            raise ValueError(f"Unknown task ID {task_id}")
+
+        return dict(self.tasks[task_id])
+
+
+_BACKEND = None
+
+
+def set_backend(backend):
+    '''
+    Set the backend returned by `get_backend`, e.g. a `FakeTransferBackend` for tests.
+    '''
+
+    global _BACKEND
+
+    _BACKEND = backend
+
+
+def get_backend():
+    '''
+    Return the shared transfer backend.
+
+    The backend is chosen with the AUTODATAINGEST_GLOBUS_BACKEND environment
+    variable ('sdk' or 'cli'). Otherwise the SDK backend is used when globus_sdk is
+    installed and tokens exist, and the CLI backend is used if not.
+    '''
+
+    global _BACKEND
+
+    if _BACKEND is not None:
+        return _BACKEND
+
+    backend_name = os.environ.get("AUTODATAINGEST_GLOBUS_BACKEND", None)
+
+    if backend_name is None:
+        try:
+            import globus_sdk
+            has_sdk = True
+        except ImportError:
+            has_sdk = False
+
+        backend_name = 'sdk' if has_sdk and os.path.exists(GLOBUS_TOKEN_FILE) else 'cli'
+
+    if backend_name == 'sdk':
+        _BACKEND = SDKTransferBackend()
+    elif backend_name == 'cli':
+        _BACKEND = CLITransferBackend()
+    else:
+        raise ValueError(f"Unknown globus backend {backend_name}")
+
+    log.info(f"Using the {_BACKEND.name} globus backend.")
+
+    return _BACKEND
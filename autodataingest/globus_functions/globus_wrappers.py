@@ -1,20 +1,24 @@
 
 '''
-It seems easiest to just wrap the command line tools.
+Wrappers for the globus transfers between the staging, cluster and ingest nodes.
+
+The calls go through the backend from `globus_backends.get_backend`.
 '''
 
 import os
 import subprocess
-import time
-import asyncio
-import async_timeout
 
 from ..logging import setup_logging
 log = setup_logging()
 
 from ..cluster_configs import ENDPOINT_INFO
 
-USERNAME = "ekoch"
+from .globus_backends import get_backend
+from .task_monitor import get_task_monitor
+from .listing_cache import get_listing_cache
+from .deletion_queue import get_deletion_queue
+
+from ..transfer_metrics import record_transfer, route_throughput
 
 
 def do_authenticate_globus():
@@ -22,20 +26,7 @@ def do_authenticate_globus():
     Check that we can login.
     """
 
-    out = subprocess.run(['globus', 'login'], capture_output=True)
-
-    if not len(out.stderr) == 0:
-
-        raise ValueError("Login failed with {out.stderr}")
-
-
-    # Check who is logged in:
-
-    user = subprocess.run(['globus', 'whoami'], capture_output=True).stdout
-    user = user.decode('utf-8')
-
-    if user.split('@')[0] != USERNAME:
-        raise ValueError("Unexpected login user? {user}")
+    get_backend().check_login()
 
 
 def do_manual_login(nodename, verbose=True, interactive_login=False):
@@ -45,56 +36,76 @@ def do_manual_login(nodename, verbose=True, interactive_login=False):
 
     '''
 
-    from getpass import unix_getpass
-
     id_number = ENDPOINT_INFO[nodename]['endpoint_id']
 
-    # Check if logged in.
-    act_cmd = ['globus', 'endpoint', 'is-activated', id_number]
-    out = subprocess.run(act_cmd, capture_output=True)
+    return get_backend().activate(id_number, interactive=interactive_login)
 
-    # If logged in, don't bother with another login.
-    if 'is activated' in out.stdout.decode('utf-8'):
-        return True
 
-    if interactive_login:
-        log.info(f"Require manual login to {nodename}")
-
-        username = input("Username:")
-        password = unix_getpass()
+def _check_accepted(result):
+    '''
+    Return the task ID of a submitted task, or raise a ValueError if it was not accepted.
+    '''
 
-        cmd = ['globus', 'endpoint', 'activate', '--myproxy', id_number,
-            '--myproxy-username', username, '--myproxy-password', password]
+    if result is None or result.get('code') != 'Accepted':
+        log.warning(result)
 
-        out = subprocess.run(cmd, capture_output=True)
+        raise ValueError("Transfer was not accepted Check the above messages.")
 
-    return True
+    return result['task_id']
 
 
 async def globus_wait_for_completion(task_id, sleeptime=900,
-                                     timeout=86400):
+                                     timeout=86400,
+                                     ebid=None, stage=None,
+                                     startnode=None, endnode=None):
     '''
-    Asynchronously poll if the transfer is completed.
+    Wait for the transfer to complete. The task is polled by the shared
+    `GlobusTaskMonitor` with all other outstanding tasks.
+
+    Parameters
+    ----------
+    sleeptime : float, optional
+        Longest time to go between polls of this task.
+    timeout : float, optional
+        Time to wait before raising an `asyncio.TimeoutError`.
+    ebid, stage, startnode, endnode : optional
+        When given, the transfer metrics are recorded with
+        `transfer_metrics.record_transfer`.
+
+    Returns
+    -------
+    task : dict
+        The final task document.
     '''
 
-    do_authenticate_globus()
+    monitor = get_task_monitor()
+
+    do_record = any([val is not None for val in [ebid, stage, startnode, endnode]])
 
-    async with async_timeout.timeout(timeout):
+    if do_record and startnode is not None and endnode is not None:
+        df_route = route_throughput()
+        if (startnode, endnode) in df_route.index:
+            log.info(f"Recent throughput from {startnode} to {endnode}: "
+                     f"{df_route.loc[(startnode, endnode), 'Rate_MBs']:.1f} MB/s")
+
+    try:
+        task = await monitor.wait(task_id, timeout=timeout, max_interval=sleeptime)
+    except ValueError:
+        if do_record:
+            # Tasks that were never found in the task list have no document.
+            task = monitor.task_document(task_id)
+            if task is None:
+                task = {'task_id': task_id, 'status': 'NOT_FOUND'}
 
-        while True:
-            # Will not return until the task is completed.
-            out = subprocess.run(['globus', 'task', 'show', f"{task_id}", '--jmespath', 'status'],
-                                capture_output=True)
+            record_transfer(task, ebid=ebid, stage=stage,
+                            startnode=startnode, endnode=endnode)
+        raise
 
-            result = out.stdout.decode('utf-8')
+    if do_record:
+        record_transfer(task, ebid=ebid, stage=stage,
+                        startnode=startnode, endnode=endnode)
 
-            if "SUCCEEDED" in result:
-                break
-            elif "CANCELLED" in result:
-                raise ValueError('Transfer has been cancelled.')
-            else:
-                # Wait
-                await asyncio.sleep(sleeptime)
+    return task
 
 
 def globus_ebid_check_exists(ebid, nodename='nrao-aoc',
@@ -113,36 +124,23 @@ def globus_ebid_check_exists(ebid, nodename='nrao-aoc',
     # Based on SDM name where the execution block is unique.
     search_string = f'.eb{ebid}.'
 
-    # Want to return the task_id in the command line output.
+    endpoint_id = ENDPOINT_INFO[nodename]['endpoint_id']
+
     if use_startnode_datapath:
-        input_cmd = f"{ENDPOINT_INFO[nodename]['endpoint_id']}:{ENDPOINT_INFO[nodename]['data_path']}/"
+        input_path = ENDPOINT_INFO[nodename]['data_path']
     else:
-        input_cmd = f"{ENDPOINT_INFO[nodename]['endpoint_id']}:"
-
-    # Check if the input file/folder exists:
-    task_command = ['globus', 'ls', "/".join(input_cmd.split("/")[:-1])]
+        input_path = "/~/"
 
-    log.info(f"Submitting cmd: {task_command}")
-
-    task_check = subprocess.run(task_command, capture_output=True)
+    # One listing of the directory is shared by all EBID checks within the cache TTL.
+    ebid_index = get_listing_cache().ebid_index(endpoint_id, input_path)
 
     if print_output:
-        log.info(task_check.stdout.decode('utf-8'))
+        log.info("\n".join(ebid_index.values()))
 
-    if search_string not in task_check.stdout.decode('utf-8'):
-        if raise_error:
-            raise ValueError(f"The EBID {search_string} does not exist at {input_cmd}.")
-        else:
-            return None
-
-    # Extract and return the full trackname
-    trackname = None
-    for out in task_check.stdout.decode('utf-8').split('\n'):
-        if search_string in out:
-            trackname = out
+    trackname = ebid_index.get(int(ebid))
 
-            if ".tar" in trackname:
-                trackname = trackname[:-4]
+    if trackname is None and raise_error:
+        raise ValueError(f"The EBID {search_string} does not exist at {endpoint_id}:{input_path}.")
 
     return trackname
 
@@ -153,8 +151,13 @@ def transfer_file(track_name, track_folder_name, startnode='nrao-aoc',
                   request_manual_login=False):
     """
     Start a globus transfer from `startnode` to `endnode`.
+
+    With `remove_existing=True`, an existing output is deleted first and the
+    transfer is only submitted once the delete task has finished.
     """
 
+    backend = get_backend()
+
     try:
         do_authenticate_globus()
     except ValueError:
@@ -166,38 +169,24 @@ def transfer_file(track_name, track_folder_name, startnode='nrao-aoc',
     do_manual_login(startnode, interactive_login=request_manual_login)
 
     # Make a new folder on `endnode` for the data to go to:
-    mkdir_command = ["globus", "mkdir",
-                     f"{ENDPOINT_INFO[endnode]['endpoint_id']}:{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}"]
-
-    log.info(f"Making data directory on {endnode}: {mkdir_command}")
-
-    out = subprocess.run(mkdir_command, capture_output=True)
-
-    # Want to return the task_id in the command line output.
-    input_cmd = f"{ENDPOINT_INFO[startnode]['endpoint_id']}:{ENDPOINT_INFO[startnode]['data_path']}/{track_name}.tar"
-    output_cmd = f"{ENDPOINT_INFO[endnode]['endpoint_id']}:{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}/{track_name}.tar"
-
-    # task_command = f"$(globus transfer {input_cmd} {output_cmd} --jmes path 'task_id' --format=UNIX)"
-    task_command = ['globus', 'transfer', input_cmd, output_cmd]
-
-    log.info(f"Submitting command: {task_command}")
-
-    task_transfer = subprocess.run(task_command, capture_output=True)
-
-    # Extract the task ID from the stdout
-    task_transfer_stdout = task_transfer.stdout.decode('utf-8').replace("\n", " ")
+    log.info(f"Making data directory on {endnode}: {track_folder_name}")
 
-    if not 'accepted' in task_transfer_stdout:
-        log.warning(task_transfer_stdout)
-        log.warning(task_transfer.stderr.decode('utf-8'))
+    backend.mkdir(ENDPOINT_INFO[endnode]['endpoint_id'],
+                  f"{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}")
+    get_listing_cache().invalidate(ENDPOINT_INFO[endnode]['endpoint_id'],
+                                   ENDPOINT_INFO[endnode]['data_path'])
 
-        raise ValueError("Transfer was not accepted Check the above messages.")
+    input_path = f"{ENDPOINT_INFO[startnode]['data_path']}/{track_name}.tar"
+    output_path = f"{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}/{track_name}.tar"
 
-    task_id = task_transfer_stdout.split('Task ID:')[-1].replace(" ", '')
+    log.info(f"Submitting transfer of {input_path} to {output_path}")
 
+    result = backend.submit_transfer(ENDPOINT_INFO[startnode]['endpoint_id'],
+                                     ENDPOINT_INFO[endnode]['endpoint_id'],
+                                     [(input_path, output_path, False)],
+                                     label=track_name)
 
-    # Wait for 30 seconds to allow the transfer to get started.
-    time.sleep(30)
+    task_id = _check_accepted(result)
 
     if wait_for_completion:
         globus_wait_for_completion(task_id)
@@ -225,47 +214,75 @@ def transfer_pipeline(track_name, track_folder_name, endnode='cc-cedar'):
     os.chdir('..')
 
     # Transfer to the endnode
-    input_cmd = f"{ENDPOINT_INFO['ingester']['endpoint_id']}:{ENDPOINT_INFO['ingester']['data_path']}/{foldername}/ReductionPipeline.tar"
-    output_cmd = f"{ENDPOINT_INFO[endnode]['endpoint_id']}:{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}/ReductionPipeline.tar"
-
-    task_command = ["globus", "transfer", input_cmd, output_cmd]
+    input_path = f"{ENDPOINT_INFO['ingester']['data_path']}/{foldername}/ReductionPipeline.tar"
+    output_path = f"{ENDPOINT_INFO[endnode]['data_path']}/{track_folder_name}/ReductionPipeline.tar"
 
-    out = subprocess.run(task_command, capture_output=True)
+    get_backend().submit_transfer(ENDPOINT_INFO['ingester']['endpoint_id'],
+                                  ENDPOINT_INFO[endnode]['endpoint_id'],
+                                  [(input_path, output_path, False)],
+                                  label=f"{track_name} pipeline")
 
     return True
 
 
-def cleanup_source(track_name, node='nrao-aoc'):
+def _retrieve_exception(future):
+    '''
+    Mark the exception of an unawaited future as retrieved. Failures are logged
+    by the queue.
+    '''
+
+    if not future.cancelled():
+        future.exception()
+
+
+async def cleanup_source(track_name, node='nrao-aoc', wait=False):
     """
     Run after a transfer finishes to remove the track from the initial location.
     This is needed to not overwhelm our project storage limit on AOC.
+
+    The deletion is queued and submitted together with other deletions on the
+    same node (see `DeletionQueue`). Without `wait`, the queue must be closed
+    with `get_deletion_queue().close()` before the event loop stops.
+
+    Parameters
+    ----------
+    wait : bool, optional
+        Wait for the delete task to finish.
     """
 
     do_manual_login(node)
 
-    input_cmd = f"{ENDPOINT_INFO[node]['endpoint_id']}:{ENDPOINT_INFO[node]['data_path']}/{track_name}.tar"
+    input_path = f"{ENDPOINT_INFO[node]['data_path']}/{track_name}.tar"
 
-    out = subprocess.run(['globus', 'rm', input_cmd], capture_output=True)
+    future = get_deletion_queue().enqueue(ENDPOINT_INFO[node]['endpoint_id'], input_path)
 
-    time.sleep(30)
+    if wait:
+        await future
+    else:
+        future.add_done_callback(_retrieve_exception)
 
     return True
 
 
-def transfer_general(filename, output_destination,
-                    startnode='cc-cedar',
-                    endnode='ingester',
-                    wait_for_completion=False,
-                    use_rootname=True,
-                    skip_if_not_existing=True,
-                    remove_existing=False,
-                    use_startnode_datapath=True,
-                    use_endnode_datapath=True):
+async def transfer_general(filename, output_destination,
+                          startnode='cc-cedar',
+                          endnode='ingester',
+                          wait_for_completion=False,
+                          use_rootname=True,
+                          skip_if_not_existing=True,
+                          remove_existing=False,
+                          use_startnode_datapath=True,
+                          use_endnode_datapath=True):
 
     """
     Start a globus transfer from `startnode` to `endnode`.
+
+    With `remove_existing=True`, an existing output is deleted first and the
+    transfer is only submitted once the delete task has finished.
     """
 
+    backend = get_backend()
+
     try:
         do_authenticate_globus()
     except ValueError:
@@ -280,64 +297,163 @@ def transfer_general(filename, output_destination,
     else:
         output_filename = filename
 
-    # Want to return the task_id in the command line output.
     if use_startnode_datapath:
-        input_cmd = f"{ENDPOINT_INFO[startnode]['endpoint_id']}:{ENDPOINT_INFO[startnode]['data_path']}/{filename}"
+        input_path = f"{ENDPOINT_INFO[startnode]['data_path']}/{filename}"
     else:
-        input_cmd = f"{ENDPOINT_INFO[startnode]['endpoint_id']}:{filename}"
+        input_path = filename
 
     if use_endnode_datapath:
-        output_cmd = f"{ENDPOINT_INFO[endnode]['endpoint_id']}:{ENDPOINT_INFO[endnode]['data_path']}/{output_destination}/{output_filename}"
+        output_path = f"{ENDPOINT_INFO[endnode]['data_path']}/{output_destination}/{output_filename}"
     else:
-        output_cmd = f"{ENDPOINT_INFO[endnode]['endpoint_id']}:{output_destination}/{output_filename}"
+        output_path = f"{output_destination}/{output_filename}"
 
-    # Check if the input file/folder exists:
-    task_command = ['globus', 'ls', "/".join(input_cmd.split("/")[:-1]), '--filter', input_cmd.split("/")[-1]]
+    start_id = ENDPOINT_INFO[startnode]['endpoint_id']
+    end_id = ENDPOINT_INFO[endnode]['endpoint_id']
 
-    log.info(f"Full globus command is: {task_command}")
-    task_check = subprocess.run(task_command, capture_output=True)
+    cache = get_listing_cache()
 
-    base_filename = filename.split('/')[0]
+    # Check if the input file/folder exists:
+    input_entry = cache.exists(start_id, input_path)
 
-    if base_filename not in task_check.stdout.decode('utf-8'):
+    if input_entry is None:
         if skip_if_not_existing:
-            log.warning(f"The file {base_filename} does not exist at {input_cmd}. Skipping.")
+            log.warning(f"The file {filename} does not exist at {start_id}:{input_path}. Skipping.")
             return None
 
-        raise ValueError(f"The file {base_filename} does not exist at {input_cmd}.")
+        raise ValueError(f"The file {filename} does not exist at {start_id}:{input_path}.")
 
-    # Check if the output file/folder already exists:
-    task_command = ['globus', 'ls', "/".join(output_cmd.split("/")[:-1]), '--filter', output_cmd.split("/")[-1]]
-    task_check = subprocess.run(task_command, capture_output=True)
+    is_dir = input_entry['type'] == 'dir'
 
-    if base_filename in task_check.stdout.decode('utf-8'):
+    # Check if the output file/folder already exists:
+    if cache.exists(end_id, output_path) is not None:
         log.info("Found existing output file.")
         if remove_existing:
-            task_command = ['globus', 'rm', output_cmd]
-            task_remove = subprocess.run(task_command, capture_output=True)
+            result = backend.submit_delete(end_id, [output_path], recursive=True,
+                                           label=f"{output_filename} overwrite")
+            delete_id = _check_accepted(result)
+
+            # The delete must finish before the new copy lands.
+            await get_task_monitor().wait(delete_id, max_interval=300)
+
+            cache.invalidate(end_id, output_path.rpartition("/")[0])
         else:
             log.info("Skipping deletion of existing output file.")
 
-    # task_command = f"$(globus transfer {input_cmd} {output_cmd} --jmes path 'task_id' --format=UNIX)"
-    task_command = ['globus', 'transfer', input_cmd, output_cmd]
+    result = backend.submit_transfer(start_id, end_id,
+                                     [(input_path, output_path, is_dir)],
+                                     label=output_filename)
 
-    task_transfer = subprocess.run(task_command, capture_output=True)
+    cache.invalidate(end_id, output_path.rpartition("/")[0])
 
-    # Extract the task ID from the stdout
-    task_transfer_stdout = task_transfer.stdout.decode('utf-8').replace("\n", " ")
+    task_id = _check_accepted(result)
 
-    if not 'accepted' in task_transfer_stdout:
-        log.warning(task_transfer_stdout)
-        log.warning(task_transfer.stderr.decode('utf-8'))
+    # if wait_for_completion:
+    #     globus_wait_for_completion(task_id)
 
-        raise ValueError("Transfer was not accepted Check the above messages.")
+    return task_id
 
-    task_id = task_transfer_stdout.split('Task ID:')[-1].replace(" ", '')
 
-    # Wait for 30 seconds to allow the transfer to get started.
-    time.sleep(30)
+def transfer_batch(transfers,
+                   startnode='cc-cedar',
+                   endnode='ingester',
+                   label=None,
+                   verify_checksum=True,
+                   use_rootname=True,
+                   skip_if_not_existing=True,
+                   use_startnode_datapath=True,
+                   use_endnode_datapath=True,
+                   return_skipped=False):
+    """
+    Start one globus transfer from `startnode` to `endnode` for many files.
+
+    Parameters
+    ----------
+    transfers : list of tuple
+        (filename, output_destination) for each file, as in `transfer_general`.
+        The files can be from different tracks.
+    verify_checksum : bool, optional
+        Verify the checksum of each file after it is transferred.
+    skip_if_not_existing : bool, optional
+        Leave out files that do not exist and transfer the rest. Otherwise
+        raise a ValueError.
+    return_skipped : bool, optional
+        Also return the (filename, output_destination) pairs that were left out.
+
+    Returns
+    -------
+    task_id : str
+        The task ID. None if none of the files exist and `skip_if_not_existing=True`.
+    skipped : list
+        Returned with `return_skipped=True`.
+    """
 
-    # if wait_for_completion:
-    #     globus_wait_for_completion(task_id)
+    backend = get_backend()
 
-    return task_id
+    try:
+        do_authenticate_globus()
+    except ValueError:
+        log.exception(f"Auto authentication of {endnode} failed. Try manual login.")
+        do_manual_login(endnode)
+
+    do_manual_login(startnode)
+
+    start_id = ENDPOINT_INFO[startnode]['endpoint_id']
+    end_id = ENDPOINT_INFO[endnode]['endpoint_id']
+
+    cache = get_listing_cache()
+
+    items = []
+    skipped = []
+
+    for filename, output_destination in transfers:
+
+        if use_rootname:
+            output_filename = filename.split('/')[-1]
+        else:
+            output_filename = filename
+
+        if use_startnode_datapath:
+            input_path = f"{ENDPOINT_INFO[startnode]['data_path']}/{filename}"
+        else:
+            input_path = filename
+
+        if use_endnode_datapath:
+            output_path = f"{ENDPOINT_INFO[endnode]['data_path']}/{output_destination}/{output_filename}"
+        else:
+            output_path = f"{output_destination}/{output_filename}"
+
+        # Each input directory is listed once.
+        input_entry = cache.exists(start_id, input_path)
+
+        if input_entry is None:
+            if skip_if_not_existing:
+                log.warning(f"The file {filename} does not exist at {start_id}:{input_path}. Skipping.")
+                skipped.append((filename, output_destination))
+                continue
+
+            raise ValueError(f"The file {filename} does not exist at {start_id}:{input_path}.")
+
+        is_dir = input_entry['type'] == 'dir'
+
+        items.append((input_path, output_path, is_dir))
+
+    if len(skipped) > 0:
+        log.warning(f"Left {len(skipped)} of {len(transfers)} files out of the transfer: "
+                    f"{[filename for filename, _ in skipped]}")
+
+    if len(items) == 0:
+        log.warning(f"None of the files to transfer from {startnode} to {endnode} exist.")
+        return (None, skipped) if return_skipped else None
+
+    log.info(f"Submitting transfer of {len(items)} files from {startnode} to {endnode}")
+
+    result = backend.submit_transfer(start_id, end_id, items,
+                                     label=label,
+                                     verify_checksum=verify_checksum)
+
+    for item in items:
+        cache.invalidate(end_id, item[1].rpartition("/")[0])
+
+    task_id = _check_accepted(result)
+
+    return (task_id, skipped) if return_skipped else task_id
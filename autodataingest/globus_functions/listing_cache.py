@@ -0,0 +1,123 @@
+'''
+Short-lived cache of globus directory listings.
+
+All callers share one listing per (endpoint, path) until it expires, so
+checking many EBIDs or files in the same directory costs one `ls`.
+'''
+
+import re
+import time
+
+from .globus_backends import get_backend
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+# SDM names are PROJECT.sbNUM.ebNUM.MJD
+EBID_PATTERN = re.compile(r"\.eb(\d+)\.")
+
+
+class ListingCache(object):
+    '''
+    Directory listings keyed by (endpoint ID, path).
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Time in seconds to reuse a listing.
+    '''
+
+    def __init__(self, ttl=300):
+
+        self.ttl = ttl
+
+        self._listings = {}
+        self._ebid_indices = {}
+
+    @staticmethod
+    def _key(endpoint_id, path):
+        return (endpoint_id, re.sub("/+", "/", path).rstrip('/') or '/')
+
+    def listing(self, endpoint_id, path, force=False):
+        '''
+        Return the directory listing as a dict of entries keyed by name.
+        '''
+
+        key = self._key(endpoint_id, path)
+
+        if not force and key in self._listings:
+            list_time, entries = self._listings[key]
+            if (time.time() - list_time) < self.ttl:
+                return entries
+
+        log.info(f"Listing {endpoint_id}:{path}")
+
+        entries = {entry['name']: entry for entry in get_backend().ls(endpoint_id, path)}
+
+        self._listings[key] = (time.time(), entries)
+        self._ebid_indices.pop(key, None)
+
+        return entries
+
+    def exists(self, endpoint_id, path):
+        '''
+        Return the listing entry of a file or folder, or None if it does not exist.
+        '''
+
+        dirname, _, name = re.sub("/+", "/", path).rstrip('/').rpartition("/")
+
+        return self.listing(endpoint_id, dirname or '/').get(name)
+
+    def ebid_index(self, endpoint_id, path):
+        '''
+        Map of EBID to the track name (without ".tar") of the SDMs in a directory.
+        '''
+
+        entries = self.listing(endpoint_id, path)
+
+        key = self._key(endpoint_id, path)
+
+        if key not in self._ebid_indices:
+
+            index = {}
+            for name in entries:
+                match = EBID_PATTERN.search(name)
+                if match is None:
+                    continue
+
+                index[int(match.group(1))] = name[:-4] if name.endswith(".tar") else name
+
+            self._ebid_indices[key] = index
+
+        return self._ebid_indices[key]
+
+    def invalidate(self, endpoint_id, path=None):
+        '''
+        Drop the cached listing of a directory, or all directories on an endpoint.
+        '''
+
+        for key in list(self._listings):
+            if key[0] != endpoint_id:
+                continue
+            if path is not None and key != self._key(endpoint_id, path):
+                continue
+
+            del self._listings[key]
+            self._ebid_indices.pop(key, None)
+
+
+_LISTING_CACHE = None
+
+
+def get_listing_cache():
+    '''
+    Return the shared listing cache.
+    '''
+
+    global _LISTING_CACHE
+
+    if _LISTING_CACHE is None:
+        _LISTING_CACHE = ListingCache()
+
+    return _LISTING_CACHE
@@ -0,0 +1,373 @@
+'''
+One poller for all in-flight globus tasks.
+
+Stages register their task IDs with the shared `GlobusTaskMonitor` and await
+the returned future. All outstanding tasks are checked in one batched task
+list query, and the poll interval adapts to how soon the tasks are expected
+to finish. The query runs in an executor thread so it does not block the
+event loop.
+'''
+
+import time
+import asyncio
+from datetime import datetime
+
+from .globus_backends import get_backend, TASK_DONE_STATUSES
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+def _parse_time(timestr):
+    '''
+    Parse the timestamps in the task documents.
+    '''
+
+    if timestr is None:
+        return None
+
+    return datetime.fromisoformat(timestr.replace("Z", "+00:00"))
+
+
+def task_progress(task, total_bytes=None):
+    '''
+    Progress of a task from its task document.
+
+    Parameters
+    ----------
+    task : dict
+        The task document.
+    total_bytes : int, optional
+        Total size of the transfer. Without it, the ETA is estimated from the
+        fraction of completed subtasks.
+
+    Returns
+    -------
+    progress : dict
+        'status', 'bytes_transferred', 'rate' in bytes/s and 'eta' in seconds
+        (None when it cannot be estimated).
+    '''
+
+    bytes_transferred = task.get('bytes_transferred', 0) or 0
+    rate = task.get('effective_bytes_per_second', 0) or 0
+
+    eta = None
+
+    if task['status'] in TASK_DONE_STATUSES:
+        eta = 0.
+
+    elif total_bytes is not None and rate > 0:
+        eta = max(total_bytes - bytes_transferred, 0) / rate
+
+    else:
+        subtasks_total = task.get('subtasks_total', 0) or 0
+        subtasks_pending = task.get('subtasks_pending', 0) or 0
+        subtasks_done = subtasks_total - subtasks_pending
+
+        request_time = _parse_time(task.get('request_time'))
+
+        if subtasks_done > 0 and request_time is not None:
+            elapsed = (datetime.now(request_time.tzinfo) - request_time).total_seconds()
+            eta = elapsed * subtasks_pending / subtasks_done
+
+    return {'status': task['status'],
+            'bytes_transferred': bytes_transferred,
+            'rate': rate,
+            'eta': eta}
+
+
+class GlobusTaskMonitor(object):
+    '''
+    Registry of outstanding globus tasks polled in one loop.
+
+    Parameters
+    ----------
+    min_interval : float, optional
+        Shortest time in seconds between polls.
+    max_interval : float, optional
+        Longest time in seconds between polls.
+    backoff : float, optional
+        Factor to increase the interval by when no task finished and there is
+        no ETA to go by.
+    max_missing_polls : int, optional
+        Number of polls a task can be missing from the task list before it is
+        failed.
+    '''
+
+    def __init__(self, min_interval=30, max_interval=900, backoff=2.,
+                 max_missing_polls=5):
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_missing_polls = max_missing_polls
+
+        self._futures = {}
+        self._num_waiters = {}
+        self._num_missing = {}
+        self._tasks = {}
+        self._total_bytes = {}
+        self._max_intervals = {}
+
+        self._interval = min_interval
+        self._loop = None
+        self._poller = None
+        self._wakeup = None
+
+    def _check_loop(self):
+        '''
+        Reset the registry if used from a new event loop.
+        '''
+
+        loop = asyncio.get_running_loop()
+
+        if loop is not self._loop:
+            self._loop = loop
+            self._futures = {}
+            self._num_waiters = {}
+            self._poller = None
+            self._wakeup = asyncio.Event()
+
+    def watch(self, task_id, total_bytes=None, max_interval=None):
+        '''
+        Register a task and return a future that resolves to the final task
+        document. The future raises a ValueError if the task fails.
+
+        Parameters
+        ----------
+        total_bytes : int, optional
+            Size of the transfer, used for the ETA.
+        max_interval : float, optional
+            Longest time in seconds to go between polls while this task is running.
+        '''
+
+        self._check_loop()
+
+        if task_id not in self._futures:
+            self._futures[task_id] = self._loop.create_future()
+
+        if total_bytes is not None:
+            self._total_bytes[task_id] = total_bytes
+
+        if max_interval is not None:
+            self._max_intervals[task_id] = max_interval
+
+        # Poll soon to pick up the new task.
+        self._interval = self.min_interval
+        self._wakeup.set()
+
+        if self._poller is None or self._poller.done():
+            self._poller = self._loop.create_task(self._poll_loop())
+
+        return self._futures[task_id]
+
+    async def wait(self, task_id, timeout=None, **kwargs):
+        '''
+        Wait for a task to finish. Returns the final task document.
+
+        When the last waiter of a task times out or is cancelled, the task is
+        no longer polled.
+        '''
+
+        future = self.watch(task_id, **kwargs)
+
+        self._num_waiters[task_id] = self._num_waiters.get(task_id, 0) + 1
+
+        try:
+            # Shield so a timeout in one waiter does not cancel the shared future.
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        finally:
+            self._num_waiters[task_id] -= 1
+
+            if self._num_waiters[task_id] == 0:
+                del self._num_waiters[task_id]
+
+                if not future.done():
+                    log.info(f"No one is waiting for globus task {task_id}. "
+                             "Dropping it from the monitor.")
+                    self._forget(task_id)
+
+    def _forget(self, task_id):
+        '''
+        Stop polling a task.
+        '''
+
+        future = self._futures.pop(task_id, None)
+
+        if future is not None and not future.done():
+            future.cancel()
+
+        self._total_bytes.pop(task_id, None)
+        self._max_intervals.pop(task_id, None)
+        self._num_missing.pop(task_id, None)
+
+    def task_document(self, task_id):
+        '''
+        Latest task document of a task, or None if it has not been polled yet.
+        '''
+
+        return self._tasks.get(task_id)
+
+    def progress(self, task_id):
+        '''
+        Latest progress of a task. See `task_progress`.
+        '''
+
+        if task_id not in self._tasks:
+            return None
+
+        return task_progress(self._tasks[task_id],
+                             total_bytes=self._total_bytes.get(task_id))
+
+    def outstanding(self):
+        '''
+        IDs of the tasks that have not finished.
+        '''
+
+        return [task_id for task_id, future in self._futures.items() if not future.done()]
+
+    def poll(self):
+        '''
+        Check all outstanding tasks in one query and resolve the finished ones.
+
+        Returns
+        -------
+        num_finished : int
+        '''
+
+        task_ids = self.outstanding()
+
+        if len(task_ids) == 0:
+            return 0
+
+        return self._resolve(task_ids, get_backend().get_tasks(task_ids))
+
+    def _resolve(self, task_ids, tasks):
+        '''
+        Resolve the futures of the finished tasks in the task documents from
+        a query of `task_ids`. Tasks missing from `max_missing_polls` queries in
+        a row are failed.
+
+        Returns
+        -------
+        num_finished : int
+        '''
+
+        num_finished = 0
+
+        finished_ids = []
+
+        for task in tasks:
+
+            task_id = task['task_id']
+            self._tasks[task_id] = task
+            self._num_missing.pop(task_id, None)
+
+            future = self._futures.get(task_id)
+
+            if future is None or future.done():
+                continue
+
+            if task['status'] == 'SUCCEEDED':
+                future.set_result(task)
+            elif task['status'] in TASK_DONE_STATUSES:
+                future.set_exception(ValueError(f'Transfer {task_id} finished with status '
+                                                f'{task["status"]}: {task.get("nice_status")}'))
+            else:
+                continue
+
+            finished_ids.append(task_id)
+
+        found_ids = set([task['task_id'] for task in tasks])
+
+        for task_id in task_ids:
+
+            if task_id in found_ids:
+                continue
+
+            self._num_missing[task_id] = self._num_missing.get(task_id, 0) + 1
+
+            if self._num_missing[task_id] < self.max_missing_polls:
+                continue
+
+            future = self._futures.get(task_id)
+
+            if future is not None and not future.done():
+                future.set_exception(ValueError(f'Transfer {task_id} was not found in '
+                                                f'{self._num_missing[task_id]} polls.'))
+                finished_ids.append(task_id)
+
+        for task_id in finished_ids:
+            self._total_bytes.pop(task_id, None)
+            self._max_intervals.pop(task_id, None)
+            self._num_missing.pop(task_id, None)
+
+        return len(finished_ids)
+
+    def _next_interval(self, num_finished):
+        '''
+        Poll again at the earliest ETA. Without ETAs, back off when nothing finished.
+        '''
+
+        etas = [progress['eta'] for progress in [self.progress(task_id)
+                                                 for task_id in self.outstanding()]
+                if progress is not None and progress['eta'] is not None]
+
+        if len(etas) > 0:
+            interval = min(etas)
+        elif num_finished > 0:
+            interval = self.min_interval
+        else:
+            interval = self._interval * self.backoff
+
+        max_interval = min([self.max_interval] + list(self._max_intervals.values()))
+
+        return min(max(interval, self.min_interval), max_interval)
+
+    async def _poll_loop(self):
+
+        while len(self.outstanding()) > 0:
+
+            self._wakeup.clear()
+
+            t0 = time.time()
+
+            task_ids = self.outstanding()
+
+            try:
+                tasks = await self._loop.run_in_executor(None, get_backend().get_tasks,
+                                                         task_ids)
+                num_finished = self._resolve(task_ids, tasks)
+            except Exception:
+                log.exception("Failed to poll the globus tasks. Retrying.")
+                num_finished = 0
+
+            self._interval = self._next_interval(num_finished)
+
+            log.debug(f"Polled {len(self.outstanding())} globus tasks in {time.time() - t0:.1f} s. "
+                      f"Next poll in {self._interval:.0f} s.")
+
+            if len(self.outstanding()) == 0:
+                break
+
+            # Sleep until the next poll or until a new task is registered.
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+_TASK_MONITOR = None
+
+
+def get_task_monitor():
+    '''
+    Return the shared task monitor.
+    '''
+
+    global _TASK_MONITOR
+
+    if _TASK_MONITOR is None:
+        _TASK_MONITOR = GlobusTaskMonitor()
+
+    return _TASK_MONITOR
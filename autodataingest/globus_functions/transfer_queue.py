@@ -0,0 +1,169 @@
+'''
+Batched globus transfers across tracks.
+
+Files queued for the same route within `batch_window` seconds are moved with
+one transfer task from `transfer_batch`. Queuing does not block the event loop,
+and the returned futures resolve once the transfer task is submitted.
+'''
+
+import asyncio
+
+from .globus_wrappers import transfer_batch
+
+from ..logging import setup_logging
+log = setup_logging()
+
+
+class TransferQueue(object):
+    '''
+    Queue of (filename, output_destination) pairs, submitted as one transfer
+    task per route.
+
+    Parameters
+    ----------
+    batch_window : float, optional
+        Time in seconds to collect files before submitting the transfer task.
+    max_batch : int, optional
+        Submit right away once this many files are queued for a route.
+
+    Notes
+    -----
+    Queued files that are not submitted before the event loop stops are lost.
+    Use `flush` to submit them early.
+    '''
+
+    def __init__(self, batch_window=30, max_batch=50):
+
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self._loop = None
+        self._pending = {}
+        self._full = {}
+        self._flushers = {}
+
+    def _check_loop(self):
+
+        loop = asyncio.get_running_loop()
+
+        if loop is not self._loop:
+            self._loop = loop
+            self._pending = {}
+            self._full = {}
+            self._flushers = {}
+
+    def enqueue(self, transfers, startnode='cc-cedar', endnode='ingester',
+                label=None,
+                use_rootname=True,
+                use_startnode_datapath=True,
+                use_endnode_datapath=True):
+        '''
+        Queue the (filename, output_destination) pairs of one track. Files that
+        do not exist are left out of the transfer.
+
+        Returns a future that resolves to (task_id, skipped), where `skipped` are
+        the pairs from `transfers` that were left out. `task_id` is None when
+        all of them were left out.
+        '''
+
+        self._check_loop()
+
+        key = (startnode, endnode, use_rootname, use_startnode_datapath, use_endnode_datapath)
+
+        future = self._loop.create_future()
+
+        self._pending.setdefault(key, []).append((list(transfers), label, future))
+
+        if key not in self._full:
+            self._full[key] = asyncio.Event()
+
+        if sum([len(entry[0]) for entry in self._pending[key]]) >= self.max_batch:
+            self._full[key].set()
+
+        if key not in self._flushers or self._flushers[key].done():
+            self._flushers[key] = self._loop.create_task(self._flush_later(key))
+
+        return future
+
+    async def _flush_later(self, key):
+
+        try:
+            await asyncio.wait_for(self._full[key].wait(), self.batch_window)
+        except asyncio.TimeoutError:
+            pass
+
+        await self._flush_key(key)
+
+        # Files queued while the transfer was submitted need their own flush.
+        if len(self._pending.get(key, [])) > 0:
+            self._flushers[key] = self._loop.create_task(self._flush_later(key))
+
+    async def _flush_key(self, key):
+
+        entries = self._pending.pop(key, [])
+        self._full.pop(key, None)
+
+        if len(entries) == 0:
+            return
+
+        startnode, endnode, use_rootname, use_startnode_datapath, use_endnode_datapath = key
+
+        transfers = [pair for pairs, label, future in entries for pair in pairs]
+
+        if len(entries) == 1 and entries[0][1] is not None:
+            label = entries[0][1]
+        else:
+            label = f"batch of {len(transfers)} files from {len(entries)} tracks"
+
+        try:
+            # The existence checks and the submission are blocking calls.
+            task_id, skipped = await self._loop.run_in_executor(
+                None, lambda: transfer_batch(transfers,
+                                             startnode=startnode,
+                                             endnode=endnode,
+                                             label=label,
+                                             skip_if_not_existing=True,
+                                             use_rootname=use_rootname,
+                                             use_startnode_datapath=use_startnode_datapath,
+                                             use_endnode_datapath=use_endnode_datapath,
+                                             return_skipped=True))
+
+        except Exception as exc:
+            log.exception(f"Transfer of {len(transfers)} files from {startnode} to {endnode} failed.")
+            for pairs, label, future in entries:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for pairs, label, future in entries:
+            entry_skipped = [pair for pair in pairs if pair in skipped]
+
+            entry_task_id = None if len(entry_skipped) == len(pairs) else task_id
+
+            if not future.done():
+                future.set_result((entry_task_id, entry_skipped))
+
+    async def flush(self):
+        '''
+        Submit all queued transfers now.
+        '''
+
+        self._check_loop()
+
+        await asyncio.gather(*[self._flush_key(key) for key in list(self._pending)])
+
+
+_TRANSFER_QUEUE = None
+
+
+def get_transfer_queue():
+    '''
+    Return the shared transfer queue.
+    '''
+
+    global _TRANSFER_QUEUE
+
+    if _TRANSFER_QUEUE is None:
+        _TRANSFER_QUEUE = TransferQueue()
+
+    return _TRANSFER_QUEUE
@@ -179,6 +179,38 @@ def find_running_tracks(sheetname='20A - OpLog Summary',
     return running_tracks
 
 
+def get_track_metadata(sheetnames=['20A - OpLog Summary',
+                                   'Archival Track Summary']):
+    """
+    Return a table of the target, configuration and data size (in GB) of every
+    track. This requires one read per sheet.
+    """
+
+    import pandas as pd
+
+    full_sheet = read_tracksheet()
+
+    rows = []
+
+    for sheetname in sheetnames:
+
+        worksheet = full_sheet.worksheet(sheetname)
+
+        # Grab the track info.
+        tracks_info = worksheet.get_all_records()
+
+        for track in tracks_info:
+            rows.append([track['EBID'], track['Target'], track['Configuration'],
+                         str(track.get('Data Size', '')).rstrip('GB'), sheetname])
+
+    tab = pd.DataFrame(rows, columns=['EBID', 'Target', 'Configuration', 'DataSize', 'SheetName'])
+
+    tab['EBID'] = pd.to_numeric(tab['EBID'], errors='coerce')
+    tab['DataSize'] = pd.to_numeric(tab['DataSize'], errors='coerce')
+
+    return tab[tab['EBID'].notnull()].astype({'EBID': int})
+
+
 def return_all_ebids(sheetname='20A - OpLog Summary'):
 
     # Find the right sheet according to sheetname
@@ -331,6 +363,83 @@ def update_cell(ebid, value,
     worksheet.update_cell(cell.row, num_col, value)
 
 
+def update_cells(ebid, values,
+                 sheetname='20A - OpLog Summary'):
+    '''
+    Update multiple cells in the row of an execution block ID with a single write.
+
+    Parameters
+    ----------
+    ebid : str
+        EB ID number of the track.
+    values : dict
+        Column names in the header row of the google sheet, and the value to
+        write in each.
+    sheetname : str, optional
+        Name of tab sheet name.
+
+    '''
+
+    full_sheet = read_tracksheet()
+    worksheet = full_sheet.worksheet(sheetname)
+
+    # Read the header once instead of searching for each column.
+    header = worksheet.row_values(1)
+
+    row = worksheet.find(str(ebid)).row
+
+    cells = []
+    for name_col, value in values.items():
+        if name_col not in header:
+            raise ValueError(f"Unable to find column name {name_col}.")
+
+        cells.append(gspread.Cell(row, header.index(name_col) + 1, value))
+
+    worksheet.update_cells(cells)
+
+
+def update_rows(values,
+                sheetname='20A - OpLog Summary'):
+    '''
+    Update cells in the rows of many execution block IDs with a single write.
+
+    Parameters
+    ----------
+    values : dict
+        For each EB ID, a dict of the column names in the header row and the
+        value to write in each.
+    sheetname : str, optional
+        Name of tab sheet name.
+
+    '''
+
+    if len(values) == 0:
+        return
+
+    full_sheet = read_tracksheet()
+    worksheet = full_sheet.worksheet(sheetname)
+
+    header = worksheet.row_values(1)
+
+    # Find the rows from one read of the EBID column.
+    ebid_rows = {ebid: num + 1 for num, ebid in
+                 enumerate(worksheet.col_values(header.index('EBID') + 1))}
+
+    cells = []
+    for ebid, these_values in values.items():
+
+        if str(ebid) not in ebid_rows:
+            raise ValueError(f"Unable to find EBID {ebid}.")
+
+        for name_col, value in these_values.items():
+            if name_col not in header:
+                raise ValueError(f"Unable to find column name {name_col}.")
+
+            cells.append(gspread.Cell(ebid_rows[str(ebid)], header.index(name_col) + 1, value))
+
+    worksheet.update_cells(cells)
+
+
 def return_cell(ebid,
                 name_col=None,
                 column=9,
@@ -370,6 +479,49 @@ def return_cell(ebid,
     return cell.value
 
 
+def return_cells(ebid, name_cols,
+                 sheetname='20A - OpLog Summary'):
+    '''
+    Return multiple cells in the row of an execution block ID, reading the
+    header and the row once.
+
+    Parameters
+    ----------
+    ebid : str
+        EB ID number of the track.
+    name_cols : list of str
+        Column names in the header row of the google sheet.
+    sheetname : str, optional
+        Name of tab sheet name.
+
+    Returns
+    -------
+    values : dict
+        Value of each column. Empty cells are None.
+    '''
+
+    full_sheet = read_tracksheet()
+    worksheet = full_sheet.worksheet(sheetname)
+
+    header = worksheet.row_values(1)
+
+    row_values = worksheet.row_values(worksheet.find(str(ebid)).row)
+
+    values = {}
+    for name_col in name_cols:
+        if name_col not in header:
+            raise ValueError(f"Unable to find column name {name_col}.")
+
+        col_index = header.index(name_col)
+
+        # Trailing empty cells are not returned.
+        value = row_values[col_index] if col_index < len(row_values) else ""
+
+        values[name_col] = value if value != "" else None
+
+    return values
+
+
 def download_refant_summsheet(ebid,
                               output_folder,
                               data_type='continuum',
@@ -403,6 +555,35 @@ def download_refant_summsheet(ebid,
     return outfilename
 
 
+def write_summary_table(df, worksheet_name='Job Time Summary'):
+    '''
+    Replace the contents of a worksheet in the track sheet with a table. The
+    worksheet is created if it does not exist.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Table to write. The index is written as the first columns.
+    worksheet_name : str, optional
+        Name of the tab sheet.
+    '''
+
+    full_sheet = read_tracksheet()
+
+    df = df.reset_index()
+
+    try:
+        worksheet = full_sheet.worksheet(worksheet_name)
+    except gspread.WorksheetNotFound:
+        worksheet = full_sheet.add_worksheet(title=worksheet_name,
+                                             rows=len(df) + 1, cols=len(df.columns))
+
+    values = [list(df.columns)] + df.astype(object).where(df.notnull(), "").values.tolist()
+
+    worksheet.clear()
+    worksheet.update(values)
+
+
 def get_tracknames(source_name,
                    sheetnames=['20A - OpLog Summary',
                                'Archival Track Summary'],
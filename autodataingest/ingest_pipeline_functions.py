@@ -10,8 +10,9 @@ import os
 from pathlib import Path
 from glob import glob
 import asyncio
-import subprocess
-import shutil
+import tarfile
+from datetime import datetime, timedelta
+import astropy.units as u
 
 from autodataingest.logging import setup_logging
 log = setup_logging()
@@ -19,14 +20,20 @@ log = setup_logging()
 
 from autodataingest.email_notifications.receive_gmail_notifications import (check_for_archive_notification, check_for_job_notification, add_jobtimes)
 
+from autodataingest.email_notifications.notification_index import get_notification_index
+from autodataingest.email_notifications.notification_watcher import get_notification_watcher
+
 from autodataingest.gsheet_tracker.gsheet_functions import (find_new_tracks, update_track_status,
-                                             update_cell, return_cell, download_refant_summsheet)
+                                             update_cell, update_cells, update_rows,
+                                             return_cell, return_cells,
+                                             download_refant_summsheet)
 
 from autodataingest.gsheet_tracker.gsheet_flagging import (download_flagsheet_to_flagtxt)
 
 from autodataingest.globus_functions import (transfer_file, transfer_pipeline,
                                cleanup_source, globus_wait_for_completion,
-                               transfer_general)
+                               transfer_general, transfer_batch,
+                               get_transfer_queue)
 
 from autodataingest.get_track_info import match_ebid_to_source
 
@@ -39,6 +46,11 @@ from autodataingest.ssh_utils import (run_command,
 
 from autodataingest.archive_request import archive_copy_SDM
 
+from autodataingest.submission_journal import (reserve_submission, record_submission,
+                                               check_submission, find_submitted_jobs)
+
+from autodataingest.cluster_capacity import release_capacity, shrink_capacity
+
 # Import dictionary defining the job creation script functions for each
 # cluster.
 from autodataingest.cluster_configs import (JOB_CREATION_FUNCTIONS, CLUSTERADDRS,
@@ -46,6 +58,79 @@ from autodataingest.cluster_configs import (JOB_CREATION_FUNCTIONS, CLUSTERADDRS
 
 from autodataingest.utils import uniquify, uniquify_folder
 
+from autodataingest.qa_build_service import io_slot, timed_step
+
+from autodataingest.product_extraction import extract_selected_members, QA_PRODUCT_MEMBERS
+
+from autodataingest.qa_plot_worker import get_qaplot_worker
+
+from autodataingest.fs_ops import chmod_recursive, remove_tree, move_path, copy_file
+
+# Sheet columns for the job status and run time of each job type.
+JOB_STATS_COLUMNS = {'continuum': ('Continuum reduction', "Continuum job wall time"),
+                     'speclines': ('Line reduction', "Line job wall time"),
+                     'import_and_split': ('Line/continuum split', "Split Job ID")}
+
+
+def set_job_stats_batch(jobs, labelname='Telescope Notifications/20A-346 Cedar Jobs',
+                        markasread=True):
+    '''
+    Write the status and run time of many jobs from their notification emails.
+
+    The mailbox is synced once, and all cells on a sheet are written in one update.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        (auto_pipe, job_id, job_type) for each job.
+
+    Returns
+    -------
+    job_stats : dict
+        (status, run time) for each job ID with a notification.
+    '''
+
+    index = get_notification_index()
+    index.sync(labelname, 'job')
+
+    records = index.lookup('job', [job_id for _, job_id, _ in jobs], labelname=labelname)
+
+    sheet_values = {}
+    job_stats = {}
+
+    for auto_pipe, job_id, job_type in jobs:
+
+        record = records.get(str(job_id))
+
+        if record is None or record['Status'] is None:
+            log.info(f"Unable to find notification for job ID: {job_id}")
+            continue
+
+        if job_type not in JOB_STATS_COLUMNS:
+            log.error(f"Unable to interpret job_type {job_type}")
+            continue
+
+        job_status, job_runtime = record['Status'], record['Runtime']
+
+        log.info(f"Found notification for {job_id}:{job_type} with status {job_status}")
+
+        job_stats[str(job_id)] = (job_status, job_runtime)
+
+        status_col, runtime_col = JOB_STATS_COLUMNS[job_type]
+
+        this_sheet = sheet_values.setdefault(auto_pipe.sheetname, {})
+        this_sheet.setdefault(auto_pipe.ebid, {}).update({status_col: job_status,
+                                                          runtime_col: job_runtime})
+
+    for sheetname, values in sheet_values.items():
+        update_rows(values, sheetname=sheetname)
+
+    if markasread:
+        index.mark_as_read([records[job_id]['MessageID'] for job_id in job_stats])
+
+    return job_stats
+
+
 class AutoPipeline(object):
     """
     Handler for the processing pipeline stages. Each instance is defined by the
@@ -84,18 +169,14 @@ class AutoPipeline(object):
         different stages.
         '''
 
-        target = return_cell(self.ebid,
-                            #  column=4,
-                             name_col="Target",
-                             sheetname=self.sheetname)
-        config = return_cell(self.ebid,
-                            #  column=9,
-                             name_col="Configuration",
-                             sheetname=self.sheetname)
-        track_name = return_cell(self.ebid,
-                                #  column=3,
-                                 name_col='Trackname',
-                                 sheetname=self.sheetname)
+        # Data size in GB is used to predict the job resources.
+        sheet_values = return_cells(self.ebid,
+                                    ["Target", "Configuration", "Trackname", "Data Size"],
+                                    sheetname=self.sheetname)
+
+        target = sheet_values["Target"]
+        config = sheet_values["Configuration"]
+        track_name = sheet_values["Trackname"]
 
         if target is not "None":
             self.target = target
@@ -112,6 +193,11 @@ class AutoPipeline(object):
         else:
             self.track_name = None
 
+        try:
+            self.data_size = float(str(sheet_values["Data Size"]).rstrip('GB'))
+        except ValueError:
+            self.data_size = None
+
     def _qa_review_input(self, data_type='continuum'):
         '''
         Request a restart on the jobs.
@@ -197,6 +283,7 @@ class AutoPipeline(object):
                                            archive_kwargs={},
                                            timewindow=48 * 3600.,
                                            sleeptime=600,
+                                           use_notification_watcher=True,
                                            clustername='cc-cedar',
                                            do_cleanup=True,
                                            default_project_code='20A-346',
@@ -206,6 +293,9 @@ class AutoPipeline(object):
         Step 1.
 
         Request the data be staged from the VLA archive and transfer to destination via globus.
+
+        With `use_notification_watcher=True`, the archive notification is awaited from
+        the shared `NotificationWatcher`. Otherwise the label is checked every `sleeptime`.
         """
 
         ebid = self.ebid
@@ -245,6 +335,12 @@ class AutoPipeline(object):
                                 status_col=2)
 
             # Wait for the notification email that the data is ready for transfer
+            if out is None and use_notification_watcher:
+                event = await get_notification_watcher().wait_for_archive(
+                    ebid, since=datetime.now() - timedelta(seconds=timewindow))
+
+                out = event.path, event.ms_name
+
             while out is None:
                 out = check_for_archive_notification(ebid, timewindow=timewindow,
                                                     project_id=project_code)
@@ -329,9 +425,15 @@ class AutoPipeline(object):
                             status_col=2)
 
         log.info(f"Waiting for globus transfer to {clustername} to complete.")
-        await globus_wait_for_completion(transfer_taskid)
+        await globus_wait_for_completion(transfer_taskid, ebid=self.ebid,
+                                         stage='archive_transfer',
+                                         startnode='nrao-aoc', endnode=clustername)
         log.info(f"Globus transfer {transfer_taskid} completed!")
 
+        # The SDM is now counted in the scratch quota.
+        if self.data_size is not None:
+            shrink_capacity(self.ebid, self.data_size * u.GB)
+
         update_cell(ebid, "TRUE",
                     # num_col=18,
                     name_col='Transferred data',
@@ -340,7 +442,7 @@ class AutoPipeline(object):
         # Remove the data staged at NRAO to avoid exceeding our storage quota
         if do_cleanup:
             log.info(f"Cleaning up {ebid} on nrao-aoc")
-            cleanup_source(self.track_name, node='nrao-aoc')
+            await cleanup_source(self.track_name, node='nrao-aoc')
 
 
     async def setup_for_reduction_pipeline(self,
@@ -439,6 +541,8 @@ class AutoPipeline(object):
                                     continuum_mem=None,
                                     line_mem=None,
                                     scheduler_cmd="",
+                                    bundle_submission=False,
+                                    new_attempt=False,
                                     **ssh_kwargs):
         """
         Step 3.
@@ -454,9 +558,33 @@ class AutoPipeline(object):
 
         Parameters
         -----------
+        bundle_submission : bool, optional
+            Upload all job scripts in one transfer and submit the dependent
+            job chain with a single remote call. See `bundle_job_submission`.
+        new_attempt : bool, optional
+            Start a new submission attempt in the submission journal. Otherwise,
+            jobs already submitted for the current attempt are not submitted again.
+            See `submission_journal.reserve_submission`.
 
         """
 
+        if bundle_submission:
+            return await self.bundle_job_submission(clustername=clustername,
+                                                    scripts_dir=scripts_dir,
+                                                    split_type=split_type,
+                                                    reindex=reindex,
+                                                    casa_version=casa_version,
+                                                    submit_continuum_pipeline=submit_continuum_pipeline,
+                                                    submit_line_pipeline=submit_line_pipeline,
+                                                    split_time=split_time,
+                                                    continuum_time=continuum_time,
+                                                    line_time=line_time,
+                                                    split_mem=split_mem,
+                                                    continuum_mem=continuum_mem,
+                                                    line_mem=line_mem,
+                                                    new_attempt=new_attempt,
+                                                    **ssh_kwargs)
+
         cluster_key = "cedar-robot-generic"
 
         log.info(f"Starting job submission of {self.ebid} on {cluster_key}.")
@@ -489,6 +617,10 @@ class AutoPipeline(object):
         if split_mem is not None:
             slurm_split_kwargs['mem'] = split_mem
 
+        split_entry = reserve_submission(self.ebid, 'import_and_split',
+                                         new_attempt=new_attempt)
+        slurm_split_kwargs['job_token'] = split_entry['Token']
+
         # Create the job script.
         print(JOB_CREATION_FUNCTIONS[clustername]['IMPORT_SPLIT'](
                 target_name=self.track_folder_name.split('_')[0],
@@ -498,14 +630,10 @@ class AutoPipeline(object):
                 reindex=reindex,
                 slurm_kwargs=slurm_split_kwargs,
                 setup_kwargs={},
-                casa_version=casa_version),
+                casa_version=casa_version,
+                data_size=self.data_size),
             file=open(track_scripts_dir / job_split_filename, 'a'))
 
-        # Move the job script to the cluster:
-        log.info(f"Moving import/split job file for {self.ebid} to {cluster_key}")
-        result = connect.put(track_scripts_dir / job_split_filename,
-                             remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
-
         # Setup connection:
         cluster_key_submit = 'cedar-submitter'
         log.info(f"Starting connection to {cluster_key_submit}")
@@ -516,24 +644,35 @@ class AutoPipeline(object):
         # arg0
         chdir_cmd = f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/'
 
-        log.info(f"Submitting job file: {job_split_filename}")
+        # Skip if this attempt was already submitted.
+        split_jobid = check_submission(split_entry)
 
-        try:
-            # Try to avoid needing an extra sacct run in run_job_submission
+        if split_jobid is None:
+            # Move the job script to the cluster:
+            log.info(f"Moving import/split job file for {self.ebid} to {cluster_key}")
+            result = connect.put(track_scripts_dir / job_split_filename,
+                                remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
 
-            result = connect_submit.run(f"{chdir_cmd} {job_split_filename}")
-            split_jobid = result.stdout.replace("\n", '').split(" ")[-1]
+            log.info(f"Submitting job file: {job_split_filename}")
 
-            # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
-            # split_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
-            #                                       self.track_name, 'import_and_split')
-        except ValueError as exc:
-            split_jobid = None
+            try:
+                # Try to avoid needing an extra sacct run in run_job_submission
 
-            connect_submit.close()
-            del connect_submit
+                result = connect_submit.run(f"{chdir_cmd} {job_split_filename}")
+                split_jobid = result.stdout.replace("\n", '').split(" ")[-1]
 
-            raise ValueError(f"Failed to submit split job! See stderr: {exc}")
+                # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
+                # split_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
+                #                                       self.track_name, 'import_and_split')
+            except ValueError as exc:
+                split_jobid = None
+
+                connect_submit.close()
+                del connect_submit
+
+                raise ValueError(f"Failed to submit split job! See stderr: {exc}")
+
+            record_submission(split_entry['Token'], split_jobid)
 
         # Record the job ID so we can check for completion.
         self.importsplit_jobid = split_jobid
@@ -568,6 +707,10 @@ class AutoPipeline(object):
             if continuum_mem is not None:
                 slurm_continuum_kwargs['mem'] = continuum_mem
 
+            continuum_entry = reserve_submission(self.ebid, 'continuum_pipeline_default',
+                                                 new_attempt=new_attempt)
+            slurm_continuum_kwargs['job_token'] = continuum_entry['Token']
+
             print(JOB_CREATION_FUNCTIONS[clustername]['CONTINUUM_PIPE'](
                     target_name=self.track_folder_name.split('_')[0],
                     config=self.track_folder_name.split('_')[1],
@@ -575,26 +718,32 @@ class AutoPipeline(object):
                     slurm_kwargs=slurm_continuum_kwargs,
                     setup_kwargs={},
                     conditional_on_jobnum=self.importsplit_jobid,
-                    casa_version=casa_version),
+                    casa_version=casa_version,
+                    data_size=self.data_size),
                 file=open(track_scripts_dir / job_continuum_filename, 'a'))
 
-            # Move the job script to the cluster:
-            log.info(f"Moving continuum pipeline job file for {self.ebid} to {clustername}")
-            result = connect.put(track_scripts_dir / job_continuum_filename,
-                                remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
+            continuum_jobid = check_submission(continuum_entry)
 
-            log.info(f"Submitting job file: {job_continuum_filename}")
+            if continuum_jobid is None:
+                # Move the job script to the cluster:
+                log.info(f"Moving continuum pipeline job file for {self.ebid} to {clustername}")
+                result = connect.put(track_scripts_dir / job_continuum_filename,
+                                    remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
 
-            try:
-                result = connect_submit.run(f"{chdir_cmd} {job_continuum_filename}")
-                continuum_jobid = result.stdout.replace("\n", '').split(" ")[-1]
+                log.info(f"Submitting job file: {job_continuum_filename}")
 
-                # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
-                # continuum_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
-                #                                            self.track_name, 'continuum_pipeline')
-            except ValueError as exc:
-                continuum_jobid = None
-                raise ValueError(f"Failed to submit continuum pipeline job! See stderr: {exc}")
+                try:
+                    result = connect_submit.run(f"{chdir_cmd} {job_continuum_filename}")
+                    continuum_jobid = result.stdout.replace("\n", '').split(" ")[-1]
+
+                    # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
+                    # continuum_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
+                    #                                            self.track_name, 'continuum_pipeline')
+                except ValueError as exc:
+                    continuum_jobid = None
+                    raise ValueError(f"Failed to submit continuum pipeline job! See stderr: {exc}")
+
+                record_submission(continuum_entry['Token'], continuum_jobid)
 
             # Record the job ID so we can check for completion.
             self.continuum_jobid = continuum_jobid
@@ -632,6 +781,10 @@ class AutoPipeline(object):
             if line_mem is not None:
                 slurm_line_kwargs['mem'] = line_mem
 
+            line_entry = reserve_submission(self.ebid, 'line_pipeline_default',
+                                            new_attempt=new_attempt)
+            slurm_line_kwargs['job_token'] = line_entry['Token']
+
             print(JOB_CREATION_FUNCTIONS[clustername]['LINE_PIPE'](
                     target_name=self.track_folder_name.split('_')[0],
                     config=self.track_folder_name.split('_')[1],
@@ -639,32 +792,38 @@ class AutoPipeline(object):
                     slurm_kwargs=slurm_line_kwargs,
                     setup_kwargs={},
                     conditional_on_jobnum=self.importsplit_jobid,
-                    casa_version=casa_version),
+                    casa_version=casa_version,
+                    data_size=self.data_size),
                 file=open(track_scripts_dir / job_line_filename, 'a'))
 
-            # Move the job script to the cluster:
-            log.info(f"Moving line pipeline job file for {self.ebid} to {clustername}")
-            result = connect.put(track_scripts_dir / job_line_filename,
-                                remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
-
-            log.info(f"Submitting job file: {job_line_filename}")
-
             # Lines
             update_track_status(self.ebid,
                                 message=f"Reduction running on {clustername}",
                                 sheetname=self.sheetname,
                                 status_col=2)
 
-            try:
-                result = connect_submit.run(f"{chdir_cmd} {job_line_filename}")
-                line_jobid = result.stdout.replace("\n", '').split(" ")[-1]
+            line_jobid = check_submission(line_entry)
 
-                # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
-                # line_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
-                #                                       self.track_name, 'line_pipeline')
-            except ValueError as exc:
-                line_jobid = None
-                raise ValueError(f"Failed to submit line pipeline job! See stderr: {exc}")
+            if line_jobid is None:
+                # Move the job script to the cluster:
+                log.info(f"Moving line pipeline job file for {self.ebid} to {clustername}")
+                result = connect.put(track_scripts_dir / job_line_filename,
+                                    remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
+
+                log.info(f"Submitting job file: {job_line_filename}")
+
+                try:
+                    result = connect_submit.run(f"{chdir_cmd} {job_line_filename}")
+                    line_jobid = result.stdout.replace("\n", '').split(" ")[-1]
+
+                    # result = run_command(connect, f"{chdir_cmd} && {submit_cmd}")
+                    # line_jobid = await run_job_submission(connect, f"{chdir_cmd} && {submit_cmd}",
+                    #                                       self.track_name, 'line_pipeline')
+                except ValueError as exc:
+                    line_jobid = None
+                    raise ValueError(f"Failed to submit line pipeline job! See stderr: {exc}")
+
+                record_submission(line_entry['Token'], line_jobid)
 
             # Record the job ID so we can check for completion.
             self.line_jobid = line_jobid
@@ -689,6 +848,186 @@ class AutoPipeline(object):
 
         log.info(f"Finished submitting pipeline for {self.ebid} on {clustername}")
 
+    async def bundle_job_submission(self,
+                                    clustername='cc-cedar',
+                                    scripts_dir=Path('reduction_job_scripts/'),
+                                    split_type='all',
+                                    reindex=False,
+                                    casa_version="6.2",
+                                    submit_continuum_pipeline=True,
+                                    submit_line_pipeline=True,
+                                    split_time=None,
+                                    continuum_time=None,
+                                    line_time=None,
+                                    split_mem=None,
+                                    continuum_mem=None,
+                                    line_mem=None,
+                                    new_attempt=False,
+                                    **ssh_kwargs):
+        """
+        Step 3 with one transfer and one submission.
+
+        The import/split and pipeline job scripts are written locally and moved to
+        the cluster as a single tar file. The job chain is then submitted with one
+        call to the bundle submission robot (auto_scripts/submit_bundle_robot.sh),
+        which holds the import/split job until all dependent jobs are submitted and
+        cancels the whole chain if any submission fails.
+
+        The chain is recorded in the submission journal, so a retry after a hung
+        submission does not submit the jobs again.
+
+        """
+
+        track_scripts_dir = scripts_dir / self.track_folder_name
+
+        if not track_scripts_dir.exists():
+            track_scripts_dir.mkdir()
+
+        target_name, config, trackname = self.track_folder_name.split('_')[:3]
+
+        # Job type, script name, job creation function, slurm kwargs and sheet column.
+        # The import/split job must be first. The others depend on it.
+        job_info = [('split', f"{self.track_folder_name}_{split_type}_job_import_and_split.sh",
+                     'IMPORT_SPLIT', {'job_time': split_time, 'mem': split_mem},
+                     {'split_type': split_type, 'reindex': reindex},
+                     "Split Job ID")]
+
+        if submit_continuum_pipeline:
+            job_info.append(('continuum', f"{self.track_folder_name}_job_continuum.sh",
+                             'CONTINUUM_PIPE', {'job_time': continuum_time, 'mem': continuum_mem},
+                             {}, "Continuum job ID"))
+
+        if submit_line_pipeline:
+            job_info.append(('line', f"{self.track_folder_name}_job_line.sh",
+                             'LINE_PIPE', {'job_time': line_time, 'mem': line_mem},
+                             {}, "Line job ID"))
+
+        journal_job_types = {'split': 'import_and_split',
+                             'continuum': 'continuum_pipeline_default',
+                             'line': 'line_pipeline_default'}
+
+        entries = {info[0]: reserve_submission(self.ebid, journal_job_types[info[0]],
+                                               new_attempt=new_attempt)
+                   for info in job_info}
+
+        log.info(f"Making job files for {self.ebid} or {self.track_folder_name}: "
+                 f"{[info[0] for info in job_info]}")
+
+        for job_type, job_filename, job_func, slurm_kwargs, job_kwargs, _ in job_info:
+
+            slurm_kwargs = {key: val for key, val in slurm_kwargs.items() if val is not None}
+            slurm_kwargs['job_token'] = entries[job_type]['Token']
+
+            # The dependency on the import/split job is set at submission.
+            with open(track_scripts_dir / job_filename, 'w') as f:
+                print(JOB_CREATION_FUNCTIONS[clustername][job_func](
+                        target_name=target_name,
+                        config=config,
+                        trackname=trackname,
+                        slurm_kwargs=slurm_kwargs,
+                        setup_kwargs={},
+                        casa_version=casa_version,
+                        data_size=self.data_size,
+                        **job_kwargs),
+                    file=f)
+
+        bundle_filename = f"{self.track_folder_name}_{split_type}_job_bundle.tar"
+
+        if (track_scripts_dir / bundle_filename).exists():
+            (track_scripts_dir / bundle_filename).unlink()
+
+        with tarfile.open(track_scripts_dir / bundle_filename, 'w') as tar:
+            for info in job_info:
+                tar.add(track_scripts_dir / info[1], arcname=info[1])
+
+        # Check whether a previous try already submitted this chain.
+        jobids = {job_type: entry['JobID'] for job_type, entry in entries.items()}
+
+        if None in jobids.values() and not all(entry['IsNew'] for entry in entries.values()):
+            since = min([datetime.fromisoformat(entry['Updated']) for entry in entries.values()])
+            found_jobids = find_submitted_jobs([entry['Token'] for entry in entries.values()],
+                                               since=since)
+
+            jobids = {job_type: found_jobids.get(entry['Token'])
+                      for job_type, entry in entries.items()}
+
+        if None not in jobids.values():
+            log.info(f"Found jobs already submitted for {self.ebid}: {jobids}. "
+                     "Skipping submission.")
+
+            for job_type, entry in entries.items():
+                record_submission(entry['Token'], jobids[job_type])
+
+        else:
+            cluster_key = "cedar-robot-generic"
+
+            log.info(f"Starting connection to {cluster_key}")
+            connect = await self.setup_ssh_connection(cluster_key, **ssh_kwargs)
+            log.info(f"Returned connection for {cluster_key}")
+
+            log.info(f"Moving job bundle for {self.ebid} to {cluster_key}")
+            connect.put(track_scripts_dir / bundle_filename,
+                        remote=f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/')
+
+            connect.close()
+            del connect
+
+            cluster_key_submit = 'cedar-bundle-submitter'
+
+            log.info(f"Starting connection to {cluster_key_submit}")
+            connect_submit = await self.setup_ssh_connection(cluster_key_submit, **ssh_kwargs)
+            log.info(f"Returned connection for {cluster_key_submit}")
+
+            # arg0 is the directory, arg1 the bundle, arg2 the dependency type, then the
+            # job scripts in submission order.
+            submit_args = [f'{ENDPOINT_INFO[clustername]["data_path"]}/{self.track_folder_name}/',
+                           bundle_filename, 'afterok'] + [info[1] for info in job_info]
+
+            log.info(f"Submitting job bundle: {bundle_filename}")
+
+            try:
+                result = run_command(connect_submit, " ".join(submit_args))
+            except ValueError as exc:
+                raise ValueError(f"Failed to submit job bundle for {self.ebid}! {exc}")
+            finally:
+                connect_submit.close()
+                del connect_submit
+
+            # Last line is "Submitted jobs: SPLITID CONTID LINEID"
+            jobids = result.stdout.strip().split("\n")[-1].split(":")[-1].split()
+
+            if len(jobids) != len(job_info):
+                raise ValueError(f"Unable to parse job IDs for {self.ebid} from: {result.stdout}")
+
+            jobids = dict(zip([info[0] for info in job_info], jobids))
+
+            for job_type, entry in entries.items():
+                record_submission(entry['Token'], jobids[job_type])
+
+        self.importsplit_jobid = jobids['split']
+        self.continuum_jobid = jobids.get('continuum')
+        self.line_jobid = jobids.get('line')
+
+        log.info(f"Submitted jobs for {self.ebid} on {clustername}: {jobids}")
+
+        update_cells(self.ebid,
+                     {info[-1]: f"{clustername}:{jobids[info[0]]}" for info in job_info},
+                     sheetname=self.sheetname)
+
+        if submit_continuum_pipeline:
+            update_track_status(self.ebid,
+                                message=f"Reduction running on {clustername}",
+                                sheetname=self.sheetname,
+                                status_col=1)
+
+        if submit_line_pipeline:
+            update_track_status(self.ebid,
+                                message=f"Reduction running on {clustername}",
+                                sheetname=self.sheetname,
+                                status_col=2)
+
+        log.info(f"Finished submitting pipeline for {self.ebid} on {clustername}")
+
     def set_job_status(self, data_type, job_status):
         """
         Function to set the status of a job based on data type and job status.
@@ -733,40 +1072,7 @@ class AutoPipeline(object):
 
     def set_job_stats(self, job_id, job_type):
 
-        job_check = check_for_job_notification(job_id)
-
-        if job_check is None:
-            log.info(f"Unable to find notification for job ID: {job_id}")
-            return
-
-        job_status, job_runtime =  job_check
-
-        log.info(f"Found notification for {job_id}:{job_type} with status {job_status}")
-
-        if job_type == "continuum":
-            update_cell(self.ebid, job_status,
-                        name_col='Continuum reduction',
-                        sheetname=self.sheetname)
-            update_cell(self.ebid, job_runtime,
-                        name_col="Continuum job wall time",
-                        sheetname=self.sheetname)
-        elif job_type == "speclines":
-            update_cell(self.ebid, job_status,
-                        name_col='Line reduction',
-                        sheetname=self.sheetname)
-            update_cell(self.ebid, job_runtime,
-                        name_col="Line job wall time",
-                        sheetname=self.sheetname)
-        elif job_type == "import_and_split":
-            update_cell(self.ebid, job_status,
-                        name_col='Line/continuum split',
-                        sheetname=self.sheetname)
-            update_cell(self.ebid, job_runtime,
-                        name_col="Split Job ID",
-                        sheetname=self.sheetname)
-        else:
-            log.error(f"Unable to interpret job_type {job_type}")
-
+        set_job_stats_batch([(self, job_id, job_type)])
 
     async def transfer_pipeline_products(self, data_type='speclines',
                                          startnode='cc-cedar',
@@ -796,11 +1102,11 @@ class AutoPipeline(object):
         # Going to the ingester instance. Doesn't need an extra path.
         output_destination = "/"
 
-        transfer_taskid = transfer_general(filename, output_destination,
-                                           startnode=startnode,
-                                           endnode=endnode,
-                                           wait_for_completion=False,
-                                           skip_if_not_existing=True)
+        transfer_taskid = await transfer_general(filename, output_destination,
+                                                 startnode=startnode,
+                                                 endnode=endnode,
+                                                 wait_for_completion=False,
+                                                 skip_if_not_existing=True)
 
         if transfer_taskid is None:
             return
@@ -810,7 +1116,9 @@ class AutoPipeline(object):
         log.info(f"The globus transfer ID is: {transfer_taskid}")
 
         log.info(f"Waiting for globus transfer to {endnode} to complete.")
-        await globus_wait_for_completion(transfer_taskid, sleeptime=180)
+        await globus_wait_for_completion(transfer_taskid, sleeptime=180,
+                                         ebid=self.ebid, stage='pipeline_products',
+                                         startnode=startnode, endnode=endnode)
         log.info(f"Globus transfer {transfer_taskid} completed!")
 
     async def make_flagging_sheet(self, data_type='continuum',
@@ -857,9 +1165,13 @@ class AutoPipeline(object):
 
     def make_qa_products(self, data_type='speclines',
                          verbose=False,
-                         do_update_track_status=True):
+                         do_update_track_status=True,
+                         timings=None):
         '''
         Create the QA products for the QA webserver.
+
+        The time spent extracting, plotting and publishing the products is
+        added to the `timings` dict when it is given (see `qa_build_service`).
         '''
 
         if not data_type in ['speclines', 'continuum']:
@@ -887,73 +1199,24 @@ class AutoPipeline(object):
         temp_path = product_file.with_suffix("")
 
         if os.path.exists(temp_path):
-            shutil.rmtree(temp_path)
+            remove_tree(temp_path)
 
         os.mkdir(temp_path)
 
-        # Extract weblog
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/weblog.tgz"]
-
-        task_weblog1 = subprocess.run(task_command, capture_output=True)
-
-        # Extract cal plots
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/finalBPcal_txt"]
-
-        task_caltxt = subprocess.run(task_command, capture_output=True)
-
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/final_caltable_txt"]
-
-        task_caltxt = subprocess.run(task_command, capture_output=True)
+        with timed_step(timings, 'extract'), io_slot():
 
-        # Extract scan plots
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/scan_plots_txt"]
+            # Extract the QA products in one pass over the tar file. The
+            # weblog.tgz is unpacked into weblog/ as it is read.
+            extract_selected_members(product_file, temp_path, QA_PRODUCT_MEMBERS,
+                                     strip_components=1,
+                                     unpack_nested={"products/weblog.tgz": "weblog"})
 
-        task_scantxt = subprocess.run(task_command, capture_output=True)
+            # Update the weblog file permissions for the webserver
+            # We restrict the permission via the webserver on transfer.
+            chmod_recursive(temp_path / 'weblog', 0o775)
 
-        # Extract quicklook images
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/quicklook_imaging"]
-
-        task_qlimages = subprocess.run(task_command, capture_output=True)
-
-        # Extract quicklook images
-        task_command = ['tar', '--strip-components=1', '-C',
-                        f"{temp_path}", '-xf', f"{product_file}",
-                        "products/spw_definitions.npy"]
-
-        task_spwdict = subprocess.run(task_command, capture_output=True)
-
-        cur_dir = os.getcwd()
-
-        os.chdir(temp_path)
-
-        # Extract the weblog
-        os.mkdir('weblog')
-
-        task_command = ['tar', '--strip-components=1', '-C',
-                        "weblog", '-xf', "weblog.tgz"]
-
-        task_weblog2 = subprocess.run(task_command, capture_output=True)
-
-        # Update the weblog file permissions for the webserver
-        # We restrict the permission via the webserver on transfer.
-        task_command = ['chmod', '-R', '775', "weblog"]
-        task_weblogchmod = subprocess.run(task_command, capture_output=True)
-
-        if verbose:
-            log.info(f"The extracted files are: {os.listdir()}")
-
-        if os.path.exists('weblog'):
-            os.remove('weblog.tgz')
+            if verbose:
+                log.info(f"The extracted files are: {os.listdir(temp_path)}")
 
         # Generate the QA products:
         if data_type == 'continuum':
@@ -963,80 +1226,58 @@ class AutoPipeline(object):
         else:
             raise ValueError(f"data_type must be 'continuum' or 'speclines'. Given {data_type}")
 
-        kwarg_strs = f"flagging_sheet_link='{flagging_sheet_link}', show_target_linesonly=True"
-
-        task_command = ['ipython', '-c',
-                        f'"import qaplotter; qaplotter.make_all_plots({kwarg_strs})"']
+        with timed_step(timings, 'qaplot'):
 
-        log.info(f"Running qaplotting.")
-        log.info(" ".join(task_command))
-
-        task_qaplot_make = subprocess.run(task_command, capture_output=True)
-
-        if task_qaplot_make.returncode != 0:
-            log.info(task_qaplot_make.stdout)
-            log.info("qaplotter failure. Check products.")
-
-            if do_update_track_status:
-                update_track_status(self.ebid, message="ISSUE: qaplotter failure",
-                                    sheetname=self.sheetname,
-                                    status_col=1 if data_type == 'continuum' else 2)
+            # qaplotter runs in a persistent worker process with the
+            # folders in temp_path passed explicitly.
+            log.info(f"Running qaplotting on {temp_path}")
 
+            try:
+                qaplot_success, qaplot_error = \
+                    get_qaplot_worker().make_all_plots(temp_path,
+                                                       flagging_sheet_link=flagging_sheet_link,
+                                                       show_target_linesonly=True)
+            except (ImportError, TimeoutError) as exc:
+                qaplot_success, qaplot_error = False, str(exc)
 
-        # Clean up the original txt files and images. These are kept in
-        # the tar files and do not need to be duplicated on the webserver.
-        task_command = ['rm', '-r', "quicklook_images"]
-        task_cleanup = subprocess.run(task_command, capture_output=True)
-        task_command = ['rm', '-r', "final_caltable_txt"]
-        task_cleanup = subprocess.run(task_command, capture_output=True)
-        task_command = ['rm', '-r', "scan_plots_txt"]
-        task_cleanup = subprocess.run(task_command, capture_output=True)
+            if not qaplot_success:
+                log.info(qaplot_error)
+                log.info("qaplotter failure. Check products.")
 
-        # Return the original directory
-        os.chdir(cur_dir)
+                if do_update_track_status:
+                    update_track_status(self.ebid, message="ISSUE: qaplotter failure",
+                                        sheetname=self.sheetname,
+                                        status_col=1 if data_type == 'continuum' else 2)
 
-        # Check if the name is already in the qa path:
 
-        new_qa_path = qa_path / os.path.split(temp_path)[-1]
-        # Add a unique 1,2,3, etc to make sure the name is unique
-        new_qa_path =  uniquify_folder(new_qa_path)
+        with timed_step(timings, 'publish'), io_slot():
 
-        # Open permission for the webserver to read and access the files
-        # Allow write so that the webserver's rsync can remove the source
-        # files after transfer. Then we don't keep 2 copies everytime.
-        task_command = ['chmod', '-R', '775', temp_path]
+            # Clean up the original txt files and images. These are kept in
+            # the tar files and do not need to be duplicated on the webserver.
+            for folder in ["quicklook_images", "final_caltable_txt", "scan_plots_txt"]:
+                remove_tree(temp_path / folder, missing_ok=True)
 
-        task_chmod = subprocess.run(task_command, capture_output=True)
-        log.debug(f"The task was: {task_command}")
-        task_chmod_stdout = task_chmod.stdout.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stdout: {task_chmod_stdout}")
-        task_chmod_stderr = task_chmod.stderr.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stderr: {task_chmod_stderr}")
+            # Check if the name is already in the qa path:
 
-        # Move to the directory of the webserver:
-        task_command = ['mv', temp_path, new_qa_path]
+            new_qa_path = qa_path / os.path.split(temp_path)[-1]
+            # Add a unique 1,2,3, etc to make sure the name is unique
+            new_qa_path =  uniquify_folder(new_qa_path)
 
-        task_move = subprocess.run(task_command, capture_output=True)
-        log.debug(f"The task was: {task_command}")
-        task_move_stdout = task_move.stdout.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stdout: {task_move_stdout}")
-        task_move_stderr = task_move.stderr.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stderr: {task_move_stderr}")
+            # Open permission for the webserver to read and access the files
+            # Allow write so that the webserver's rsync can remove the source
+            # files after transfer. Then we don't keep 2 copies everytime.
+            chmod_recursive(temp_path, 0o775)
 
-        # Now move the tar file to "processed" folder:
-        proced_folder = data_path / "processed"
-        proced_folder.mkdir(parents=True, exist_ok=True)
+            # Move to the directory of the webserver:
+            move_path(temp_path, new_qa_path)
 
-        proced_file = uniquify(proced_folder / product_tarname)
+            # Now move the tar file to "processed" folder:
+            proced_folder = data_path / "processed"
+            proced_folder.mkdir(parents=True, exist_ok=True)
 
-        task_command = ['mv', product_file, proced_file]
+            proced_file = uniquify(proced_folder / product_tarname)
 
-        task_move = subprocess.run(task_command, capture_output=True)
-        log.debug(f"The task was: {task_command}")
-        task_move_stdout = task_move.stdout.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stdout: {task_move_stdout}")
-        task_move_stderr = task_move.stderr.decode('utf-8').replace("\n", " ")
-        log.debug(f"Stderr: {task_move_stderr}")
+            move_path(product_file, proced_file)
 
         # Update track status
         if do_update_track_status:
@@ -1107,9 +1348,7 @@ class AutoPipeline(object):
 
             newfilename = track_scripts_dir / f'manual_flagging_{data_type}.txt'
 
-            task_command = ['cp', filename, newfilename]
-
-            task_copy = subprocess.run(task_command, capture_output=True)
+            copy_file(filename, newfilename)
 
             cluster_key = 'cedar-robot-generic'
             log.info(f"Starting connection to {cluster_key}")
@@ -1158,9 +1397,7 @@ class AutoPipeline(object):
 
             newfilename = track_scripts_dir / f'refantignore_{data_type}.txt'
 
-            task_command = ['cp', refant_filename, newfilename]
-
-            task_copy = subprocess.run(task_command, capture_output=True)
+            copy_file(refant_filename, newfilename)
 
             cluster_key = 'cedar-robot-generic'
 
@@ -1189,20 +1426,28 @@ class AutoPipeline(object):
                                    scheduler_cmd='',
                                    reindex=False,
                                    casa_version=6.2,
-                                   pipeline_branch='main'):
+                                   pipeline_branch='main',
+                                   bundle_submission=False,
+                                   submit_jobs=True):
 
         """
         Step 7.
 
         After QA, supplies an additional manual flagging script to re-run the pipeline
         calibration.
+
+        With `submit_jobs=False`, only the track is prepared for the re-run. This is
+        used to submit many tracks together as job arrays (see
+        `campaign_submission.campaign_job_submission`).
+
+        Returns True when a restart was requested and False otherwise.
         """
 
         status_flag = self._qa_review_input(data_type=data_type)
 
         if status_flag != "RESTART":
             log.debug("No restart requested. Exiting")
-            return
+            return False
 
         update_track_status(self.ebid, message=f"Restarting pipeline for re-run",
                             sheetname=self.sheetname,
@@ -1228,6 +1473,9 @@ class AutoPipeline(object):
         await self.setup_for_reduction_pipeline(clustername=clustername,
                                                 pipeline_branch=pipeline_branch)
 
+        if not submit_jobs:
+            return True
+
         await self.initial_job_submission(clustername=clustername,
                                         scripts_dir=Path('reduction_job_scripts/'),
                                         split_type=data_type,
@@ -1242,13 +1490,17 @@ class AutoPipeline(object):
                                         continuum_mem=continuum_mem,
                                         line_mem=line_mem,
                                         scheduler_cmd=scheduler_cmd,
-                                        casa_version=casa_version)
+                                        casa_version=casa_version,
+                                        bundle_submission=bundle_submission,
+                                        new_attempt=True)
 
         update_track_status(self.ebid,
                             message=f"Reduction running on {clustername} after QA check",
                             sheetname=self.sheetname,
                             status_col=1 if data_type == 'continuum' else 2)
 
+        return True
+
     async def cleanup_on_cluster(self, clustername='cc-cedar', data_type='continuum',
                                  do_remove_whole_track=False,
                                  do_only_remove_ms=False,
@@ -1296,6 +1548,10 @@ class AutoPipeline(object):
 
         log.info(f"Finished clean up on {clustername} with {rm_command}")
 
+        # The track no longer uses scratch space.
+        if do_remove_whole_track:
+            release_capacity(self.ebid)
+
         if do_cleanup_tempstorage:
             log.info(f"Cleaning up temp project space on {clustername} for track {self.ebid}")
 
@@ -1324,25 +1580,31 @@ class AutoPipeline(object):
         path_to_products = f'{self.track_folder_name}/{self.track_folder_name}_{data_type}/'
 
         filename = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split.tar'
+        filename_cals = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split_calibrators.tar'
 
         # Going to the ingester instance. Doesn't need an extra path.
         output_destination = project_dir
 
-        log.info(f"Filename to transfer is: {filename}")
+        log.info(f"Filenames to transfer are: {filename} {filename_cals}")
         log.info(f"Transferring to: {output_destination}")
 
-        transfer_taskid = transfer_general(filename, output_destination,
-                                           startnode=clustername,
-                                           endnode=clustername,
-                                           wait_for_completion=False,
-                                           skip_if_not_existing=True,
-                                           remove_existing=False,
-                                           use_startnode_datapath=True,
-                                           use_endnode_datapath=False,
-                                           use_rootname=True)
-
-        if transfer_taskid is None:
-            log.info(f"No transfer task ID returned. Check existence of {filename}."
+        # Move the MS and the split calibrator MS in one task, shared with
+        # other tracks queued at the same time.
+        transfer_taskid, skipped = \
+            await get_transfer_queue().enqueue([(filename, output_destination),
+                                                (filename_cals, output_destination)],
+                                               startnode=clustername,
+                                               endnode=clustername,
+                                               label=f"{self.track_folder_name} {data_type} calibrated",
+                                               use_startnode_datapath=True,
+                                               use_endnode_datapath=False,
+                                               use_rootname=True)
+
+        if (filename_cals, output_destination) in skipped:
+            log.warning(f"{filename_cals} does not exist and was not transferred.")
+
+        if transfer_taskid is None or (filename, output_destination) in skipped:
+            log.info(f"No transfer task ID returned. Check existence of {filename} and {filename_cals}."
                   " Exiting completion process.")
 
             update_track_status(self.ebid,
@@ -1350,54 +1612,19 @@ class AutoPipeline(object):
                     sheetname=self.sheetname,
                     status_col=1 if data_type == 'continuum' else 2)
 
-            raise ValueError(f"No transfer task ID returned. Check existence of {filename}."
+            raise ValueError(f"No transfer task ID returned. Check existence of {filename} and {filename_cals}."
                   " Exiting completion process.")
 
-            return
-
         self.transfer_taskid = transfer_taskid
 
         log.info(f"The globus transfer ID is: {transfer_taskid}")
 
-        # Next transfer the split calibrator MS
-        filename_cals = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split_calibrators.tar'
-
-        log.info(f"Filename to transfer is: {filename_cals}")
-        log.info(f"Transferring to: {output_destination}")
-
-        transfer_taskid_cals = transfer_general(filename_cals, output_destination,
-                                                startnode=clustername,
-                                                endnode=clustername,
-                                                wait_for_completion=False,
-                                                skip_if_not_existing=True,
-                                                remove_existing=False,
-                                                use_startnode_datapath=True,
-                                                use_endnode_datapath=False,
-                                                use_rootname=True)
-
-        if transfer_taskid_cals is None:
-            log.debug(f"No transfer task ID returned. Check existence of {filename_cals}."
-                  " Exiting completion process.")
-
-            update_track_status(self.ebid,
-                    message=f"ISSUE: globus transfer failed.",
-                    sheetname=self.sheetname,
-                    status_col=1 if data_type == 'continuum' else 2)
-
-            raise ValueError(f"No transfer task ID returned. Check existence of {filename_cals}."
-                  " Exiting completion process.")
-
-            return
-
-        log.info(f"The globus transfer ID for cals is: {transfer_taskid_cals}")
-
         log.info(f"Waiting for globus transfer to {clustername} to complete.")
-        await globus_wait_for_completion(transfer_taskid, sleeptime=180)
+        await globus_wait_for_completion(transfer_taskid, sleeptime=180,
+                                         ebid=self.ebid, stage='calibrated_data',
+                                         startnode=clustername, endnode=clustername)
         log.info(f"Globus transfer {transfer_taskid} completed!")
 
-        await globus_wait_for_completion(transfer_taskid_cals, sleeptime=180)
-        log.info(f"Globus transfer {transfer_taskid_cals} completed!")
-
         log.info("Clean-up ms file on scratch")
         await self.cleanup_on_cluster(clustername=clustername, data_type=data_type,
                                       do_remove_whole_track=False,
@@ -1437,24 +1664,31 @@ class AutoPipeline(object):
         # These paths point to MS location on project space.
         path_to_products = staging_dir
         filename = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split.tar'
+        filename_cals = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split_calibrators.tar'
 
         # Going to the ingester instance. Doesn't need an extra path.
         output_destination = project_dir
 
-        log.info(f"Filename to transfer is: {filename}")
-        log.info(f"Transferring to: {output_destination}")
-
-        transfer_taskid = transfer_general(filename, output_destination,
-                                           startnode=clustername,
-                                           endnode=clustername,
-                                           wait_for_completion=False,
-                                           skip_if_not_existing=True,
-                                           use_startnode_datapath=False,
-                                           use_endnode_datapath=False,
-                                           use_rootname=True)
-
-        if transfer_taskid is None:
-            log.debug(f"No transfer task ID returned. Check existence of {filename}."
+        log.info(f"Filenames to transfer are: {filename} {filename_cals}")
+        log.info(f"Transferring to: {output_destination} and {project_cals_dir}")
+
+        # Move the MS and the split calibrator MS in one task, shared with
+        # other tracks queued at the same time.
+        transfer_taskid, skipped = \
+            await get_transfer_queue().enqueue([(filename, output_destination),
+                                                (filename_cals, project_cals_dir)],
+                                               startnode=clustername,
+                                               endnode=clustername,
+                                               label=f"{self.track_folder_name} {data_type} export",
+                                               use_startnode_datapath=False,
+                                               use_endnode_datapath=False,
+                                               use_rootname=True)
+
+        if (filename_cals, project_cals_dir) in skipped:
+            log.warning(f"{filename_cals} does not exist and was not transferred.")
+
+        if transfer_taskid is None or (filename, output_destination) in skipped:
+            log.debug(f"No transfer task ID returned. Check existence of {filename} and {filename_cals}."
                     " Exiting completion process.")
             return
 
@@ -1462,32 +1696,12 @@ class AutoPipeline(object):
 
         log.info(f"The globus transfer ID is: {transfer_taskid}")
 
-        filename_cals = f'{path_to_products}/{self.track_folder_name}.{data_type}.ms.split_calibrators.tar'
-
-        log.info(f"Filename to transfer is: {filename_cals}")
-        log.info(f"Transferring to: {project_cals_dir}")
-
-        transfer_taskid_cals = transfer_general(filename_cals, project_cals_dir,
-                                                startnode=clustername,
-                                                endnode=clustername,
-                                                wait_for_completion=False,
-                                                skip_if_not_existing=True,
-                                                use_startnode_datapath=False,
-                                                use_endnode_datapath=False,
-                                                use_rootname=True)
-
-        if transfer_taskid_cals is None:
-            log.debug(f"No transfer task ID returned. Check existence of {filename_cals}."
-                    " Exiting completion process.")
-            return
-
         log.info(f"Waiting for globus transfer to {clustername} to complete.")
-        await globus_wait_for_completion(transfer_taskid, sleeptime=180)
+        await globus_wait_for_completion(transfer_taskid, sleeptime=180,
+                                         ebid=self.ebid, stage='export_imaging',
+                                         startnode=clustername, endnode=clustername)
         log.info(f"Globus transfer {transfer_taskid} completed!")
 
-        await globus_wait_for_completion(transfer_taskid_cals, sleeptime=180)
-        log.info(f"Globus transfer {transfer_taskid_cals} completed!")
-
         # Update track status. Append both data types if one has already finished
         other_data_type = "speclines" if data_type == 'continuum' else 'continuum'
         current_status = return_cell(self.ebid,
@@ -1538,7 +1752,7 @@ class AutoPipeline(object):
         del connect
 
         # Last, make sure we have cleaned up the SDM on AOC:
-        cleanup_source(self.track_name, node='nrao-aoc')
+        await cleanup_source(self.track_name, node='nrao-aoc')
 
         # Remove completion flag to avoid re-runs
         update_cell(self.ebid, "",
@@ -1611,11 +1825,11 @@ class AutoPipeline(object):
         # Going to the ingester instance. Doesn't need an extra path.
         output_destination = "pipeline_failures/"
 
-        transfer_taskid = transfer_general(filename, output_destination,
-                                           startnode=startnode,
-                                           endnode=endnode,
-                                           wait_for_completion=False,
-                                           skip_if_not_existing=True)
+        transfer_taskid = await transfer_general(filename, output_destination,
+                                                 startnode=startnode,
+                                                 endnode=endnode,
+                                                 wait_for_completion=False,
+                                                 skip_if_not_existing=True)
 
         if transfer_taskid is None:
             return
@@ -1625,7 +1839,9 @@ class AutoPipeline(object):
         log.info(f"The globus transfer ID is: {transfer_taskid}")
 
         log.info(f"Waiting for globus transfer to {endnode} to complete.")
-        await globus_wait_for_completion(transfer_taskid, sleeptime=180)
+        await globus_wait_for_completion(transfer_taskid, sleeptime=180,
+                                         ebid=self.ebid, stage='qa_failures',
+                                         startnode=startnode, endnode=endnode)
         log.info(f"Globus transfer {transfer_taskid} completed!")
 
         # TODO: link this into the webserver to easily view the weblog for failures
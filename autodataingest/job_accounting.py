@@ -0,0 +1,388 @@
+'''
+Record the resource usage of the pipeline jobs from slurm accounting.
+
+This lets us compare what we request (memory, wall time) against what the
+jobs actually use.
+'''
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from .job_monitor import get_slurm_job_monitor, parse_slurm_timedelta, FINISHED_STATES
+from .cluster_configs import local_db_path
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+JOB_ACCOUNTING_DB = local_db_path('job_accounting.db')
+
+# Columns stored per job. Times are in seconds and memory/disk in bytes.
+JOB_RESOURCE_COLUMNS = ['JobID', 'EBID', 'TrackName', 'Target', 'Configuration',
+                        'DataSize', 'JobType', 'State', 'Elapsed', 'TotalCPU',
+                        'MaxRSS', 'MaxDiskRead', 'MaxDiskWrite', 'ReqMem', 'Timelimit',
+                        'End']
+
+# TARGET_CONFIG_PROJ.sbNUM.ebNUM.MJD
+TRACKNAME_PATTERN = r"^(?P<Target>.+)_(?P<Configuration>[^_]+)_[^_]+$"
+
+
+def _connect_db(db_path):
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    conn = sqlite3.connect(db_path)
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS job_resources (
+                    JobID INTEGER PRIMARY KEY, EBID INTEGER, TrackName TEXT,
+                    Target TEXT, Configuration TEXT, DataSize REAL, JobType TEXT,
+                    State TEXT, Elapsed REAL, TotalCPU REAL, MaxRSS REAL,
+                    MaxDiskRead REAL, MaxDiskWrite REAL, ReqMem REAL,
+                    Timelimit REAL, End TEXT)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_job_resources_type
+                    ON job_resources (JobType, Configuration)''')
+
+    return conn
+
+
+def record_job_resources(df, track_info=None, db_path=JOB_ACCOUNTING_DB):
+    '''
+    Store the resource usage of finished jobs. Existing entries for a JobID
+    are replaced.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Job table from `get_slurm_job_monitor`.
+    track_info : pandas.DataFrame, optional
+        Table from `gsheet_functions.get_track_metadata`. Used to add the data
+        size and the configuration from the sheet.
+    db_path : str, optional
+        Local sqlite file to store the job usage in.
+    '''
+
+    df = df[df['State'].astype(str).isin(FINISHED_STATES)].copy()
+
+    if len(df) == 0:
+        return 0
+
+    df = pd.concat([df, df['TrackName'].str.extract(TRACKNAME_PATTERN)], axis=1)
+
+    if track_info is not None:
+        sheet_info = track_info.drop_duplicates(subset='EBID').set_index('EBID')
+
+        df['DataSize'] = df['EBID'].map(sheet_info['DataSize'])
+        df['Configuration'] = df['EBID'].map(sheet_info['Configuration']).fillna(df['Configuration'])
+    else:
+        df['DataSize'] = np.nan
+
+    for field in ['Elapsed', 'TotalCPU', 'Timelimit']:
+        df[field] = df[field].dt.total_seconds()
+
+    df['State'] = df['State'].astype(str)
+    df['End'] = df['End'].astype(str)
+
+    df = df[JOB_RESOURCE_COLUMNS].astype(object).where(df[JOB_RESOURCE_COLUMNS].notnull(), None)
+
+    with _connect_db(db_path) as conn:
+        conn.executemany(f"INSERT OR REPLACE INTO job_resources VALUES "
+                         f"({','.join(['?'] * len(JOB_RESOURCE_COLUMNS))})",
+                         df.itertuples(index=False, name=None))
+    conn.close()
+
+    log.info(f"Recorded resource usage for {len(df)} jobs in {db_path}")
+
+    return len(df)
+
+
+def load_job_resources(db_path=JOB_ACCOUNTING_DB, job_type=None, config=None):
+    '''
+    Return the stored job resource usage, optionally for one job type
+    and/or configuration.
+    '''
+
+    query = "SELECT * FROM job_resources"
+
+    conditions = []
+    params = []
+    if job_type is not None:
+        conditions.append("JobType = ?")
+        params.append(job_type)
+    if config is not None:
+        conditions.append("Configuration = ?")
+        params.append(config)
+
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+
+    with _connect_db(db_path) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def collect_job_resources(connect, time_range_days=14, track_info=None,
+                          db_path=JOB_ACCOUNTING_DB):
+    '''
+    Pull the accounting info for all pipeline jobs finished within
+    `time_range_days` and store them locally.
+    '''
+
+    df = get_slurm_job_monitor(connect, time_range_days=time_range_days)
+
+    return record_job_resources(df, track_info=track_info, db_path=db_path)
+
+
+def summarize_job_resources(df=None, by=['JobType', 'Configuration'],
+                            db_path=JOB_ACCOUNTING_DB,
+                            completed_only=True):
+    '''
+    Summary statistics of the memory and wall time used compared to the
+    requested values.
+
+    The `*_frac` columns give the used/requested fractions. Small values
+    mean we are over-requesting.
+    '''
+
+    if df is None:
+        df = load_job_resources(db_path=db_path)
+
+    if completed_only:
+        df = df[df['State'] == 'COMPLETED']
+
+    df = df.assign(MaxRSS_GB=df['MaxRSS'] / 1024**3,
+                   ReqMem_GB=df['ReqMem'] / 1024**3,
+                   Elapsed_hr=df['Elapsed'] / 3600.,
+                   Timelimit_hr=df['Timelimit'] / 3600.,
+                   mem_frac=df['MaxRSS'] / df['ReqMem'],
+                   time_frac=df['Elapsed'] / df['Timelimit'],
+                   cpu_efficiency=df['TotalCPU'] / df['Elapsed'])
+
+    summary = df.groupby(by).agg(num_jobs=('JobID', 'count'),
+                                 MaxRSS_GB_median=('MaxRSS_GB', 'median'),
+                                 MaxRSS_GB_max=('MaxRSS_GB', 'max'),
+                                 ReqMem_GB_median=('ReqMem_GB', 'median'),
+                                 Elapsed_hr_median=('Elapsed_hr', 'median'),
+                                 Elapsed_hr_max=('Elapsed_hr', 'max'),
+                                 Timelimit_hr_median=('Timelimit_hr', 'median'),
+                                 mem_frac_median=('mem_frac', 'median'),
+                                 time_frac_median=('time_frac', 'median'),
+                                 cpu_efficiency_median=('cpu_efficiency', 'median'))
+
+    return summary
+
+
+def format_slurm_timedelta(values):
+    '''
+    Format timedeltas (or times in seconds) as slurm D-HH:MM:SS strings.
+    Missing values are returned as empty strings.
+    '''
+
+    values = pd.Series(values)
+
+    if pd.api.types.is_timedelta64_dtype(values):
+        seconds = values.dt.total_seconds()
+    else:
+        seconds = values.astype(float)
+
+    is_valid = seconds.notnull()
+
+    seconds = seconds.fillna(0).astype(np.int64)
+
+    days, seconds = np.divmod(seconds, 86400)
+    hours, seconds = np.divmod(seconds, 3600)
+    minutes, seconds = np.divmod(seconds, 60)
+
+    timestrs = (days.astype(str) + "-" + hours.astype(str).str.zfill(2) + ":" +
+                minutes.astype(str).str.zfill(2) + ":" + seconds.astype(str).str.zfill(2))
+
+    return timestrs.where(is_valid, "")
+
+
+def summarize_job_times(df=None, by=['Target', 'Configuration'], job_type=None,
+                        db_path=JOB_ACCOUNTING_DB,
+                        completed_only=False):
+    '''
+    Total and median wall and CPU time of the jobs per group (e.g., per
+    'TrackName', 'Target' or 'Configuration').
+
+    Parameters
+    ----------
+    df : pandas.DataFrame, optional
+        Job table from `load_job_resources` (times in seconds) or from
+        `get_slurm_job_monitor` (times as timedeltas or slurm strings).
+        Loaded from `db_path` by default.
+    by : list, optional
+        Columns to group by.
+    job_type : str, optional
+        Only include this job type.
+    completed_only : bool, optional
+        Only include completed jobs. Otherwise the time of failed jobs
+        is included.
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The hour columns and the total times as D-HH:MM:SS strings for the
+        summary sheet.
+    '''
+
+    if df is None:
+        df = load_job_resources(db_path=db_path, job_type=job_type)
+    elif job_type is not None:
+        df = df[df['JobType'] == job_type]
+
+    if completed_only:
+        df = df[df['State'].astype(str) == 'COMPLETED']
+
+    missing_cols = [col for col in ['Target', 'Configuration']
+                    if col in by and col not in df.columns]
+    if len(missing_cols) > 0:
+        df = pd.concat([df, df['TrackName'].str.extract(TRACKNAME_PATTERN)[missing_cols]],
+                       axis=1)
+
+    times = {}
+    for field in ['Elapsed', 'TotalCPU']:
+        values = df[field]
+        if pd.api.types.is_timedelta64_dtype(values):
+            values = values.dt.total_seconds()
+        elif not pd.api.types.is_numeric_dtype(values):
+            values = parse_slurm_timedelta(values).dt.total_seconds().set_axis(df.index)
+        times[f"{field}_hr"] = values.astype(float) / 3600.
+
+    df = df.assign(**times)
+
+    summary = df.groupby(by).agg(num_jobs=('JobID', 'count'),
+                                 Elapsed_hr_total=('Elapsed_hr', 'sum'),
+                                 Elapsed_hr_median=('Elapsed_hr', 'median'),
+                                 TotalCPU_hr_total=('TotalCPU_hr', 'sum'))
+
+    summary['Elapsed_total'] = format_slurm_timedelta(summary['Elapsed_hr_total'] * 3600.).values
+    summary['TotalCPU_total'] = format_slurm_timedelta(summary['TotalCPU_hr_total'] * 3600.).values
+
+    return summary
+
+
+# Used when there are too few previous jobs to estimate from.
+# Memory in MB and time in hours.
+DEFAULT_JOB_RESOURCES = {'import_and_split': {'mem': 32000, 'job_time': 12},
+                         'continuum_pipeline_default': {'mem': 32000, 'job_time': 72},
+                         'line_pipeline_default': {'mem': 40000, 'job_time': 72}}
+
+# Limits on the cedar base nodes
+MAX_JOB_MEM = 187000
+MAX_JOB_TIME = 168
+
+
+def _predict_usage(usage, data_sizes, data_size, quantile):
+    '''
+    Upper quantile of the usage. When the data size is given, the usage is
+    first fit as a linear function of the data size and the quantile of the
+    residuals is added to the prediction.
+    '''
+
+    has_size = data_sizes.notnull() & usage.notnull()
+
+    if data_size is None or has_size.sum() < 3 or data_sizes[has_size].nunique() < 2:
+        return usage.quantile(quantile)
+
+    slope = np.polyfit(data_sizes[has_size], usage[has_size], 1)[0]
+
+    # Don't let noisy fits predict less usage for larger tracks.
+    slope = max(slope, 0.)
+    intercept = np.median(usage[has_size] - slope * data_sizes[has_size])
+
+    residuals = usage[has_size] - (intercept + slope * data_sizes[has_size])
+
+    return intercept + slope * data_size + residuals.quantile(quantile)
+
+
+def estimate_job_resources(job_type, config=None, data_size=None,
+                           db_path=JOB_ACCOUNTING_DB,
+                           quantile=0.95,
+                           safety_margin=1.25,
+                           min_jobs=5):
+    '''
+    Predict the memory and wall time for a job from previous completed jobs.
+
+    Parameters
+    ----------
+    job_type : str
+        Job type in the job name (e.g., "continuum_pipeline_default").
+    config : str, optional
+        VLA configuration. Only jobs in this configuration are used when
+        there are at least `min_jobs` of them.
+    data_size : float, optional
+        Data size of the track in GB.
+    quantile : float, optional
+        Quantile of the previous usage to predict.
+    safety_margin : float, optional
+        Factor to multiply the prediction by.
+    min_jobs : int, optional
+        Minimum number of previous jobs to estimate from. Otherwise the
+        values in `DEFAULT_JOB_RESOURCES` are returned.
+
+    Returns
+    -------
+    job_resources : dict
+        The 'mem' and 'job_time' strings to pass to `cedar_slurm_setup`.
+    '''
+
+    default = DEFAULT_JOB_RESOURCES.get(job_type, {'mem': 20000, 'job_time': 72})
+
+    mem_mb = default['mem']
+    time_hr = default['job_time']
+
+    if os.path.exists(db_path):
+        df = load_job_resources(db_path=db_path, job_type=job_type)
+        df = df[df['State'] == 'COMPLETED']
+
+        if config is not None and (df['Configuration'] == config).sum() >= min_jobs:
+            df = df[df['Configuration'] == config]
+
+        if len(df) >= min_jobs:
+            pred_mem = _predict_usage(df['MaxRSS'] / 1024**2, df['DataSize'],
+                                      data_size, quantile)
+            pred_time = _predict_usage(df['Elapsed'] / 3600., df['DataSize'],
+                                       data_size, quantile)
+
+            if np.isfinite(pred_mem):
+                mem_mb = pred_mem * safety_margin
+            if np.isfinite(pred_time):
+                time_hr = pred_time * safety_margin
+
+            log.info(f"Estimated {job_type} resources from {len(df)} jobs: "
+                     f"{mem_mb:.0f}M and {time_hr:.1f} hr")
+        else:
+            log.info(f"Only {len(df)} previous {job_type} jobs. Using default resources.")
+
+    # Round up to 1000M and 1 hr.
+    mem_mb = int(min(np.ceil(mem_mb / 1000.) * 1000, MAX_JOB_MEM))
+    time_hr = int(min(np.ceil(time_hr), MAX_JOB_TIME))
+
+    return {'mem': f"{mem_mb}M", 'job_time': f"{time_hr}:00:00"}
+
+
+def fill_job_resources(slurm_kwargs, job_type, config=None, data_size=None,
+                       **estimate_kwargs):
+    '''
+    Return a copy of `slurm_kwargs` with the estimated 'mem' and 'job_time'
+    added when they are not given.
+    '''
+
+    slurm_kwargs = dict(slurm_kwargs)
+
+    if 'mem' in slurm_kwargs and 'job_time' in slurm_kwargs:
+        return slurm_kwargs
+
+    job_resources = estimate_job_resources(job_type, config=config,
+                                           data_size=data_size,
+                                           **estimate_kwargs)
+
+    for key in job_resources:
+        slurm_kwargs.setdefault(key, job_resources[key])
+
+    return slurm_kwargs
@@ -1,5 +1,8 @@
 
 from datetime import datetime, timedelta
+from collections import namedtuple
+from io import StringIO
+import numpy as np
 import pandas as pd
 from astropy import units as u
 
@@ -9,121 +12,482 @@ from .logging import setup_logging
 log = setup_logging()
 
 
+FAIL_STATES = ["FAILED", "OUT_OF_MEMORY", "CANCELLED", "NODE_FAIL", "TIMEOUT"]
+
+FINISHED_STATES = ["COMPLETED"] + FAIL_STATES
+
+
+# Fields requested from sacct in status_robot.sh
+SACCT_FIELDS = ["JobID", "JobIDRaw", "JobName", "State", "Elapsed", "TotalCPU", "MaxRSS",
+                "MaxDiskRead", "MaxDiskWrite", "ReqMem", "AllocCPUS", "Timelimit", "End"]
+
+# Usage fields only reported on the job steps. Keep the peak value over all steps.
+SACCT_STEP_FIELDS = ["MaxRSS", "MaxDiskRead", "MaxDiskWrite"]
+
+SACCT_TIME_FIELDS = ["Elapsed", "TotalCPU", "Timelimit"]
+
+# TARGET_CONFIG_PROJ.sbNUM.ebNUM.MJD.vla_pipeline.JOBTYPE-%J
+# or with the submission journal token (see submission_journal.job_token):
+# TARGET_CONFIG_PROJ.sbNUM.ebNUM.MJD.vla_pipeline.JOBTYPE-jHEX
+JOBNAME_PATTERN = (r"^(?P<TrackName>[^.]*\.[^.]*\.eb(?P<EBID>\d+)\.[^-]*?)"
+                   r"\.vla_pipeline\.(?P<JobType>\w+?)(?:-(?P<JobToken>j[0-9a-f]{12}))?(?:-|$)")
+
+# Job arrays from `campaign_submission` are named CAMPAIGN.vla_pipeline.JOBTYPE-%J
+# until each task starts and renames itself to the track's job name.
+CAMPAIGN_JOBNAME_PATTERN = r"^campaign_[^.]*\.vla_pipeline\.(?P<JobType>\w+?)(?:-|$)"
+
+# JOBNUM or ARRAYJOBNUM_TASKNUM
+JOBID_PATTERN = r"^\d+(?:_\d+)?$"
+
+# Job names that did not match JOBNAME_PATTERN and were already logged.
+_UNPARSED_JOBNAMES = set()
+
+MEMORY_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
 def get_slurm_job_monitor(connect, time_range_days=7, timeout=600,
-                          raise_jobname_error=False):
+                          raise_jobname_error=False,
+                          start_time=None):
     '''
     Return job statuses on clusters running slurm.
+
+    Parameters
+    ----------
+    time_range_days : int, optional
+        Number of days of job history to return.
+    start_time : datetime, optional
+        Return only jobs active since this time. Overrides `time_range_days`.
     '''
 
-    time_now = datetime.now()
-    time_week = timedelta(days=time_range_days)
+    if start_time is None:
+        time_now = datetime.now()
+        time_week = timedelta(days=time_range_days)
 
-    start_time = time_now - time_week
-    start_time_str = start_time.strftime("%Y-%m-%d")
+        start_time = time_now - time_week
+        start_time_str = start_time.strftime("%Y-%m-%d")
+    else:
+        start_time_str = start_time.strftime("%Y-%m-%dT%H:%M:%S")
 
     # See status_robot.sh for more info
-
-    # slurm_cmd = f'sacct --format="JobID,JobName%110,State%20" --starttime={start_time_str} | grep -v "^[0-9]*\."'
+    # slurm_cmd = f'sacct --parsable2 --format="{",".join(SACCT_FIELDS)}" --starttime={start_time_str}'
 
     result = run_command(connect, start_time_str, test_connection=False,
                          timeout=timeout)
 
-    # Parse the output into a table.
-    lines = result.stdout.split('\n')
+    return parse_sacct_output(result.stdout,
+                              raise_jobname_error=raise_jobname_error)
 
-    colnames = list(filter(None, lines[0].split(" ")))
 
-    stripped_lines = []
+def parse_sacct_output(output, raise_jobname_error=False):
+    '''
+    Parse `sacct --parsable2` output into a table of the pipeline jobs.
 
-    # Skip line[1]. It's the delimiter in the slurm output
-    for ii, line in enumerate(lines[2:]):
-        this_line = list(filter(None, line.split(" ")))
+    Job steps (e.g., 1234.batch) are folded into their parent job to get
+    the peak memory and disk usage. The JobID is returned as an int, the
+    State as a categorical, times as timedeltas and memory/disk in bytes.
 
-        if len(this_line) == 0:
-            continue
+    Job array tasks are given their unique JobIDRaw as the JobID, and
+    the ARRAYJOBNUM_TASKNUM form is kept in ArrayJobID. ArrayJobID is
+    empty for jobs that are not in an array.
+    '''
+
+    df = pd.read_csv(StringIO(output), sep='|', dtype=str,
+                     keep_default_na=False, index_col=False)
+
+    missing_fields = [field for field in SACCT_FIELDS if field not in df.columns]
+    if len(missing_fields) > 0:
+        raise ValueError(f"sacct output is missing fields: {missing_fields}")
+
+    # Split off the job steps.
+    parent_id = df['JobID'].str.split(".", n=1).str[0]
+    is_step = df['JobID'].str.contains(".", regex=False)
+
+    step_peaks = {}
+    for field in SACCT_STEP_FIELDS:
+        step_peaks[field] = parse_slurm_memory(df[field]).groupby(parent_id).max()
+
+    df = df[~is_step].copy()
+
+    for field in SACCT_STEP_FIELDS:
+        df[field] = df['JobID'].map(step_peaks[field])
+
+    # Per-core requests (e.g., 4000Mc) are scaled to the whole job.
+    df['ReqMem'] = parse_slurm_memory(df['ReqMem'], ncpus=df['AllocCPUS'])
+    df = df.drop(columns='AllocCPUS')
 
-        # Some cancelled states will list: CANCELLED by NUM
-        # when it was cancelled due to a dependent job.
-        # Correct for those cases here.
-        if len(this_line) > 3:
-            if "CANCELLED" in this_line[2]:
-                this_line = this_line[:3]
-            else:
-                raise ValueError(f"Unsure of input line format: {this_line}")
+    # Array jobs that have not started (e.g., 1234_[1-5]) cannot be matched to a track.
+    is_valid = df['JobID'].str.match(JOBID_PATTERN)
+    if (~is_valid).any():
+        log.debug(f"Skipping {(~is_valid).sum()} jobs without a job or array task ID.")
+    df = df[is_valid]
 
-        # Job num is int
-        this_line[0] = int(this_line[0])
+    df['ArrayJobID'] = df['JobID'].where(df['JobID'].str.contains("_", regex=False), "")
+    df['JobID'] = df['JobIDRaw'].astype(np.int64)
+    df = df.drop(columns='JobIDRaw')
 
-        # Strip out track info from the job name
-        this_name = this_line[1]
-        name_info = this_name.split('-%J')[0].split(".vla_pipeline.")
-        if len(name_info) != 2:
-            if raise_jobname_error:
-                raise ValueError(f"Check job name: {name_info}")
-            else:
-                log.warn(f"Unable to parse job with name: {name_info}")
-                continue
+    # Some cancelled states will list: CANCELLED by NUM
+    # when it was cancelled due to a dependent job.
+    df['State'] = df['State'].str.split(" ", n=1).str[0].astype('category')
 
-        track_name, job_type = name_info
+    for field in SACCT_TIME_FIELDS:
+        df[field] = parse_slurm_timedelta(df[field])
+
+    df['End'] = pd.to_datetime(df['End'], format="%Y-%m-%dT%H:%M:%S", errors='coerce')
+
+    df = split_job_names(df, raise_jobname_error=raise_jobname_error)
+
+    return df.reset_index(drop=True)
+
+
+def split_job_names(df, raise_jobname_error=False):
+    '''
+    Add the track name, EBID and job type from the job names. Jobs
+    that do not follow the pipeline naming scheme are removed.
+
+    Campaign array tasks that have not started yet are matched to their
+    track through the submission journal. Their TrackName is left empty.
+    '''
 
-        try:
-            ebid = int(track_name.split(".")[2].split('eb')[1])
-        except IndexError:
-            log.warn(f"Unable to parse job with name: {name_info}")
-            continue
+    name_info = df['JobName'].str.extract(JOBNAME_PATTERN)
 
-        this_line.extend([track_name, ebid, job_type])
+    if 'ArrayJobID' in df.columns:
+        is_campaign = name_info['EBID'].isnull() & \
+            df['JobName'].str.match(CAMPAIGN_JOBNAME_PATTERN) & (df['ArrayJobID'] != "")
 
-        stripped_lines.append(this_line)
+        if is_campaign.any():
+            from .submission_journal import lookup_job_ids
 
-    colnames.extend(["TrackName", 'EBID', 'JobType'])
+            entries = lookup_job_ids(df.loc[is_campaign, 'ArrayJobID'])
 
-    df = pd.DataFrame(stripped_lines, columns=colnames)
+            for idx in df.index[is_campaign]:
+                entry = entries.get(df.loc[idx, 'ArrayJobID'])
+                if entry is not None:
+                    name_info.loc[idx, ['EBID', 'JobType']] = [str(entry[0]), entry[1]]
+
+    unmatched = name_info['EBID'].isnull()
+    if unmatched.any():
+        bad_names = list(df.loc[unmatched, 'JobName'])
+        if raise_jobname_error:
+            raise ValueError(f"Check job names: {bad_names}")
+
+        # Only log each name once, since they come back on every poll.
+        new_bad_names = sorted(set(bad_names) - _UNPARSED_JOBNAMES)
+        if len(new_bad_names) > 0:
+            log.warning(f"Unable to parse jobs with names: {new_bad_names}")
+            _UNPARSED_JOBNAMES.update(new_bad_names)
+
+    df = pd.concat([df[~unmatched], name_info[~unmatched]], axis=1)
+    df['EBID'] = df['EBID'].astype(np.int64)
 
     return df
 
 
+def parse_slurm_timedelta(values):
+    '''
+    Convert slurm times to timedeltas. All forms given by sacct are accepted:
+    DD-HH[:MM[:SS]], [HH:]MM:SS (with optional fractional seconds, as in TotalCPU)
+    and plain seconds. Unparseable or unlimited values (e.g., UNLIMITED,
+    Partition_Limit, INVALID) are returned as NaT.
+    '''
+
+    parts = pd.Series(values, dtype=str).str.strip().str.extract(
+        r"^(?:(?P<days>\d+)-)?(?P<clock>\d+(?:\.\d+)?(?::\d+(?:\.\d+)?){0,2})$")
+
+    has_days = parts['days'].notnull()
+
+    clock = parts['clock'].str.split(":", expand=True).reindex(columns=range(3)).astype(float)
+    num_fields = clock.notnull().sum(axis=1)
+
+    # With days, the clock fields start from hours. Otherwise they end with seconds.
+    shift = np.where(has_days, 0, 3 - num_fields.clip(lower=1))
+
+    unit_scales = np.array([3600, 60, 1, 0, 0])
+
+    seconds = parts['days'].astype(float).fillna(0) * 86400
+    for i in range(3):
+        seconds = seconds + clock[i].fillna(0) * unit_scales[i + shift]
+
+    seconds = seconds.where(parts['clock'].notnull())
+
+    return pd.to_timedelta(seconds, unit='s')
+
+
+def parse_slurm_memory(values, ncpus=None):
+    '''
+    Convert slurm memory values (e.g., 1234K, 2.5G) to bytes.
+    Empty values are returned as NaN.
+
+    ReqMem values can end with n (per node) or c (per core). With `ncpus`,
+    the per-core values are multiplied by the number of CPUs of each job.
+    Per-core values of jobs without allocated CPUs (e.g., pending jobs) are
+    returned as NaN.
+    '''
+
+    values = pd.Series(values, dtype=str)
+
+    parts = values.str.extract(r"^(?P<value>[\d.]+)(?P<unit>[KMGT]?)(?P<per>[nc]?)$")
+
+    memory = parts['value'].astype(float) * parts['unit'].map(MEMORY_UNITS)
+
+    if ncpus is not None:
+        ncpus = pd.to_numeric(pd.Series(ncpus, index=values.index), errors='coerce')
+        ncpus = ncpus.where(ncpus > 0)
+
+        memory = memory.where(parts['per'] != 'c', memory * ncpus)
+
+    return memory
+
+
+def get_slurm_queue(connect, timeout=600, raise_jobname_error=False):
+    '''
+    Return the pending and running jobs from squeue.
+    '''
+
+    # See queue_robot.sh for more info
+    result = run_command(connect, "", test_connection=False,
+                         timeout=timeout)
+
+    df = pd.read_csv(StringIO(result.stdout), sep='|', dtype=str, header=None,
+                     names=["JobID", "ArrayJobID", "JobName", "State"],
+                     keep_default_na=False)
+
+    # Skip un-started array jobs (e.g., 1234_[1-5])
+    df = df[df['ArrayJobID'].str.match(JOBID_PATTERN)].copy()
+
+    df['ArrayJobID'] = df['ArrayJobID'].where(df['ArrayJobID'].str.contains("_", regex=False), "")
+    df['JobID'] = df['JobID'].astype(np.int64)
+
+    df = split_job_names(df, raise_jobname_error=raise_jobname_error)
+
+    return df.reset_index(drop=True)
+
+
+JobStateEvent = namedtuple("JobStateEvent",
+                           ["JobID", "EBID", "JobType", "PrevState", "State"])
+
+
+class SlurmJobWatcher(object):
+    '''
+    Keep an in-memory index of the slurm jobs by JobID and EBID.
+
+    The first poll pulls the full `time_range_days` of history. Later polls
+    only request jobs active since the previous poll (plus `overlap` to avoid
+    edge cases) and return the state changes as `JobStateEvent`.
+
+    Finished jobs are kept until they are handled and removed with `evict`, or
+    until they ended more than `time_range_days` ago.
+    '''
+
+    def __init__(self, time_range_days=7, overlap=300):
+
+        self.time_range_days = time_range_days
+        self.overlap = timedelta(seconds=overlap)
+
+        self._last_poll = None
+
+        self.jobs = pd.DataFrame(columns=["ArrayJobID", "JobName", "State", "TrackName",
+                                          'EBID', 'JobType', 'JobToken'],
+                                 index=pd.Index([], name='JobID'))
+        self._ebid_index = {}
+
+        # Evicted jobs that can still be returned by the overlapping polls.
+        self._evicted = set()
+
+    @property
+    def last_poll(self):
+        return self._last_poll
+
+    def poll(self, connect, queue_connect=None, timeout=600):
+        '''
+        Update the job index and return the state changes since the last poll.
+
+        Parameters
+        ----------
+        connect : fabric.Connection
+            Connection to the sacct job status robot.
+        queue_connect : fabric.Connection, optional
+            Connection to the squeue robot. When given, the active job states
+            from squeue take precedence over sacct.
+        '''
+
+        poll_time = datetime.now()
+
+        if self._last_poll is None:
+            df = get_slurm_job_monitor(connect, time_range_days=self.time_range_days,
+                                       timeout=timeout)
+        else:
+            df = get_slurm_job_monitor(connect, start_time=self._last_poll - self.overlap,
+                                       timeout=timeout)
+
+        if queue_connect is not None:
+            df_queue = get_slurm_queue(queue_connect, timeout=timeout)
+
+            queue_states = df_queue.set_index('JobID')['State']
+
+            df['State'] = df['JobID'].map(queue_states).fillna(df['State'].astype(str))
+            df = pd.concat([df, df_queue[~df_queue['JobID'].isin(df['JobID'])]])
+
+        events = self.update(df)
+
+        self._last_poll = poll_time
+
+        return events
+
+    def update(self, df):
+        '''
+        Merge a new job table into the index and return the state changes.
+        '''
+
+        df = df.drop_duplicates(subset='JobID', keep='last').set_index('JobID')
+
+        # Do not re-add evicted jobs returned again in the poll overlap. Jobs
+        # not in this poll will not be in the later ones.
+        reappeared = df.index.isin(list(self._evicted)) & \
+            df['State'].astype(str).isin(FINISHED_STATES)
+        self._evicted = set(df.index[reappeared])
+        df = df[~reappeared]
+
+        prev_states = self.jobs['State'].reindex(df.index)
+
+        changed = prev_states.ne(df['State'])
+
+        events = [JobStateEvent(job_id, row['EBID'], row['JobType'],
+                                None if pd.isnull(prev_states[job_id]) else prev_states[job_id],
+                                row['State'])
+                  for job_id, row in df[changed].iterrows()]
+
+        self.jobs = pd.concat([self.jobs[~self.jobs.index.isin(df.index)], df])
+
+        for job_id, ebid in df['EBID'].items():
+            self._ebid_index.setdefault(ebid, set()).add(job_id)
+
+        for event in events:
+            log.info(f"Job {event.JobID} ({event.EBID} {event.JobType}) changed from "
+                     f"{event.PrevState} to {event.State}")
+
+        self._evict_expired()
+
+        return events
+
+    def evict(self, job_ids):
+        '''
+        Remove handled jobs from the index.
+        '''
+
+        job_ids = [job_id for job_id in job_ids if job_id in self.jobs.index]
+
+        if len(job_ids) == 0:
+            return
+
+        for job_id, ebid in self.jobs.loc[job_ids, 'EBID'].items():
+            these_ids = self._ebid_index.get(ebid, set())
+            these_ids.discard(job_id)
+            if len(these_ids) == 0:
+                self._ebid_index.pop(ebid, None)
+
+        self.jobs = self.jobs.drop(index=job_ids)
+
+        self._evicted.update(job_ids)
+
+        log.debug(f"Evicted {len(job_ids)} jobs. {len(self.jobs)} jobs are in the index.")
+
+    def _evict_expired(self):
+        '''
+        Remove finished jobs that ended before the `time_range_days` window.
+        '''
+
+        if 'End' not in self.jobs.columns:
+            return
+
+        cutoff = datetime.now() - timedelta(days=self.time_range_days)
+
+        is_expired = self.jobs['State'].astype(str).isin(FINISHED_STATES) & \
+            (pd.to_datetime(self.jobs['End']) < cutoff)
+
+        if is_expired.any():
+            self.evict(list(self.jobs.index[is_expired]))
+
+    def jobs_for_ebid(self, ebid):
+        '''
+        Return the jobs for a given EBID.
+        '''
+
+        return self.jobs.loc[sorted(self._ebid_index.get(ebid, []))]
+
+    def job_state(self, job_id):
+        '''
+        Return the last known state of a job, or None if unknown.
+        '''
+
+        if job_id not in self.jobs.index:
+            return None
+
+        return self.jobs.loc[job_id, 'State']
+
+    def as_table(self):
+        '''
+        Return the index as a table in the format of `get_slurm_job_monitor`.
+        '''
+
+        return self.jobs.reset_index()
+
 
 def identify_completions(df, running_tracks):
     '''
     Search for completed/failed jobs that are listed as currently running.
+
+    The running tracks are matched to the job table with a single lookup on
+    the JobID index.
+
+    Returns
+    -------
+    df_comp : pandas.DataFrame
+        Completed jobs.
+    df_fails : pandas.DataFrame
+        Jobs that ended in one of `FAIL_STATES`.
+    df_running : pandas.DataFrame
+        Jobs that are still pending or running.
     '''
 
-    fail_states = ["FAILED", "OUT_OF_MEMORY", "CANCELLED", "NODE_FAIL", "TIMEOUT"]
+    df_tracks = pd.DataFrame(running_tracks, columns=['SheetEBID', 'DataType', 'JobSummary'])
 
-    comps = []
-    fails = []
+    no_jobid = df_tracks['JobSummary'].astype(str) == ""
+    for this_ebid in df_tracks.loc[no_jobid, 'SheetEBID']:
+        log.error(f"No job ID is in the spreadsheet for {this_ebid}. Check this status manually.")
 
-    for this_track in running_tracks:
-        this_ebid, data_type, job_summ = this_track
+    df_tracks = df_tracks[~no_jobid].copy()
 
-        if job_summ == "":
-            log.error(f"No job ID is in the spreadsheet. Check this status manually.")
-            continue
+    # CLUSTERNAME:JOBNUM or CLUSTERNAME:ARRAYJOBNUM_TASKNUM for job arrays
+    sheet_jobids = df_tracks['JobSummary'].astype(str).str.split(":").str[1]
 
-        # CLUSTERNAME:JOBNUM
-        job_id = int(job_summ.split(":")[1])
+    array_jobids = df[df['ArrayJobID'] != ""].drop_duplicates(subset='ArrayJobID', keep='last')
+    array_jobids = array_jobids.set_index('ArrayJobID')['JobID']
 
-        this_row = df[df['JobID'] == job_id]
+    df_tracks['JobID'] = sheet_jobids.map(array_jobids).fillna(pd.to_numeric(sheet_jobids,
+                                                                             errors='coerce'))
 
-        if len(this_row) == 0:
-            log.error(f"Unable to find job ID {job_id} for EBID {this_ebid} {data_type}")
-            continue
+    df_jobs = df.drop_duplicates(subset='JobID', keep='last').set_index('JobID')
 
-        index = this_row.index[0]
+    matched = df_tracks.join(df_jobs, on='JobID', how='left')
 
-        if this_row['State'].to_string(index=False) == "COMPLETED":
-            comps.append(index)
-        elif this_row['State'].to_string(index=False) in fail_states:
-            fails.append(index)
-        else:
-            # Pending or running.
-            pass
+    is_missing = matched['State'].isnull()
+    for _, this_track in matched[is_missing].iterrows():
+        log.error(f"Unable to find job ID {this_track['JobSummary']} for EBID "
+                  f"{this_track['SheetEBID']} {this_track['DataType']}")
+
+    matched = matched[~is_missing].astype({'JobID': np.int64, 'EBID': np.int64})
+
+    states = matched['State'].astype(str)
+
+    is_comp = states == "COMPLETED"
+    is_fail = states.isin(FAIL_STATES)
 
-    df_comp = df.iloc[comps]
-    df_fails = df.iloc[fails]
+    df_comp = matched[is_comp]
+    df_fails = matched[is_fail]
+    # Pending or running.
+    df_running = matched[~is_comp & ~is_fail]
 
-    return df_comp, df_fails
+    return df_comp, df_fails, df_running
 
 
 def number_of_active_jobs(df):
@@ -7,6 +7,7 @@ To be run in python3
 
 from .job_tools import (cedar_slurm_setup, cedar_job_setup,
                         cedar_qa_plots, cedar_casa_startupfile,
+                        cedar_array_setup, ARRAY_TRACK_VARIABLES,
                         path_to_casa)
 
 # from ..cluster_configs import ENDPOINT_INFO
@@ -19,16 +20,41 @@ def cedar_submission_script(target_name="M31",
                             conditional_on_jobnum=None,
                             run_casa6=True,
                             run_qaplotter=False,
-                            casa_version='6.5'):
+                            casa_version='6.5',
+                            data_size=None,
+                            estimate_resources=True,
+                            array_manifest=None):
     '''
     Runs the default VLA pipeline.
 
+    Set `array_manifest` to make a job array over the tracks listed in the
+    manifest (see `job_tools.cedar_array_setup`).
+
     TODO: Make job start conditional on the split job finishing (need to pass that job num)
     '''
 
-    slurm_kwargs['job_name'] = f"{target_name}_{config}_{trackname}"
     slurm_kwargs['job_type'] = "continuum_pipeline_default"
 
+    # Predict the memory and time from previous jobs when not given.
+    # Job arrays span configurations so only the data size is used.
+    if estimate_resources:
+        from ..job_accounting import fill_job_resources
+
+        slurm_kwargs = fill_job_resources(slurm_kwargs, slurm_kwargs['job_type'],
+                                          config=config if array_manifest is None else None,
+                                          data_size=data_size)
+
+    # Add in default info to set the log file, job name, etc
+    if array_manifest is None:
+        slurm_kwargs['job_name'] = f"{target_name}_{config}_{trackname}"
+        array_str = ""
+    else:
+        # Each task in the job array reads its track from the manifest.
+        slurm_kwargs.setdefault('job_name', "campaign")
+        array_str = cedar_array_setup(array_manifest, job_type=slurm_kwargs['job_type'])
+
+        target_name, config, trackname = ARRAY_TRACK_VARIABLES
+
     if conditional_on_jobnum is not None:
         slurm_kwargs['dependency'] = f"afterok:{conditional_on_jobnum}"
 
@@ -50,7 +76,7 @@ def cedar_submission_script(target_name="M31",
 
     job_str = \
         f'''{slurm_str}\n{setup_str}
-
+{array_str}
 export TRACK_FOLDER="{target_name}_{config}_{trackname}"
 
 cd /home/ekoch/{data_path}/$TRACK_FOLDER
@@ -7,6 +7,7 @@ To be run in python3
 
 from .job_tools import (cedar_slurm_setup, cedar_job_setup,
                         cedar_casa_startupfile,
+                        cedar_array_setup, ARRAY_TRACK_VARIABLES,
                         path_to_casa)
 
 # from ..cluster_configs import ENDPOINT_INFO
@@ -19,12 +20,33 @@ def cedar_submission_script(target_name="M31", config="C",
                             slurm_kwargs={},
                             setup_kwargs={},
                             run_casa6=True,
-                            casa_version='6.5'):
+                            casa_version='6.5',
+                            data_size=None,
+                            estimate_resources=True,
+                            array_manifest=None):
 
-    # Add in default info to set the log file, job name, etc
-    slurm_kwargs['job_name'] = f"{target_name}_{config}_{trackname}"
     slurm_kwargs['job_type'] = "import_and_split"
 
+    # Predict the memory and time from previous jobs when not given.
+    # Job arrays span configurations so only the data size is used.
+    if estimate_resources:
+        from ..job_accounting import fill_job_resources
+
+        slurm_kwargs = fill_job_resources(slurm_kwargs, slurm_kwargs['job_type'],
+                                          config=config if array_manifest is None else None,
+                                          data_size=data_size)
+
+    # Add in default info to set the log file, job name, etc
+    if array_manifest is None:
+        slurm_kwargs['job_name'] = f"{target_name}_{config}_{trackname}"
+        array_str = ""
+    else:
+        # Each task in the job array reads its track from the manifest.
+        slurm_kwargs.setdefault('job_name', "campaign")
+        array_str = cedar_array_setup(array_manifest, job_type=slurm_kwargs['job_type'])
+
+        target_name, config, trackname = ARRAY_TRACK_VARIABLES
+
     slurm_str = cedar_slurm_setup(**slurm_kwargs)
     setup_str = cedar_job_setup(**setup_kwargs)
 
@@ -43,7 +65,7 @@ def cedar_submission_script(target_name="M31", config="C",
 
     job_str = \
         f'''{slurm_str}\n{setup_str}
-
+{array_str}
 export TRACK_FOLDER="{target_name}_{config}_{trackname}"
 
 cd /home/ekoch/{data_path}/$TRACK_FOLDER
@@ -11,13 +11,21 @@ def cedar_slurm_setup(job_time="72:00:00", mem="20000M",
                       sendto="ekoch@ualberta.ca",
                       dependency=None,
                       mail_complete=True,
-                      mail_fail=True):
+                      mail_fail=True,
+                      array=None,
+                      job_token=None):
 
     '''
     Dependency example: --dependency=afterok:11254323
     This requires the job to wait until the job number successfully finished.
     (e.g., the split job should start before the pipeline runs)
     See https://hpc.nih.gov/docs/job_dependencies.html.
+
+    Array example: array="0-99%20" runs 100 tasks with at most 20 at once.
+    See `cedar_array_setup`.
+
+    The job_token from `submission_journal.reserve_submission` is added to the
+    job name so a submitted job can be found if sbatch hangs.
     '''
 
     if dependency is not None:
@@ -25,6 +33,15 @@ def cedar_slurm_setup(job_time="72:00:00", mem="20000M",
     else:
         dependency_str = ""
 
+    if array is not None:
+        array_str = f"#SBATCH --array={array}"
+        output_jobid = "%A_%a"
+    else:
+        array_str = ""
+        output_jobid = "%J"
+
+    name_suffix = job_token if job_token is not None else "%J"
+
     mail_on_complete = "#SBATCH --mail-type=END" if mail_complete else ""
     mail_on_fail = "#SBATCH --mail-type=FAIL" if mail_fail else ""
 
@@ -33,12 +50,13 @@ def cedar_slurm_setup(job_time="72:00:00", mem="20000M",
 #SBATCH --time={job_time}
 #SBATCH --mem={mem}
 #SBATCH --cpus-per-task={ncpus}
-#SBATCH --job-name={job_name}.vla_pipeline.{job_type}-%J
-#SBATCH --output={job_name}_{job_type}-%J.out
+#SBATCH --job-name={job_name}.vla_pipeline.{job_type}-{name_suffix}
+#SBATCH --output={job_name}_{job_type}-{output_jobid}.out
 #SBATCH --mail-user={sendto}
 {mail_on_complete}
 {mail_on_fail}
 {dependency_str}
+{array_str}
 
 export OMP_NUM_THREADS=$SLURM_CPUS_PER_TASK
         '''
@@ -46,6 +64,37 @@ export OMP_NUM_THREADS=$SLURM_CPUS_PER_TASK
     return slurm_setup
 
 
+# Shell variables set by `cedar_array_setup` for each task in a job array.
+# Passed to the job templates in place of the target, config and track name.
+ARRAY_TRACK_VARIABLES = ("${TARGET_NAME}", "${CONFIG}", "${TRACKNAME}")
+
+
+def cedar_array_setup(manifest_path, job_type="import_and_split"):
+    '''
+    Set the track for each task in a job array from a manifest file with
+    one "TARGET CONFIG TRACKNAME" line per task, indexed by SLURM_ARRAY_TASK_ID.
+
+    The task is renamed to the usual per-track job name so it can be matched
+    to the track in `job_monitor`.
+    '''
+
+    array_setup = \
+        f'''
+
+read TARGET_NAME CONFIG TRACKNAME <<< $(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {manifest_path})
+
+if [ -z "$TRACKNAME" ]; then
+    echo "No track in {manifest_path} for array task $SLURM_ARRAY_TASK_ID. Exiting"
+    exit 1
+fi
+
+scontrol update JobId=$SLURM_JOB_ID JobName=${{TARGET_NAME}}_${{CONFIG}}_${{TRACKNAME}}.vla_pipeline.{job_type}-${{SLURM_ARRAY_JOB_ID}}_${{SLURM_ARRAY_TASK_ID}}
+
+        '''
+
+    return array_setup
+
+
 def cedar_job_setup():
     setup_script = \
         '''
@@ -0,0 +1,150 @@
+'''
+Extract selected members of the pipeline product tar files in one pass.
+
+The product tar files are several GB. Reading them in stream mode and
+routing the selected members as they go past reads the archive once,
+instead of once per member with `tar -xf`. Nested archives (the weblog.tgz)
+can be unpacked on the fly without writing them to disk.
+'''
+
+import os
+import tarfile
+from pathlib import Path
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+# Members of {track_folder_name}_{data_type}_products.tar used for the QA products.
+QA_PRODUCT_MEMBERS = ["products/weblog.tgz",
+                      "products/finalBPcal_txt",
+                      "products/final_caltable_txt",
+                      "products/scan_plots_txt",
+                      "products/quicklook_imaging",
+                      "products/spw_definitions.npy"]
+
+# Use the safe extraction filter where it is available (python>=3.11.4)
+_EXTRACT_KWARGS = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+
+def _strip_name(name, strip_components):
+
+    parts = Path(name).parts[strip_components:]
+
+    if len(parts) == 0:
+        return None
+
+    return os.path.join(*parts)
+
+
+def _matching_selection(name, selections):
+
+    name = name.rstrip("/")
+
+    for selection in selections:
+        if name == selection or name.startswith(selection + "/"):
+            return selection
+
+    return None
+
+
+def _extract_member(tar, member, output_path, strip_components):
+    '''
+    Extract one member with the leading path components removed.
+    '''
+
+    new_name = _strip_name(member.name, strip_components)
+
+    if new_name is None:
+        return False
+
+    # Links are skipped, as in `tar --strip-components` they would point to
+    # the unstripped paths.
+    if member.issym() or member.islnk():
+        log.debug(f"Skipping link {member.name}")
+        return False
+
+    member.name = new_name
+
+    tar.extract(member, path=output_path, **_EXTRACT_KWARGS)
+
+    return True
+
+
+def _extract_nested(tar, member, output_path, strip_components):
+    '''
+    Unpack a nested archive member directly from the outer stream.
+    '''
+
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    num_members = 0
+
+    with tar.extractfile(member) as fileobj:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as nested_tar:
+            for nested_member in nested_tar:
+                num_members += _extract_member(nested_tar, nested_member,
+                                               output_path, strip_components)
+
+    return num_members
+
+
+def extract_selected_members(tar_path, output_path, selections,
+                             strip_components=1,
+                             unpack_nested={},
+                             nested_strip_components=1):
+    '''
+    Extract the selected members of a tar file in a single pass.
+
+    Parameters
+    ----------
+    tar_path : str or Path
+        Tar file to extract from. Compressed files are also read.
+    output_path : str or Path
+        Folder to extract into.
+    selections : list of str
+        Member names in the archive. A directory name selects everything in it.
+    strip_components : int, optional
+        Number of leading path components to remove, as in `tar --strip-components`.
+    unpack_nested : dict, optional
+        Selected nested archives (e.g., {"products/weblog.tgz": "weblog"}) to
+        unpack into the given folder in `output_path` instead of extracting
+        the archive file.
+    nested_strip_components : int, optional
+        `strip_components` for the nested archives.
+
+    Returns
+    -------
+    num_extracted : dict
+        Number of members extracted for each selection. Selections that are
+        not in the archive have 0.
+    '''
+
+    output_path = Path(output_path)
+
+    selections = [selection.rstrip("/") for selection in selections]
+
+    num_extracted = {selection: 0 for selection in selections}
+
+    with tarfile.open(tar_path, mode='r|*') as tar:
+
+        for member in tar:
+
+            selection = _matching_selection(member.name, selections)
+
+            if selection is None:
+                continue
+
+            if member.name in unpack_nested and member.isfile():
+                nested_path = output_path / unpack_nested[member.name]
+                num_extracted[selection] += _extract_nested(tar, member, nested_path,
+                                                            nested_strip_components)
+            else:
+                num_extracted[selection] += _extract_member(tar, member, output_path,
+                                                            strip_components)
+
+    missing = [selection for selection, num in num_extracted.items() if num == 0]
+    if len(missing) > 0:
+        log.warning(f"Unable to find {missing} in {tar_path}")
+
+    return num_extracted
@@ -0,0 +1,222 @@
+'''
+Build the QA products of many tracks in parallel.
+
+Each build (`AutoPipeline.make_qa_products`) runs in a bounded process pool.
+The number of worker processes limits the CPU use (mostly qaplotter) and a
+semaphore shared by the workers limits how many builds read or write the
+product tar files and webserver folders at the same time.
+
+Per-track timings of the extract, qaplot and publish steps, and of the file
+system operations in them (`fs_ops`), are logged and kept in
+`QABuildService.results`.
+'''
+
+import os
+import time
+import asyncio
+import multiprocessing
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+
+import pandas as pd
+
+from .fs_ops import get_fs_timings, reset_fs_timings
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+QABuildResult = namedtuple('QABuildResult',
+                           ['ebid', 'data_type', 'success', 'timings', 'error'])
+
+# Set in each worker process by `_init_worker`.
+_IO_SEMAPHORE = None
+
+
+def _init_worker(io_semaphore):
+
+    global _IO_SEMAPHORE
+
+    _IO_SEMAPHORE = io_semaphore
+
+
+@contextmanager
+def io_slot():
+    '''
+    Hold one of the disk I/O slots shared by the QA build workers. Outside of
+    a worker this does nothing.
+    '''
+
+    if _IO_SEMAPHORE is None:
+        yield
+        return
+
+    with _IO_SEMAPHORE:
+        yield
+
+
+@contextmanager
+def timed_step(timings, name):
+    '''
+    Add the time spent in the block to `timings[name]`, when `timings` is given.
+    '''
+
+    t0 = time.time()
+
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.) + time.time() - t0
+
+
+def build_qa_products(auto_pipe, data_type, **qa_kwargs):
+    '''
+    Run `make_qa_products` for one track. This is the function run in the worker
+    processes.
+
+    Returns
+    -------
+    result : QABuildResult
+    '''
+
+    timings = {}
+
+    # Each worker runs one build at a time, so the file system timings of the
+    # process are those of this build.
+    reset_fs_timings()
+
+    t0 = time.time()
+
+    try:
+        success = auto_pipe.make_qa_products(data_type=data_type, timings=timings,
+                                             **qa_kwargs)
+        error = None
+    except Exception as exc:
+        success = False
+        error = f"{type(exc).__name__}: {exc}"
+
+    timings['total'] = time.time() - t0
+
+    for name, (num_calls, fs_time) in get_fs_timings().items():
+        timings[f"fs_{name}"] = fs_time
+
+    return QABuildResult(auto_pipe.ebid, data_type, success, timings, error)
+
+
+class QABuildService(object):
+    '''
+    Fan QA builds out to a process pool.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of concurrent builds. Defaults to half of the CPUs.
+    max_io_jobs : int, optional
+        Number of builds that can extract or move products at the same time.
+    '''
+
+    def __init__(self, max_workers=None, max_io_jobs=2):
+
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) // 2)
+
+        self.max_workers = max_workers
+        self.max_io_jobs = max_io_jobs
+
+        self.results = []
+
+        self._pool = None
+
+    @property
+    def pool(self):
+
+        if self._pool is None:
+            io_semaphore = multiprocessing.Semaphore(self.max_io_jobs)
+
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             initializer=_init_worker,
+                                             initargs=(io_semaphore,))
+
+        return self._pool
+
+    async def build(self, auto_pipe, data_type, **qa_kwargs):
+        '''
+        Build the QA products of one track in the pool.
+
+        Returns
+        -------
+        result : QABuildResult
+        '''
+
+        log.info(f"Queuing QA build for {auto_pipe.ebid} {data_type}")
+
+        loop = asyncio.get_running_loop()
+
+        result = await loop.run_in_executor(self.pool,
+                                            partial(build_qa_products, auto_pipe,
+                                                    data_type, **qa_kwargs))
+
+        self.results.append(result)
+
+        step_strs = ", ".join([f"{name} {value:.1f} s" for name, value in result.timings.items()])
+
+        if result.success:
+            log.info(f"QA build for {result.ebid} {data_type} finished: {step_strs}")
+        else:
+            log.error(f"QA build for {result.ebid} {data_type} failed "
+                      f"({result.error}): {step_strs}")
+
+        return result
+
+    async def build_many(self, items, **qa_kwargs):
+        '''
+        Build the QA products of many tracks.
+
+        Parameters
+        ----------
+        items : list
+            (auto_pipe, data_type) pairs.
+
+        Returns
+        -------
+        results : list of QABuildResult
+        '''
+
+        return await asyncio.gather(*[self.build(auto_pipe, data_type, **qa_kwargs)
+                                      for auto_pipe, data_type in items])
+
+    def timing_summary(self):
+        '''
+        Table of the per-track build timings in seconds.
+        '''
+
+        rows = [dict(EBID=result.ebid, DataType=result.data_type,
+                     Success=result.success, **result.timings)
+                for result in self.results]
+
+        return pd.DataFrame(rows)
+
+    def shutdown(self, wait=True):
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+_QA_BUILD_SERVICE = None
+
+
+def get_qa_build_service():
+    '''
+    Return the shared QA build service.
+    '''
+
+    global _QA_BUILD_SERVICE
+
+    if _QA_BUILD_SERVICE is None:
+        _QA_BUILD_SERVICE = QABuildService()
+
+    return _QA_BUILD_SERVICE
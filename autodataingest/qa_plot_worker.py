@@ -0,0 +1,188 @@
+'''
+Long-lived worker process for qaplotter.
+
+qaplotter and its plotting stack are imported once in the worker and reused
+for every track, instead of starting a new ipython for each build. The input
+and output folders are passed explicitly. Any files qaplotter still writes
+relative to the working directory stay in the worker's own process, so
+concurrent QA builds do not change each other's working directory.
+'''
+
+import os
+import threading
+import traceback
+import multiprocessing
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+# Folders in the extracted products and the qaplotter outputs written next to them.
+QAPLOT_FOLDERS = {'folder_fields': 'scan_plots_txt',
+                  'output_folder_fields': 'scan_plots_QAplots',
+                  'folder_BPs': 'finalBPcal_txt',
+                  'output_folder_BPs': 'finalBPcal_QAplots'}
+
+
+def _worker_main(conn):
+    '''
+    Serve `make_all_plots` requests until the connection is closed.
+    '''
+
+    try:
+        import qaplotter
+    except ImportError as exc:
+        conn.send((False, f"Cannot import qaplotter: {exc}"))
+        conn.close()
+        return
+
+    conn.send((True, None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        if request is None:
+            break
+
+        track_path, plot_kwargs = request
+
+        try:
+            os.chdir(track_path)
+
+            folder_kwargs = {key: os.path.join(track_path, folder)
+                             for key, folder in QAPLOT_FOLDERS.items()}
+
+            qaplotter.make_all_plots(**folder_kwargs, **plot_kwargs)
+
+            conn.send((True, None))
+
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+    conn.close()
+
+
+class QAPlotWorker(object):
+    '''
+    Run `qaplotter.make_all_plots` in a persistent worker process.
+
+    The worker is started on the first request and restarted if it dies.
+    Requests from different threads are run one at a time.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Time in seconds to wait for the plots of one track. The worker is
+        restarted after a timeout.
+    '''
+
+    def __init__(self, timeout=3600):
+
+        self.timeout = timeout
+
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+
+        parent_conn, child_conn = multiprocessing.Pipe()
+
+        self._process = multiprocessing.Process(target=_worker_main, args=(child_conn,),
+                                                daemon=True)
+        self._process.start()
+        child_conn.close()
+
+        self._conn = parent_conn
+
+        if not self._conn.poll(self.timeout):
+            self.stop()
+            raise TimeoutError("qaplotter worker did not start.")
+
+        try:
+            success, error = self._conn.recv()
+        except EOFError:
+            success, error = False, "qaplotter worker exited on start up."
+
+        if not success:
+            self.stop()
+            raise ImportError(error)
+
+        log.info(f"Started qaplotter worker (pid {self._process.pid})")
+
+    def stop(self):
+        '''
+        Stop the worker process.
+        '''
+
+        if self._process is None:
+            return
+
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+        self._conn.close()
+
+        self._process = None
+        self._conn = None
+
+    def make_all_plots(self, track_path, **plot_kwargs):
+        '''
+        Make the QA plots of the extracted products in `track_path`.
+
+        Returns
+        -------
+        success : bool
+        error : str
+            Traceback from the worker when it failed.
+        '''
+
+        with self._lock:
+
+            if self._process is None or not self._process.is_alive():
+                if self._process is not None:
+                    log.warning("qaplotter worker died. Restarting.")
+                    self.stop()
+                self._start()
+
+            self._conn.send((os.path.abspath(track_path), plot_kwargs))
+
+            if not self._conn.poll(self.timeout):
+                log.error(f"qaplotter timed out on {track_path}. Restarting the worker.")
+                self.stop()
+                return False, f"Timed out after {self.timeout} s"
+
+            try:
+                return self._conn.recv()
+            except EOFError:
+                self.stop()
+                return False, "qaplotter worker exited."
+
+
+_QAPLOT_WORKER = None
+_QAPLOT_WORKER_PID = None
+
+
+def get_qaplot_worker():
+    '''
+    Return the qaplotter worker of this process.
+    '''
+
+    global _QAPLOT_WORKER, _QAPLOT_WORKER_PID
+
+    # A forked process (e.g., a QA build worker) needs its own worker.
+    if _QAPLOT_WORKER is None or _QAPLOT_WORKER_PID != os.getpid():
+        _QAPLOT_WORKER = QAPlotWorker()
+        _QAPLOT_WORKER_PID = os.getpid()
+
+    return _QAPLOT_WORKER
@@ -62,12 +62,15 @@ def time_limit(seconds):
 
 
 async def run_job_submission(connect, cmd, track_name, job_name, test_connection=False, timeout=600,
-                             retry_attempts=5):
+                             retry_attempts=5, job_token=None):
     '''
     This wraps `run_command` specifically for submitting slurm jobs.
     In several cases, the run function hangs, but the job is submitted. In
     those cases, we catch the hanging run and instead return the job number by using
     `sacct` to link the track name to the job ID.
+
+    When `job_token` is given (see `submission_journal`), the job is matched by the
+    token instead, which is unique to this submission attempt.
     '''
 
     tries = 0
@@ -105,7 +108,12 @@ async def run_job_submission(connect, cmd, track_name, job_name, test_connection
                     else:
                         # Match track name in the job name:
                         for job_desc in job_list[2:]:
-                            if track_name in job_desc and job_name in job_desc:
+                            if job_token is not None:
+                                is_match = job_token in job_desc
+                            else:
+                                is_match = track_name in job_desc and job_name in job_desc
+
+                            if is_match:
                                 job_id = job_desc.split(' ')[0]
                                 log.info(f"Successfully identified job ID {job_id} in queue.")
                                 break
@@ -0,0 +1,287 @@
+'''
+Local journal of slurm job submissions.
+
+Each submission attempt of a job type for a track gets a deterministic token
+that is added to the slurm job name. If sbatch hangs or a submission step is
+retried, the token is used to find a job that was already submitted instead
+of submitting a duplicate.
+'''
+
+import os
+import hashlib
+import sqlite3
+from datetime import datetime, timedelta
+
+from .job_monitor import get_slurm_job_monitor, get_slurm_queue
+from .ssh_utils import setup_ssh_connection
+from .cluster_configs import local_db_path
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+SUBMISSION_JOURNAL_DB = local_db_path('submission_journal.db')
+
+SUBMISSION_COLUMNS = ['Token', 'EBID', 'JobType', 'Attempt', 'JobID', 'Status', 'Updated']
+
+# An attempt without a job ID is only retried within this time. Older attempts
+# are assumed to have failed before reaching the queue.
+SUBMISSION_RETRY_WINDOW = timedelta(hours=24)
+
+# Margin on the journal times when searching sacct for submitted jobs.
+SUBMISSION_CLOCK_MARGIN = timedelta(hours=1)
+
+
+def job_token(ebid, job_type, attempt):
+    '''
+    Token for a submission attempt. Matches the JobToken in
+    `job_monitor.JOBNAME_PATTERN`.
+    '''
+
+    digest = hashlib.sha1(f"{ebid}:{job_type}:{attempt}".encode()).hexdigest()
+
+    return f"j{digest[:12]}"
+
+
+def _connect_db(db_path):
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS submissions (
+                    Token TEXT UNIQUE, EBID INTEGER, JobType TEXT, Attempt INTEGER,
+                    JobID TEXT, Status TEXT, Updated TEXT,
+                    PRIMARY KEY (EBID, JobType, Attempt))''')
+
+    return conn
+
+
+def get_active_job_ids():
+    '''
+    Return the IDs of the pending and running jobs in squeue. Array tasks are
+    included as ARRAYJOBID_TASKID.
+    '''
+
+    queue_connect = setup_ssh_connection('cedar-robot-queuestatus')
+    df_queue = get_slurm_queue(queue_connect)
+    queue_connect.close()
+
+    return set(df_queue['JobID'].astype(str)) | set(df_queue['ArrayJobID']) - set([""])
+
+
+def _can_reuse(row, active_job_ids=None, retry_window=SUBMISSION_RETRY_WINDOW):
+    '''
+    Check if the journal row of an unfinished attempt can be reused.
+    '''
+
+    if row['JobID'] is None:
+        age = datetime.now() - datetime.fromisoformat(row['Updated'])
+        return age < retry_window
+
+    # The job may have finished without the journal being updated.
+    if active_job_ids is None:
+        active_job_ids = get_active_job_ids()
+
+    return row['JobID'] in active_job_ids
+
+
+def reserve_submission(ebid, job_type, new_attempt=False,
+                       active_job_ids=None,
+                       retry_window=SUBMISSION_RETRY_WINDOW,
+                       db_path=SUBMISSION_JOURNAL_DB):
+    '''
+    Return the journal entry for the current submission attempt of a job.
+
+    The latest attempt is returned, so a retry reuses its token, when it has not
+    finished and either its job is still pending or running, or it has no job ID
+    and was started within `retry_window`. Otherwise, or with `new_attempt=True`,
+    a new attempt is started.
+
+    Parameters
+    ----------
+    active_job_ids : set, optional
+        IDs of the pending and running jobs. Queried from squeue when needed
+        and not given (see `get_active_job_ids`).
+    retry_window : datetime.timedelta, optional
+        Time to keep retrying an attempt that has no job ID.
+
+    Returns
+    -------
+    entry : dict
+        The journal columns, and 'IsNew' which is True for a new attempt.
+    '''
+
+    with _connect_db(db_path) as conn:
+        row = conn.execute('''SELECT * FROM submissions WHERE EBID = ? AND JobType = ?
+                              ORDER BY Attempt DESC LIMIT 1''',
+                           (int(ebid), job_type)).fetchone()
+
+    conn.close()
+
+    is_reusable = row is not None and not new_attempt and row['Status'] != 'finished' and \
+        _can_reuse(row, active_job_ids=active_job_ids, retry_window=retry_window)
+
+    if is_reusable:
+        entry = dict(row)
+        entry['IsNew'] = False
+
+        return entry
+
+    if row is not None and not new_attempt and row['Status'] != 'finished':
+        log.info(f"Not reusing {ebid} {job_type} attempt {row['Attempt']} "
+                 f"(job {row['JobID']}). Starting a new attempt.")
+
+    attempt = 0 if row is None else row['Attempt'] + 1
+
+    entry = dict(Token=job_token(ebid, job_type, attempt),
+                 EBID=int(ebid), JobType=job_type, Attempt=attempt,
+                 JobID=None, Status='pending',
+                 Updated=datetime.now().isoformat())
+
+    with _connect_db(db_path) as conn:
+        conn.execute(f"INSERT INTO submissions VALUES "
+                     f"({','.join(['?'] * len(SUBMISSION_COLUMNS))})",
+                     [entry[col] for col in SUBMISSION_COLUMNS])
+
+    conn.close()
+
+    entry['IsNew'] = True
+
+    return entry
+
+
+def record_submission(token, job_id, db_path=SUBMISSION_JOURNAL_DB):
+    '''
+    Record the job ID of a submitted job.
+    '''
+
+    with _connect_db(db_path) as conn:
+        conn.execute('''UPDATE submissions SET JobID = ?, Status = 'submitted', Updated = ?
+                        WHERE Token = ?''',
+                     (str(job_id), datetime.now().isoformat(), token))
+    conn.close()
+
+
+def finish_submissions(job_ids, db_path=SUBMISSION_JOURNAL_DB):
+    '''
+    Mark the submissions of finished jobs so the next submission of that job
+    type starts a new attempt.
+    '''
+
+    job_ids = [str(job_id) for job_id in job_ids]
+
+    if len(job_ids) == 0:
+        return
+
+    with _connect_db(db_path) as conn:
+        conn.executemany('''UPDATE submissions SET Status = 'finished', Updated = ?
+                            WHERE JobID = ?''',
+                         [(datetime.now().isoformat(), job_id) for job_id in job_ids])
+    conn.close()
+
+
+def lookup_job_ids(job_ids, db_path=SUBMISSION_JOURNAL_DB):
+    '''
+    Return the EBID and job type of journaled job IDs, e.g. the
+    ARRAYJOBID_TASKID of campaign array tasks.
+
+    Returns
+    -------
+    entries : dict
+        (EBID, JobType) for each job ID found in the journal.
+    '''
+
+    job_ids = [str(job_id) for job_id in job_ids]
+
+    if len(job_ids) == 0:
+        return {}
+
+    with _connect_db(db_path) as conn:
+        rows = conn.execute(f"SELECT JobID, EBID, JobType FROM submissions WHERE "
+                            f"JobID IN ({','.join(['?'] * len(job_ids))})",
+                            job_ids).fetchall()
+    conn.close()
+
+    return {row['JobID']: (row['EBID'], row['JobType']) for row in rows}
+
+
+def _match_tokens(df, tokens):
+    '''
+    Job ID for each token in a table from `get_slurm_job_monitor` or `get_slurm_queue`.
+    '''
+
+    # Cancelled jobs include chains cancelled after a partial submission.
+    df = df[df['JobToken'].isin(tokens) & (df['State'].astype(str) != 'CANCELLED')]
+
+    return dict(zip(df['JobToken'], df['JobID'].astype(str)))
+
+
+def find_submitted_jobs(tokens, since=None, time_range_days=7):
+    '''
+    Search the cluster for jobs with the given tokens in their names.
+
+    The pending and running jobs in squeue are checked first. sacct is only
+    queried for the tokens that are not in the queue.
+
+    Parameters
+    ----------
+    since : datetime, optional
+        Time the submission attempts were started. Limits the sacct query to
+        jobs active since then. Otherwise `time_range_days` of history are used.
+
+    Returns
+    -------
+    job_ids : dict
+        Job ID for each token that was found.
+    '''
+
+    # Jobs submitted moments ago may not be in sacct yet.
+    queue_connect = setup_ssh_connection('cedar-robot-queuestatus')
+    df_queue = get_slurm_queue(queue_connect)
+    queue_connect.close()
+
+    job_ids = _match_tokens(df_queue, tokens)
+
+    missing_tokens = [token for token in tokens if token not in job_ids]
+
+    if len(missing_tokens) == 0:
+        return job_ids
+
+    # Allow for clock differences between here and the cluster.
+    start_time = None if since is None else since - SUBMISSION_CLOCK_MARGIN
+
+    connect = setup_ssh_connection('cedar-robot-jobstatus')
+    df = get_slurm_job_monitor(connect, time_range_days=time_range_days,
+                               start_time=start_time)
+    connect.close()
+
+    job_ids.update(_match_tokens(df, missing_tokens))
+
+    return job_ids
+
+
+def check_submission(entry, db_path=SUBMISSION_JOURNAL_DB):
+    '''
+    Return the job ID if the submission attempt in `entry` (from
+    `reserve_submission`) already reached the queue. Otherwise return None.
+    '''
+
+    if entry['JobID'] is not None:
+        log.info(f"Found job {entry['JobID']} for {entry['EBID']} {entry['JobType']} "
+                 f"attempt {entry['Attempt']} in the journal.")
+        return entry['JobID']
+
+    if entry['IsNew']:
+        return None
+
+    # A previous try may have hung after submitting the job.
+    job_id = find_submitted_jobs([entry['Token']],
+                                 since=datetime.fromisoformat(entry['Updated'])).get(entry['Token'])
+
+    if job_id is not None:
+        log.info(f"Found job {job_id} with token {entry['Token']} on the cluster.")
+        record_submission(entry['Token'], job_id, db_path=db_path)
+
+    return job_id
@@ -1,9 +1,14 @@
 
+import os
+import re
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
+from ..fs_ops import walk_entries
+
 
 def extract_flagging_tables(filename='t1-3.html'):
     '''
@@ -18,116 +23,338 @@ def extract_flagging_tables(filename='t1-3.html'):
     return [tab for tab in tables if "Task" not in tab.columns]
 
 
+# Manifest of the weblogs already extracted, stored in the dataset path.
+# The leading underscore keeps it out of the parquet dataset.
+WEBLOG_MANIFEST_NAME = "_weblog_manifest.csv"
+
+# One row per track, field and spw. The dataset is partitioned by target and config.
+# flag_percent is the mean over the num_values table columns with a value.
+FLAGGING_DATASET_COLUMNS = ['target', 'config', 'project', 'track', 'data_type',
+                            'qa_iteration', 'field', 'spw', 'flag_percent', 'num_values']
+
+FLAGGING_PARTITION_COLUMNS = ['target', 'config']
+
+# TARGET_CONFIG_PROJ.sbNUM.ebNUM.MJD_DATATYPE_products[_N]
+# where N is the QA iteration (0 when there is no suffix).
+PRODUCT_NAME_PATTERN = re.compile(r"^(?P<track>(?P<target>.+)_(?P<config>[^_]+)_(?P<project>[^_.]+)\.[^_]*)"
+                                  r"_(?P<data_type>continuum|speclines)_products(?:_(?P<qa_iteration>\d+))?$")
+
+
+def _product_name(filename):
+    '''
+    Name of the *_products folder the weblog is in.
+    '''
+
+    prod_name = [part for part in str(filename).split("/") if "_products" in part]
+    assert len(prod_name) == 1
+    return prod_name[0]
+
+
+def parse_product_name(prod_name):
+    '''
+    Return the target, config, project, track, data type and QA iteration
+    from a product folder name.
+    '''
+
+    match = PRODUCT_NAME_PATTERN.match(prod_name)
+
+    if match is None:
+        raise ValueError(f"Unable to parse product name {prod_name}")
+
+    info = match.groupdict()
+    info['qa_iteration'] = int(info['qa_iteration'] or 0)
+
+    return info
+
+
+def flagging_tables_to_records(tables, prod_name, skip_nan_cols=True):
+    '''
+    Convert the weblog flagging tables of one product to rows of the
+    flagging dataset. The flag percentage of each spw is averaged over the
+    table columns, and the number of columns with a value is kept to weight
+    the averages in `mean_flag_percent`.
+    '''
+
+    info = parse_product_name(prod_name)
+
+    records = []
+
+    for ii, this_table in enumerate(tables):
+
+        if skip_nan_cols:
+            this_table = this_table[::2]
+
+        values = this_table.apply(pd.to_numeric, errors='coerce')
+
+        records.append(pd.DataFrame({'field': ii,
+                                     'spw': pd.to_numeric(this_table.index, errors='coerce'),
+                                     'flag_percent': values.mean(axis=1).values,
+                                     'num_values': values.notnull().sum(axis=1).values}))
+
+    if len(records) == 0:
+        return pd.DataFrame(columns=FLAGGING_DATASET_COLUMNS)
+
+    df = pd.concat(records, ignore_index=True)
+    df = df[df['spw'].notnull()]
+
+    return df.assign(**info)[FLAGGING_DATASET_COLUMNS]
+
+
+def write_flagging_records(df, prod_name, dataset_path):
+    '''
+    Write the flagging rows of one product into the dataset. Previous rows of
+    the same product are replaced.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    pq.write_to_dataset(table, root_path=str(dataset_path),
+                        partition_cols=FLAGGING_PARTITION_COLUMNS,
+                        basename_template=f"{prod_name}-{{i}}.parquet",
+                        existing_data_behavior='overwrite_or_ignore')
+
+
+def dataset_product_names(dataset_path):
+    '''
+    Names of the products that are in the flagging dataset.
+    '''
+
+    if not os.path.exists(dataset_path):
+        return set()
+
+    return {entry.name.rsplit("-", 1)[0] for entry in walk_entries(dataset_path)
+            if entry.name.endswith(".parquet")}
+
+
+def load_flagging_dataset(dataset_path='space/vlaxl/summary_statistics/weblog_flagging_tables/',
+                          project='all',
+                          config='all',
+                          target='all',
+                          data_type=None,
+                          finalqa_only=False):
+    '''
+    Read the flagging dataset, filtered on the target, config, project and data type.
+
+    With `finalqa_only`, only the last QA iteration of each track is kept.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if not os.path.exists(dataset_path):
+        return pd.DataFrame(columns=FLAGGING_DATASET_COLUMNS)
+
+    partitioning = ds.partitioning(pa.schema([(col, pa.string()) for col in FLAGGING_PARTITION_COLUMNS]),
+                                   flavor='hive')
+
+    dataset = ds.dataset(str(dataset_path), format='parquet', partitioning=partitioning)
+
+    selections = {'target': target, 'config': config, 'project': project,
+                  'data_type': 'all' if data_type is None else data_type}
+
+    filter_expr = None
+    for col, value in selections.items():
+        if value == 'all':
+            continue
+
+        this_expr = ds.field(col) == value
+        filter_expr = this_expr if filter_expr is None else filter_expr & this_expr
+
+    df = dataset.to_table(filter=filter_expr).to_pandas()
+
+    if finalqa_only and len(df) > 0:
+        last_iteration = df.groupby(['track', 'data_type'])['qa_iteration'].transform('max')
+        df = df[df['qa_iteration'] == last_iteration]
+
+    return df
+
+
+def find_weblog_files(qa_path, target_filename='t1-3.html'):
+    '''
+    Return the path, modification time and size of every `target_filename`
+    below `qa_path`. The stat info comes from the same scandir walk.
+    '''
+
+    rows = []
+
+    for entry in walk_entries(qa_path):
+        if entry.name != target_filename or not entry.is_file(follow_symlinks=False):
+            continue
+
+        stat = entry.stat(follow_symlinks=False)
+        rows.append([entry.path, stat.st_mtime, stat.st_size])
+
+    return pd.DataFrame(rows, columns=['path', 'mtime', 'size'])
+
+
+def load_weblog_manifest(output_path):
+    '''
+    Return the manifest of extracted weblogs, or an empty table.
+    '''
+
+    manifest_file = Path(output_path) / WEBLOG_MANIFEST_NAME
+
+    if not manifest_file.exists():
+        return pd.DataFrame(columns=['path', 'mtime', 'size'])
+
+    return pd.read_csv(manifest_file)
+
+
+def diff_weblog_manifest(weblogs, manifest):
+    '''
+    Compare the weblogs from `find_weblog_files` to the manifest. The 'changed'
+    column is False for weblogs in the manifest with the same mtime and size.
+    '''
+
+    merged = weblogs.merge(manifest, on='path', how='left', suffixes=('', '_prev'))
+    merged['changed'] = (merged['mtime'] != merged['mtime_prev']) | \
+        (merged['size'] != merged['size_prev'])
+
+    return merged
+
+
+def _extract_flagging_records(filename, skip_nan_cols=True):
+    '''
+    Extract the flagging tables of one weblog as dataset rows.
+    This runs in the worker processes.
+    '''
+
+    tables = extract_flagging_tables(filename=filename)
+
+    return flagging_tables_to_records(tables, _product_name(filename),
+                                      skip_nan_cols=skip_nan_cols)
+
+
 def make_flagging_summary_tables(qa_path='bigdata/vlaxl/public_html/data/',
                                  output_path='space/vlaxl/summary_statistics/weblog_flagging_tables/',
                                  overwrite=False,
                                  target_filename='t1-3.html',
-                                 skip_nan_cols=True):
+                                 skip_nan_cols=True,
+                                 max_workers=None):
+    '''
+    Add the flagging tables of all weblogs in `qa_path` to the parquet
+    flagging dataset in `output_path`.
+
+    A manifest of the (path, mtime, size) of each weblog is kept in
+    `output_path`, and only new or changed weblogs are parsed. Products already
+    in the dataset are also skipped. With `overwrite` enabled, every weblog
+    found is parsed again. The weblogs are parsed over a pool of `max_workers`
+    processes.
+    '''
 
     path = Path(qa_path)
 
     output_path = Path(output_path)
     output_path.mkdir(exist_ok=True)
 
-    # Walk through all t1-3.html files
-    for filename in tqdm(path.glob(f"**/{target_filename}")):
+    weblogs = find_weblog_files(path, target_filename=target_filename)
 
-        # Extract the products name
-        prod_name = [part for part in str(filename).split("/") if "_products" in part]
-        assert len(prod_name) == 1
-        prod_name = prod_name[0]
+    manifest = load_weblog_manifest(output_path)
 
-        # Extract the tables:
-        tables = extract_flagging_tables(filename=filename)
+    merged = diff_weblog_manifest(weblogs, manifest)
+    is_changed = merged['changed']
 
-        for ii, this_table in enumerate(tables):
-            output_name = f"{prod_name}_field_{ii}.csv"
+    if overwrite:
+        filenames = list(merged['path'])
 
-            out_full_path = output_path / output_name
+    else:
+        filenames = list(merged.loc[is_changed, 'path'])
 
-            # Skip if it exists:
-            if not overwrite and out_full_path.exists():
-                continue
+        # Check for existing outputs before parsing.
+        existing_products = dataset_product_names(output_path)
+        filenames = [filename for filename in filenames
+                     if _product_name(filename) not in existing_products]
 
-            if skip_nan_cols:
-                this_table[::2].to_csv(out_full_path)
-            else:
-                this_table.to_csv(out_full_path)
+    print(f"Found {len(weblogs)} weblogs. Extracting {len(filenames)} weblogs.")
 
+    failed = []
 
-def make_flagging_statistics(project='20A-346',
-                             config='all',
-                             target='all',
-                             data_type='continuum',
-                             data_path='space/vlaxl/summary_statistics/weblog_flagging_tables/',
-                             finalqa_only=True):
-    '''
-    Expect file naming scheme:
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_extract_flagging_records, filename,
+                               skip_nan_cols=skip_nan_cols): filename
+                   for filename in filenames}
 
-    TARGET_CONFIG_SDMName
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            filename = futures[future]
+            try:
+                # Only this process writes to the dataset.
+                write_flagging_records(future.result(), _product_name(filename), output_path)
+            except Exception as exc:
+                print(f"Unable to extract tables from {filename}: {exc}")
+                failed.append(filename)
 
-    where the SDM name starts with the project code.
-    '''
+    # Only unchanged and newly extracted weblogs go in the manifest. Failed or
+    # skipped weblogs are checked again on the next run.
+    is_extracted = merged['path'].isin(filenames) & ~merged['path'].isin(failed)
 
-    path = Path(data_path)
+    merged.loc[~is_changed | is_extracted, ['path', 'mtime', 'size']].to_csv(
+        output_path / WEBLOG_MANIFEST_NAME, index=False)
 
-    if target is not "all":
-        target_string = f"{target}"
-    else:
-        target_string = "*"
 
-    if config is not "all":
-        config_string = f"{config}"
-    else:
-        config_string = "*"
+def convert_flagging_csvs(csv_path, dataset_path):
+    '''
+    Add the per-field csv tables from older versions of
+    `make_flagging_summary_tables` (PRODUCTNAME_field_N.csv) to the dataset.
+    '''
 
-    if project is not "all":
-        project_string = f"{project}"
-    else:
-        project_string = ""
+    tables = {}
+
+    for filename in sorted(Path(csv_path).glob("*_field_*.csv")):
+        prod_name, field = filename.stem.rsplit("_field_", 1)
+        tables.setdefault(prod_name, {})[int(field)] = pd.read_csv(filename, index_col=0)
 
-    search_string = f"{target_string}_{config_string}_{project_string}"
+    for prod_name, prod_tables in tqdm(tables.items()):
+        fields = sorted(prod_tables)
 
-    table_list = []
+        # The csv files already skip the NaN rows.
+        df = flagging_tables_to_records([prod_tables[field] for field in fields],
+                                        prod_name, skip_nan_cols=False)
+        # Keep the field numbers from the file names.
+        df['field'] = df['field'].map(dict(enumerate(fields)))
 
-    print(f"{search_string}*{data_type}*.csv")
+        write_flagging_records(df, prod_name, dataset_path)
 
-    for filename in path.glob(f"{search_string}*{data_type}*.csv"):
 
-        # Only include if this was the final run for the QA
-        if finalqa_only:
-            # Grab every instance with the SDM name and data type and find the
-            # highest N iteration for the final version.
+def mean_flag_percent(df, by='spw'):
+    '''
+    Mean flag percentage over all table columns of the rows in each `by`
+    group, weighting each row by its `num_values`. This matches averaging
+    the original weblog table columns together.
+    '''
 
-            sdm_type_name = f"{filename.name.split(data_type)[0]}{data_type}"
+    weighted = df.assign(flag_sum=df['flag_percent'] * df['num_values'])
+    weighted = weighted[weighted['num_values'] > 0]
 
-            qa_iteration = [str(this_file).split("products")[1][1] for this_file in
-                            path.glob(f"{sdm_type_name}*")]
-            # Switch the 0th iteration to a number:
-            qa_iteration = [val if val != "f"  else "0" for val in qa_iteration]
-            qa_iteration = np.array(qa_iteration).astype(int)
+    sums = weighted.groupby(by)[['flag_sum', 'num_values']].sum()
 
-            last_iteration = qa_iteration.max()
+    return (sums['flag_sum'] / sums['num_values']).rename('flag_percent')
 
-            if last_iteration == 0:
-                check_string = f"{sdm_type_name}_products"
-            else:
-                check_string = f"{sdm_type_name}_products_{last_iteration}"
 
-            if not check_string in filename.name:
-                continue
+def make_flagging_statistics(project='20A-346',
+                             config='all',
+                             target='all',
+                             data_type='continuum',
+                             data_path='space/vlaxl/summary_statistics/weblog_flagging_tables/',
+                             finalqa_only=True):
+    '''
+    Average flag percentage per spw of the tracks matching the target,
+    config and project in the flagging dataset.
 
-        this_tab = pd.read_csv(filename, index_col=0,)
+    With `finalqa_only`, only the final QA iteration of each track is used.
+    '''
 
-        table_list.append(this_tab)
+    df = load_flagging_dataset(data_path, project=project, config=config,
+                               target=target, data_type=data_type,
+                               finalqa_only=finalqa_only)
 
-    if len(table_list) == 0:
-        print(f"Unable to find any files matching: {search_string}")
+    if len(df) == 0:
+        print(f"Unable to find any tables matching: {target}_{config}_{project} {data_type}")
         return None
 
-    else:
-        all_tab = pd.concat(table_list, axis=1).mean(axis=1)
-        return all_tab
+    return mean_flag_percent(df, by='spw')
 
 
 def make_config_flagging_summary_plots(project='20A-346',
@@ -136,18 +363,25 @@ def make_config_flagging_summary_plots(project='20A-346',
                                        out_name="spw_flagging_summary.png",
                                        finalqa_only=True,
                                        data_type='continuum',
-                                       print_stats=True):
+                                       print_stats=True,
+                                       data_path='space/vlaxl/summary_statistics/weblog_flagging_tables/'):
 
     import matplotlib.pyplot as plt
 
+    # One read of the dataset for all configs.
+    df = load_flagging_dataset(data_path, project=project, data_type=data_type,
+                               finalqa_only=finalqa_only)
+
+    config_stats = mean_flag_percent(df, by=['config', 'spw'])
+
     ax = plt.subplot(111)
 
     for config in "ABCD":
-        tab = make_flagging_statistics(project=project,
-                                       target='all',
-                                       config=config,
-                                       finalqa_only=finalqa_only,
-                                       data_type=data_type)
+
+        if config in config_stats.index.get_level_values('config'):
+            tab = config_stats.loc[config]
+        else:
+            tab = None
 
         if print_stats:
             print(f"Config: {config}")
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+from ..globus_functions import globus_backends, task_monitor
+from ..globus_functions.globus_backends import FakeTransferBackend
+from ..globus_functions.task_monitor import GlobusTaskMonitor
+from ..globus_functions.deletion_queue import DeletionQueue
+from ..globus_functions.globus_wrappers import _retrieve_exception
+
+
+class BlockingDeleteBackend(FakeTransferBackend):
+    '''
+    Holds the first delete submission until `release` is set.
+    '''
+
+    def __init__(self, root):
+        super().__init__(root)
+
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def submit_delete(self, *args, **kwargs):
+        self.started.set()
+        self.release.wait(10)
+        return super().submit_delete(*args, **kwargs)
+
+
+def test_enqueue_during_inflight_flush(tmp_path, monkeypatch):
+
+    endpoint = tmp_path / "endpoint"
+    endpoint.mkdir()
+    (endpoint / "first.tar").write_text("a")
+    (endpoint / "second.tar").write_text("b")
+
+    backend = BlockingDeleteBackend(tmp_path)
+    monkeypatch.setattr(globus_backends, "_BACKEND", backend)
+    monkeypatch.setattr(task_monitor, "_TASK_MONITOR", GlobusTaskMonitor(min_interval=0.01))
+
+    async def run():
+
+        queue = DeletionQueue(batch_window=0.01)
+
+        first = queue.enqueue("endpoint", "/first.tar")
+
+        # Wait for the first delete to be submitted, then queue another path.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, backend.started.wait, 10)
+
+        second = queue.enqueue("endpoint", "/second.tar")
+
+        backend.release.set()
+
+        await asyncio.wait_for(asyncio.gather(first, second), 10)
+
+    asyncio.run(run())
+
+    assert not (endpoint / "first.tar").exists()
+    assert not (endpoint / "second.tar").exists()
+
+
+def test_close_submits_pending(tmp_path, monkeypatch):
+
+    endpoint = tmp_path / "endpoint"
+    endpoint.mkdir()
+    (endpoint / "first.tar").write_text("a")
+
+    monkeypatch.setattr(globus_backends, "_BACKEND", FakeTransferBackend(tmp_path))
+    monkeypatch.setattr(task_monitor, "_TASK_MONITOR", GlobusTaskMonitor(min_interval=0.01))
+
+    async def run():
+
+        # The batch window is far longer than the test.
+        queue = DeletionQueue(batch_window=3600)
+
+        future = queue.enqueue("endpoint", "/first.tar")
+        future.add_done_callback(_retrieve_exception)
+
+        await asyncio.wait_for(queue.close(), 10)
+
+        return future
+
+    future = asyncio.run(run())
+
+    assert future.done()
+    assert not (endpoint / "first.tar").exists()
+
+
+def test_retrieve_exception_cancelled():
+
+    errors = []
+
+    async def run():
+
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        future.cancel()
+
+        # Let the callback run.
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert errors == []
@@ -0,0 +1,176 @@
+import os
+import errno
+import stat
+
+import pytest
+
+from .. import fs_ops
+from ..fs_ops import (chmod_recursive, remove_tree, move_path, copy_file,
+                      get_fs_timings, reset_fs_timings)
+
+
+def _make_tree(path):
+
+    (path / "sub" / "nested").mkdir(parents=True)
+    (path / "top.txt").write_text("top")
+    (path / "sub" / "mid.txt").write_text("mid")
+    (path / "sub" / "nested" / "low.txt").write_text("low")
+
+    return path
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_chmod_recursive(tmp_path):
+
+    tree = _make_tree(tmp_path / "tree")
+
+    outside = tmp_path / "outside.txt"
+    outside.write_text("outside")
+    os.chmod(outside, 0o600)
+    os.symlink(outside, tree / "sub" / "link.txt")
+
+    chmod_recursive(tree, 0o750)
+
+    for path in [tree, tree / "top.txt", tree / "sub", tree / "sub" / "nested" / "low.txt"]:
+        assert _mode(path) == 0o750
+
+    # Links are not followed.
+    assert _mode(outside) == 0o600
+
+    chmod_recursive(tree / "top.txt", 0o640)
+
+    assert _mode(tree / "top.txt") == 0o640
+
+
+def test_remove_tree(tmp_path):
+
+    tree = _make_tree(tmp_path / "tree")
+
+    outside = tmp_path / "outside.txt"
+    outside.write_text("outside")
+    os.symlink(outside, tree / "sub" / "link.txt")
+
+    remove_tree(tree)
+
+    assert not tree.exists()
+    assert outside.exists()
+
+    remove_tree(outside)
+
+    assert not outside.exists()
+
+    with pytest.raises(FileNotFoundError):
+        remove_tree(tmp_path / "missing")
+
+    remove_tree(tmp_path / "missing", missing_ok=True)
+
+
+def test_move_path(tmp_path):
+
+    tree = _make_tree(tmp_path / "tree")
+
+    move_path(tree, tmp_path / "moved")
+
+    assert not tree.exists()
+    assert (tmp_path / "moved" / "sub" / "nested" / "low.txt").read_text() == "low"
+
+    # An existing file is replaced.
+    (tmp_path / "dst.txt").write_text("old")
+    move_path(tmp_path / "moved" / "top.txt", tmp_path / "dst.txt")
+
+    assert (tmp_path / "dst.txt").read_text() == "top"
+
+
+@pytest.mark.parametrize('is_dir', [True, False])
+def test_move_path_cross_device(tmp_path, monkeypatch, is_dir):
+
+    def cross_device(src, dst, *args, **kwargs):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    if is_dir:
+        src = _make_tree(tmp_path / "tree")
+    else:
+        src = tmp_path / "file.txt"
+        src.write_text("data")
+
+    dst = tmp_path / "moved"
+
+    # Renames fail as they would between file systems.
+    monkeypatch.setattr(fs_ops.os, "replace", cross_device)
+    monkeypatch.setattr(fs_ops.os, "rename", cross_device)
+
+    move_path(src, dst)
+
+    assert not src.exists()
+
+    if is_dir:
+        assert (dst / "sub" / "nested" / "low.txt").read_text() == "low"
+    else:
+        assert dst.read_text() == "data"
+
+
+def test_move_path_error(tmp_path, monkeypatch):
+
+    def no_permission(src, dst):
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    src = tmp_path / "file.txt"
+    src.write_text("data")
+
+    monkeypatch.setattr(fs_ops.os, "replace", no_permission)
+
+    with pytest.raises(PermissionError):
+        move_path(src, tmp_path / "moved.txt")
+
+    assert src.exists()
+
+
+def test_copy_file(tmp_path):
+
+    src = tmp_path / "file.txt"
+    src.write_text("data")
+    os.chmod(src, 0o640)
+
+    (tmp_path / "folder").mkdir()
+
+    dst = copy_file(src, tmp_path / "folder")
+
+    assert dst == os.path.join(tmp_path / "folder", "file.txt")
+    assert (tmp_path / "folder" / "file.txt").read_text() == "data"
+    assert _mode(dst) == 0o640
+
+    (tmp_path / "other.txt").write_text("old")
+    copy_file(src, tmp_path / "other.txt")
+
+    assert (tmp_path / "other.txt").read_text() == "data"
+
+    with pytest.raises(FileNotFoundError):
+        copy_file(tmp_path / "missing.txt", tmp_path / "folder")
+
+    # No partial copies are left behind.
+    assert sorted(os.listdir(tmp_path / "folder")) == ["file.txt"]
+
+
+def test_fs_timings(tmp_path):
+
+    reset_fs_timings()
+
+    src = tmp_path / "file.txt"
+    src.write_text("data")
+
+    copy_file(src, tmp_path / "copy.txt")
+    copy_file(src, tmp_path / "copy2.txt")
+    remove_tree(tmp_path / "copy.txt")
+
+    timings = get_fs_timings()
+
+    assert set(timings) == {'copy_file', 'remove_tree'}
+    assert timings['copy_file'][0] == 2
+    assert timings['remove_tree'][0] == 1
+
+    reset_fs_timings()
+
+    assert get_fs_timings() == {}
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from ..job_monitor import parse_slurm_timedelta
+from ..job_accounting import format_slurm_timedelta, summarize_job_times
+
+
+def test_format_slurm_timedelta():
+
+    values = ["1-02:03:04", "00:00:59", "7-00:00:00", "UNLIMITED"]
+
+    timestrs = format_slurm_timedelta(parse_slurm_timedelta(values))
+
+    assert timestrs.tolist() == ["1-02:03:04", "0-00:00:59", "7-00:00:00", ""]
+
+    # Seconds are also accepted.
+    assert format_slurm_timedelta([93784., np.nan]).tolist() == ["1-02:03:04", ""]
+
+
+def test_summarize_job_times():
+
+    df = pd.DataFrame({'JobID': [1, 2, 3, 4],
+                       'TrackName': ["M31_C_20A-346.sb1.eb10.59000.1",
+                                     "M31_C_20A-346.sb1.eb11.59000.1",
+                                     "M33_B_20A-346.sb1.eb12.59000.1",
+                                     "M33_B_20A-346.sb1.eb13.59000.1"],
+                       'JobType': ['continuum', 'continuum', 'continuum', 'speclines'],
+                       'State': ['COMPLETED', 'FAILED', 'COMPLETED', 'COMPLETED'],
+                       'Elapsed': ["01:00:00", "1-01:00:00", "00:30:00", "02:00:00"],
+                       'TotalCPU': ["02:00:00", "2-00:00:00", "30:00.000", "04:00:00"]})
+
+    summary = summarize_job_times(df, job_type='continuum')
+
+    assert summary['num_jobs'].to_dict() == {('M31', 'C'): 2, ('M33', 'B'): 1}
+
+    m31 = summary.loc[('M31', 'C')]
+    assert m31['Elapsed_hr_total'] == 26.
+    assert m31['Elapsed_hr_median'] == 13.
+    assert m31['TotalCPU_hr_total'] == 50.
+    assert m31['Elapsed_total'] == "1-02:00:00"
+    assert m31['TotalCPU_total'] == "2-02:00:00"
+
+    assert summary.loc[('M33', 'B'), 'TotalCPU_total'] == "0-00:30:00"
+
+    summary = summarize_job_times(df, by=['Configuration'], completed_only=True)
+
+    assert summary['num_jobs'].to_dict() == {'B': 2, 'C': 1}
+    assert summary.loc['B', 'Elapsed_total'] == "0-02:30:00"
+
+    # Times in seconds, as stored by `record_job_resources`.
+    df_seconds = df.assign(Elapsed=parse_slurm_timedelta(df['Elapsed']).dt.total_seconds(),
+                           TotalCPU=parse_slurm_timedelta(df['TotalCPU']).dt.total_seconds())
+
+    pd.testing.assert_frame_equal(summarize_job_times(df_seconds, job_type='continuum'),
+                                  summarize_job_times(df, job_type='continuum'))
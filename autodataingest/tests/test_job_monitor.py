@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..job_monitor import (parse_slurm_timedelta, parse_slurm_memory, parse_sacct_output,
+                           SACCT_FIELDS)
+
+
+@pytest.mark.parametrize(('value', 'expected'),
+                         [("1-02", timedelta(days=1, hours=2)),
+                          ("1-02:30", timedelta(days=1, hours=2, minutes=30)),
+                          ("3-04:05:06", timedelta(days=3, hours=4, minutes=5, seconds=6)),
+                          ("02:03:04", timedelta(hours=2, minutes=3, seconds=4)),
+                          ("05:30.250", timedelta(minutes=5, seconds=30.25)),
+                          ("45", timedelta(seconds=45)),
+                          ("UNLIMITED", None),
+                          ("Partition_Limit", None),
+                          ("INVALID", None),
+                          ("", None)])
+def test_parse_slurm_timedelta(value, expected):
+
+    result = parse_slurm_timedelta([value])[0]
+
+    if expected is None:
+        assert pd.isnull(result)
+    else:
+        assert result == pd.Timedelta(expected)
+
+
+def test_parse_slurm_memory():
+
+    values = ["1024K", "2.5G", "4000Mc", "4000Mn", "16G", "2Gc", ""]
+    ncpus = ["1", "1", "8", "8", "8", "0", "1"]
+
+    memory = parse_slurm_memory(values, ncpus=ncpus)
+
+    expected = [1024**2, 2.5 * 1024**3, 8 * 4000 * 1024**2, 4000 * 1024**2,
+                16 * 1024**3, np.nan, np.nan]
+
+    np.testing.assert_allclose(memory.values, expected)
+
+    # Without the CPU counts the per-core value is returned.
+    assert parse_slurm_memory(["4000Mc"])[0] == 4000 * 1024**2
+
+
+TRACK = "M31_C_20A-346.sb1.eb10.59000.1"
+
+SACCT_ROWS = [
+    # JobID, JobIDRaw, JobName, State, Elapsed, TotalCPU, MaxRSS, MaxDiskRead,
+    # MaxDiskWrite, ReqMem, AllocCPUS, Timelimit, End
+    ["101", "101", f"{TRACK}.vla_pipeline.continuum_pipeline-j0123456789ab", "COMPLETED",
+     "1-02:00:00", "2-00:00:00", "", "", "", "4000Mc", "8", "7-00:00:00", "2026-01-02T03:04:05"],
+    ["101.batch", "101.batch", "batch", "COMPLETED",
+     "1-02:00:00", "2-00:00:00", "20G", "1G", "2G", "4000Mc", "8", "", "2026-01-02T03:04:05"],
+    ["101.extern", "101.extern", "extern", "COMPLETED",
+     "1-02:00:00", "00:00.010", "1024K", "5G", "0", "4000Mc", "8", "", "2026-01-02T03:04:05"],
+    ["102_3", "105", f"{TRACK}.vla_pipeline.speclines_pipeline", "CANCELLED by 1234",
+     "00:10:00", "05:00.500", "", "", "", "32G", "4", "UNLIMITED", "Unknown"],
+    ["103_[1-5]", "103", f"{TRACK}.vla_pipeline.speclines_pipeline", "PENDING",
+     "00:00:00", "00:00:00", "", "", "", "32G", "0", "1-00:00:00", "Unknown"],
+    ["104", "104", "interactive", "RUNNING",
+     "00:01:00", "00:00:00", "", "", "", "1G", "1", "01:00:00", "Unknown"],
+]
+
+
+def test_parse_sacct_output():
+
+    output = "\n".join(["|".join(SACCT_FIELDS)] + ["|".join(row) for row in SACCT_ROWS])
+
+    df = parse_sacct_output(output)
+
+    # Job steps are folded into their job. The un-started array and the job
+    # that is not from the pipeline are dropped.
+    assert df['JobID'].tolist() == [101, 105]
+    assert df['ArrayJobID'].tolist() == ["", "102_3"]
+    assert df['EBID'].tolist() == [10, 10]
+    assert df['TrackName'].tolist() == [TRACK, TRACK]
+    assert df['JobType'].tolist() == ['continuum_pipeline', 'speclines_pipeline']
+    assert df['JobToken'][0] == "j0123456789ab"
+    assert df['State'].astype(str).tolist() == ['COMPLETED', 'CANCELLED']
+
+    job = df.iloc[0]
+    assert job['MaxRSS'] == 20 * 1024**3
+    assert job['MaxDiskRead'] == 5 * 1024**3
+    assert job['MaxDiskWrite'] == 2 * 1024**3
+    assert job['ReqMem'] == 8 * 4000 * 1024**2
+    assert job['Elapsed'] == pd.Timedelta(days=1, hours=2)
+    assert job['TotalCPU'] == pd.Timedelta(days=2)
+    assert job['End'] == pd.Timestamp("2026-01-02T03:04:05")
+
+    job = df.iloc[1]
+    assert job['ReqMem'] == 32 * 1024**3
+    assert pd.isnull(job['MaxRSS'])
+    assert pd.isnull(job['Timelimit'])
+    assert pd.isnull(job['End'])
+
+    assert 'AllocCPUS' not in df.columns
+
+
+def test_parse_sacct_output_missing_fields():
+
+    with pytest.raises(ValueError, match="AllocCPUS"):
+        parse_sacct_output("|".join([field for field in SACCT_FIELDS if field != 'AllocCPUS']))
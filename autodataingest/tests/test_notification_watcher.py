@@ -0,0 +1,113 @@
+import asyncio
+import mailbox
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+
+import pytest
+
+# The index module imports the gmail client at import time.
+pytest.importorskip("ezgmail")
+pytest.importorskip("googleapiclient")
+
+from ..email_notifications.notification_index import NotificationIndex
+from ..email_notifications.notification_watcher import MaildirSource, NotificationWatcher
+
+
+TRACK = "M31_C_20A-346.sb1.eb10.59000.1"
+
+
+def _drop_message(maildir_path, subject, timestamp=None):
+
+    message = mailbox.MaildirMessage()
+    message['Subject'] = subject
+    message['Date'] = format_datetime((timestamp or datetime.now()).astimezone())
+    message.set_payload("")
+
+    return mailbox.Maildir(maildir_path).add(message)
+
+
+def _make_watcher(tmp_path):
+
+    maildir_path = str(tmp_path / "jobs")
+    mailbox.Maildir(maildir_path, create=True)
+
+    index = NotificationIndex(db_path=str(tmp_path / "notification_index.db"))
+
+    watcher = NotificationWatcher([MaildirSource(maildir_path, 'job')],
+                                  index=index, interval=0.01)
+
+    return watcher, index, maildir_path
+
+
+def test_wait_for_dropped_message(tmp_path):
+
+    watcher, index, maildir_path = _make_watcher(tmp_path)
+
+    async def run():
+
+        waiter = asyncio.ensure_future(watcher.wait_for('job', key=1240, finished_only=True,
+                                                        timeout=10))
+
+        # Let the watcher sync the empty maildir first.
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        _drop_message(maildir_path, f"Slurm Job_id=1239 Name={TRACK}.vla_pipeline.continuum "
+                      "Ended, Run time 00:10:00, FAILED, ExitCode 1")
+        # The start message of the job has no state.
+        _drop_message(maildir_path, f"Slurm Array Task Job_id=1234_5 (1240) "
+                      f"Name={TRACK}.vla_pipeline.continuum Began, Queued time 00:00:01")
+
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        _drop_message(maildir_path, f"Slurm Array Task Job_id=1234_5 (1240) "
+                      f"Name={TRACK}.vla_pipeline.continuum "
+                      "Ended, Run time 01:02:03, COMPLETED, ExitCode 0")
+
+        return await waiter
+
+    event = asyncio.run(run())
+
+    assert event.kind == 'job'
+    assert event.key == '1240'
+    assert event.status == 'COMPLETED'
+    assert event.runtime == '01:02:03'
+    assert event.message_id.startswith("maildir:")
+
+    # The messages are indexed once.
+    assert set(index.lookup('job', [1239, 1240])) == {'1239', '1240'}
+    assert MaildirSource(maildir_path, 'job').sync(index) == 0
+
+
+def test_wait_for_indexed_message(tmp_path):
+
+    watcher, index, maildir_path = _make_watcher(tmp_path)
+
+    sent = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+
+    _drop_message(maildir_path, f"Slurm Job_id=1250 Name={TRACK}.vla_pipeline.speclines "
+                  "Ended, Run time 02:00:00, TIMEOUT, ExitCode 0", timestamp=sent)
+
+    # Messages indexed before the watcher started are not events, but are
+    # found with `since`.
+    MaildirSource(maildir_path, 'job').sync(index)
+
+    async def run():
+
+        event = await watcher.wait_for_job(1250, since=sent - timedelta(minutes=5), timeout=1)
+
+        # No sync was needed.
+        assert watcher._runner is None
+
+        # Notifications from before `since` do not match.
+        with pytest.raises(asyncio.TimeoutError):
+            await watcher.wait_for_job(1250, since=sent + timedelta(minutes=5), timeout=0.1)
+
+        return event
+
+    event = asyncio.run(run())
+
+    assert event.key == '1250'
+    assert event.status == 'TIMEOUT'
+    assert event.timestamp == sent
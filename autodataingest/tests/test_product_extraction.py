@@ -0,0 +1,115 @@
+import io
+import tarfile
+
+from ..product_extraction import extract_selected_members, QA_PRODUCT_MEMBERS
+
+
+def _add_file(tar, name, data):
+
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _add_dir(tar, name):
+
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    tar.addfile(info)
+
+
+def _make_products_tar(tar_path):
+
+    weblog = io.BytesIO()
+    with tarfile.open(fileobj=weblog, mode='w:gz') as weblog_tar:
+        _add_dir(weblog_tar, "pipeline-123")
+        _add_dir(weblog_tar, "pipeline-123/html")
+        _add_file(weblog_tar, "pipeline-123/html/t1-3.html", b"<html></html>")
+
+    with tarfile.open(tar_path, mode='w') as tar:
+        _add_dir(tar, "products")
+        _add_file(tar, "products/weblog.tgz", weblog.getvalue())
+        _add_dir(tar, "products/finalBPcal_txt")
+        _add_file(tar, "products/finalBPcal_txt/spw0.txt", b"spw0")
+        _add_file(tar, "products/finalBPcal_txt/spw1.txt", b"spw1")
+        _add_dir(tar, "products/quicklook_imaging")
+        _add_file(tar, "products/quicklook_imaging/field0.png", b"png")
+
+        link = tarfile.TarInfo("products/quicklook_imaging/latest.png")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "field0.png"
+        tar.addfile(link)
+
+        _add_file(tar, "products/spw_definitions.npy", b"npy")
+        _add_file(tar, "products/track.ms.split.tar", b"not selected")
+
+
+def test_extract_qa_members(tmp_path):
+
+    tar_path = tmp_path / "track_continuum_products.tar"
+    _make_products_tar(tar_path)
+
+    output_path = tmp_path / "output"
+
+    num_extracted = extract_selected_members(tar_path, output_path, QA_PRODUCT_MEMBERS,
+                                             strip_components=1,
+                                             unpack_nested={"products/weblog.tgz": "weblog"})
+
+    # The directory selections include the directory itself. The link is skipped.
+    # The nested weblog has html/ and t1-3.html after its top folder is stripped.
+    assert num_extracted == {"products/weblog.tgz": 2,
+                             "products/finalBPcal_txt": 3,
+                             "products/final_caltable_txt": 0,
+                             "products/scan_plots_txt": 0,
+                             "products/quicklook_imaging": 2,
+                             "products/spw_definitions.npy": 1}
+
+    # The weblog is unpacked without its top folder and the archive is not kept.
+    assert (output_path / "weblog" / "html" / "t1-3.html").read_bytes() == b"<html></html>"
+    assert not (output_path / "weblog.tgz").exists()
+
+    assert (output_path / "finalBPcal_txt" / "spw1.txt").read_bytes() == b"spw1"
+    assert (output_path / "quicklook_imaging" / "field0.png").exists()
+    assert not (output_path / "quicklook_imaging" / "latest.png").exists()
+    assert (output_path / "spw_definitions.npy").exists()
+
+    assert sorted(path.name for path in output_path.iterdir()) == \
+        ["finalBPcal_txt", "quicklook_imaging", "spw_definitions.npy", "weblog"]
+
+
+def test_extract_without_strip_or_unpack(tmp_path):
+
+    tar_path = tmp_path / "track_continuum_products.tar"
+    _make_products_tar(tar_path)
+
+    output_path = tmp_path / "output"
+
+    num_extracted = extract_selected_members(tar_path, output_path,
+                                             ["products/weblog.tgz", "products/finalBPcal_txt/"],
+                                             strip_components=0)
+
+    assert num_extracted == {"products/weblog.tgz": 1, "products/finalBPcal_txt": 3}
+
+    assert (output_path / "products" / "finalBPcal_txt" / "spw0.txt").exists()
+
+    with tarfile.open(output_path / "products" / "weblog.tgz") as weblog_tar:
+        assert "pipeline-123/html/t1-3.html" in weblog_tar.getnames()
+
+
+def test_extract_missing_members(tmp_path):
+
+    tar_path = tmp_path / "track_continuum_products.tar"
+    _make_products_tar(tar_path)
+
+    output_path = tmp_path / "output"
+
+    # The top-level folder is removed by the strip and not extracted.
+    num_extracted = extract_selected_members(tar_path, output_path,
+                                             ["products", "products/missing.txt"],
+                                             strip_components=1)
+
+    assert num_extracted["products/missing.txt"] == 0
+    assert num_extracted["products"] == 8
+
+    assert (output_path / "track.ms.split.tar").exists()
@@ -0,0 +1,30 @@
+from ..fs_ops import copy_file
+from ..qa_build_service import build_qa_products, timed_step
+
+
+class FakePipeline(object):
+
+    ebid = 1
+
+    def __init__(self, path):
+        self.path = path
+
+    def make_qa_products(self, data_type='continuum', timings=None):
+
+        with timed_step(timings, 'publish'):
+            copy_file(self.path / "weblog.tgz", self.path / "published.tgz")
+
+        return True
+
+
+def test_build_qa_products_fs_timings(tmp_path):
+
+    (tmp_path / "weblog.tgz").write_text("weblog")
+
+    result = build_qa_products(FakePipeline(tmp_path), 'continuum')
+
+    assert result.success
+    assert (tmp_path / "published.tgz").exists()
+
+    assert set(result.timings) == {'publish', 'total', 'fs_copy_file'}
+    assert result.timings['fs_copy_file'] <= result.timings['publish']
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pandas as pd
+
+from .. import submission_journal
+from ..submission_journal import (find_submitted_jobs, job_token,
+                                  SUBMISSION_CLOCK_MARGIN)
+
+
+class FakeConnection(object):
+
+    def close(self):
+        pass
+
+
+def _jobs(job_ids, tokens, states):
+    return pd.DataFrame({'JobID': job_ids, 'JobToken': tokens, 'State': states})
+
+
+def test_find_submitted_jobs(monkeypatch):
+
+    queued = job_token(1, 'continuum', 0)
+    finished = job_token(1, 'speclines', 0)
+    cancelled = job_token(2, 'continuum', 0)
+
+    sacct_calls = []
+
+    def fake_job_monitor(connect, time_range_days=7, start_time=None):
+        sacct_calls.append(start_time)
+        return _jobs([11, 12], [finished, cancelled], ['COMPLETED', 'CANCELLED'])
+
+    monkeypatch.setattr(submission_journal, "setup_ssh_connection",
+                        lambda name: FakeConnection())
+    monkeypatch.setattr(submission_journal, "get_slurm_queue",
+                        lambda connect: _jobs([10], [queued], ['PENDING']))
+    monkeypatch.setattr(submission_journal, "get_slurm_job_monitor", fake_job_monitor)
+
+    # Jobs in the queue do not need the sacct history.
+    assert find_submitted_jobs([queued]) == {queued: '10'}
+    assert sacct_calls == []
+
+    since = datetime(2026, 1, 1, 12)
+
+    job_ids = find_submitted_jobs([queued, finished, cancelled], since=since)
+
+    assert job_ids == {queued: '10', finished: '11'}
+    assert sacct_calls == [since - SUBMISSION_CLOCK_MARGIN]
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from ..globus_functions import globus_backends, globus_wrappers, task_monitor
+from ..globus_functions.globus_backends import FakeTransferBackend
+from ..globus_functions.task_monitor import GlobusTaskMonitor
+from ..transfer_metrics import record_transfer, load_transfer_metrics
+
+
+class MissingTaskBackend(FakeTransferBackend):
+    '''
+    The task list never returns any tasks.
+    '''
+
+    def get_tasks(self, task_ids):
+        return []
+
+
+def test_wait_for_missing_task(tmp_path, monkeypatch):
+
+    db_path = str(tmp_path / "transfer_metrics.db")
+
+    monkeypatch.setattr(globus_backends, "_BACKEND", MissingTaskBackend(tmp_path))
+    monkeypatch.setattr(task_monitor, "_TASK_MONITOR",
+                        GlobusTaskMonitor(min_interval=0.01, max_missing_polls=3))
+    monkeypatch.setattr(globus_wrappers, "record_transfer",
+                        lambda task, **kwargs: record_transfer(task, db_path=db_path, **kwargs))
+
+    with pytest.raises(ValueError, match="not found in 3 polls"):
+        asyncio.run(globus_wrappers.globus_wait_for_completion("missing-task", sleeptime=1,
+                                                                timeout=10, ebid=1234,
+                                                                stage='archive_transfer'))
+
+    df = load_transfer_metrics(db_path=db_path)
+
+    assert list(df['TaskID']) == ["missing-task"]
+    assert list(df['Status']) == ["NOT_FOUND"]
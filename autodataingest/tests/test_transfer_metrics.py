@@ -0,0 +1,25 @@
+import os
+
+from ..cluster_configs import local_db_path, LOCAL_DB_DIR
+from ..transfer_metrics import record_transfer, load_transfer_metrics
+
+
+def test_db_folder_made_on_connect(tmp_path):
+
+    assert local_db_path('transfer_metrics.db') == os.path.join(LOCAL_DB_DIR, 'transfer_metrics.db')
+
+    db_path = str(tmp_path / "stores" / "transfer_metrics.db")
+
+    assert not os.path.exists(os.path.dirname(db_path))
+
+    record_transfer({'task_id': 'task', 'status': 'SUCCEEDED',
+                     'request_time': '2026-01-01T00:00:00+00:00',
+                     'completion_time': '2026-01-01T00:01:40+00:00',
+                     'bytes_transferred': 1e9},
+                    ebid=1, stage='test', startnode='cc-cedar', endnode='ingester',
+                    db_path=db_path)
+
+    df = load_transfer_metrics(db_path=db_path)
+
+    assert df['TaskID'].tolist() == ['task']
+    assert df['Rate_MBs'].iloc[0] == 10.
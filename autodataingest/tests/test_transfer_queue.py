@@ -0,0 +1,82 @@
+import asyncio
+
+from ..cluster_configs import ENDPOINT_INFO
+from ..globus_functions import globus_backends, listing_cache
+from ..globus_functions.globus_backends import FakeTransferBackend
+from ..globus_functions.listing_cache import ListingCache
+from ..globus_functions.globus_wrappers import transfer_batch
+from ..globus_functions.transfer_queue import TransferQueue
+
+
+def _setup_backend(tmp_path, monkeypatch):
+
+    backend = FakeTransferBackend(tmp_path)
+    monkeypatch.setattr(globus_backends, "_BACKEND", backend)
+    monkeypatch.setattr(listing_cache, "_LISTING_CACHE", ListingCache())
+
+    endpoint = tmp_path / ENDPOINT_INFO['cc-cedar']['endpoint_id']
+    (endpoint / "staging").mkdir(parents=True)
+    (endpoint / "output").mkdir()
+
+    return backend, endpoint
+
+
+def test_transfer_batch_skips_missing(tmp_path, monkeypatch):
+
+    backend, endpoint = _setup_backend(tmp_path, monkeypatch)
+
+    (endpoint / "staging" / "track1.ms.tar").write_text("a")
+
+    task_id, skipped = transfer_batch([("/staging/track1.ms.tar", "/output"),
+                                       ("/staging/track2.ms.tar", "/output")],
+                                      startnode='cc-cedar', endnode='cc-cedar',
+                                      use_startnode_datapath=False,
+                                      use_endnode_datapath=False,
+                                      return_skipped=True)
+
+    assert task_id is not None
+    assert skipped == [("/staging/track2.ms.tar", "/output")]
+    assert (endpoint / "output" / "track1.ms.tar").exists()
+
+    task_id = transfer_batch([("/staging/track2.ms.tar", "/output")],
+                             startnode='cc-cedar', endnode='cc-cedar',
+                             use_startnode_datapath=False,
+                             use_endnode_datapath=False)
+
+    assert task_id is None
+
+
+def test_queue_batches_tracks(tmp_path, monkeypatch):
+
+    backend, endpoint = _setup_backend(tmp_path, monkeypatch)
+
+    for name in ["track1.ms.tar", "track1_cals.tar", "track2.ms.tar"]:
+        (endpoint / "staging" / name).write_text(name)
+
+    kwargs = dict(startnode='cc-cedar', endnode='cc-cedar',
+                  use_startnode_datapath=False, use_endnode_datapath=False)
+
+    async def run():
+
+        queue = TransferQueue(batch_window=0.05)
+
+        first = queue.enqueue([("/staging/track1.ms.tar", "/output"),
+                               ("/staging/track1_cals.tar", "/output")], **kwargs)
+        second = queue.enqueue([("/staging/track2.ms.tar", "/output"),
+                                ("/staging/track2_cals.tar", "/output")], **kwargs)
+        third = queue.enqueue([("/staging/track3.ms.tar", "/output")], **kwargs)
+
+        return await asyncio.wait_for(asyncio.gather(first, second, third), 10)
+
+    first, second, third = asyncio.run(run())
+
+    # The two tracks with files share one task.
+    assert len(backend.tasks) == 1
+    assert first[0] == second[0] is not None
+
+    assert first[1] == []
+    assert second[1] == [("/staging/track2_cals.tar", "/output")]
+    assert third == (None, [("/staging/track3.ms.tar", "/output")])
+
+    for name in ["track1.ms.tar", "track1_cals.tar", "track2.ms.tar"]:
+        assert (endpoint / "output" / name).exists()
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# weblog_scraping needs tqdm for its progress bars.
+pytest.importorskip("tqdm")
+
+from ..summary_stats.weblog_scraping import (parse_product_name, PRODUCT_NAME_PATTERN,
+                                             flagging_tables_to_records, mean_flag_percent,
+                                             write_flagging_records, dataset_product_names,
+                                             load_flagging_dataset, find_weblog_files,
+                                             diff_weblog_manifest)
+
+
+TRACK = "M31_C_20A-346.sb38096442.eb38150591.59121.2648"
+
+
+@pytest.mark.parametrize(('prod_name', 'target', 'config', 'data_type', 'qa_iteration'),
+                         [(f"{TRACK}_continuum_products", 'M31', 'C', 'continuum', 0),
+                          (f"{TRACK}_speclines_products_2", 'M31', 'C', 'speclines', 2),
+                          ("NGC6822_Field_1_B_20A-346.sb1.eb2.59000.1_continuum_products_1",
+                           'NGC6822_Field_1', 'B', 'continuum', 1)])
+def test_parse_product_name(prod_name, target, config, data_type, qa_iteration):
+
+    info = parse_product_name(prod_name)
+
+    assert info['target'] == target
+    assert info['config'] == config
+    assert info['project'] == '20A-346'
+    assert info['data_type'] == data_type
+    assert info['qa_iteration'] == qa_iteration
+    assert prod_name.startswith(f"{info['track']}_{data_type}_products")
+
+
+@pytest.mark.parametrize('prod_name',
+                         [f"{TRACK}_continuum",
+                          f"{TRACK}_imaging_products",
+                          f"{TRACK}_continuum_products_final",
+                          "M31_20A-346.sb1.eb2_continuum_products"])
+def test_parse_product_name_invalid(prod_name):
+
+    assert PRODUCT_NAME_PATTERN.match(prod_name) is None
+
+    with pytest.raises(ValueError):
+        parse_product_name(prod_name)
+
+
+def _flagging_table(values):
+    # Weblog tables have a NaN row after each spw row.
+    rows = []
+    index = []
+    for spw, row in values.items():
+        rows.extend([row, [np.nan] * len(row)])
+        index.extend([spw, np.nan])
+
+    return pd.DataFrame(rows, index=index,
+                        columns=[f"col{ii}" for ii in range(len(rows[0]))])
+
+
+def test_mean_flag_percent_matches_tables():
+
+    tables = [_flagging_table({0: [10., 20., 30.], 1: [50., np.nan, 70.]}),
+              _flagging_table({0: [50., 10.], 1: [100., 80.]})]
+
+    df = flagging_tables_to_records(tables, f"{TRACK}_continuum_products")
+
+    assert df['num_values'].tolist() == [3, 2, 2, 2]
+
+    # The previous statistic averaged all table columns together.
+    expected = pd.concat([table[::2] for table in tables], axis=1).mean(axis=1)
+
+    np.testing.assert_allclose(mean_flag_percent(df).values, expected.values)
+
+
+def test_diff_weblog_manifest(tmp_path):
+
+    for name in ["new", "same", "changed"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "t1-3.html").write_text(name)
+
+    weblogs = find_weblog_files(tmp_path)
+
+    assert len(weblogs) == 3
+
+    manifest = weblogs[~weblogs['path'].str.contains("new")].copy()
+    manifest.loc[manifest['path'].str.contains("changed"), 'size'] += 1
+
+    merged = diff_weblog_manifest(weblogs, manifest)
+
+    changed = merged.loc[merged['changed'], 'path']
+
+    assert sorted([path.split("/")[-2] for path in changed]) == ["changed", "new"]
+
+
+def test_load_flagging_dataset(tmp_path):
+
+    pytest.importorskip("pyarrow")
+
+    table = _flagging_table({0: [10., 30.], 1: [60., 80.]})
+
+    prod_names = [f"{TRACK}_continuum_products",
+                  f"{TRACK}_continuum_products_1",
+                  "M33_B_20A-346.sb1.eb2.59000.1_continuum_products"]
+
+    for prod_name in prod_names:
+        write_flagging_records(flagging_tables_to_records([table], prod_name),
+                               prod_name, tmp_path)
+
+    # Re-writing a product replaces its rows.
+    write_flagging_records(flagging_tables_to_records([table], prod_names[0]),
+                           prod_names[0], tmp_path)
+
+    assert dataset_product_names(tmp_path) == set(prod_names)
+
+    df = load_flagging_dataset(tmp_path, target='M31', config='C', project='20A-346')
+
+    assert len(df) == 4
+    assert set(df['qa_iteration']) == {0, 1}
+
+    df = load_flagging_dataset(tmp_path, target='M31', finalqa_only=True)
+
+    assert set(df['qa_iteration']) == {1}
+    assert df.groupby('spw')['flag_percent'].mean().tolist() == [20., 70.]
+
+    assert len(load_flagging_dataset(tmp_path, config='B')) == 2
+    assert len(load_flagging_dataset(tmp_path, data_type='speclines')) == 0
+    assert len(load_flagging_dataset(tmp_path / "missing")) == 0
@@ -0,0 +1,194 @@
+'''
+Record the throughput of the globus transfers.
+
+Every finished transfer task is stored per EBID, pipeline stage and route
+(start and end node) so we can see which routes or times of day are slow and
+predict how long queued transfers will take.
+'''
+
+import os
+import sqlite3
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from .cluster_configs import local_db_path
+
+from .logging import setup_logging
+log = setup_logging()
+
+
+TRANSFER_METRICS_DB = local_db_path('transfer_metrics.db')
+
+# Sizes are in bytes, wall time in seconds and the rate in MB/s.
+TRANSFER_METRIC_COLUMNS = ['TaskID', 'EBID', 'Stage', 'StartNode', 'EndNode', 'Status',
+                           'Bytes', 'Files', 'Faults', 'Rate_MBs', 'WallTime',
+                           'RequestTime', 'CompletionTime']
+
+
+def _connect_db(db_path):
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    conn = sqlite3.connect(db_path)
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS transfers (
+                    TaskID TEXT PRIMARY KEY, EBID INTEGER, Stage TEXT,
+                    StartNode TEXT, EndNode TEXT, Status TEXT, Bytes REAL,
+                    Files INTEGER, Faults INTEGER, Rate_MBs REAL, WallTime REAL,
+                    RequestTime TEXT, CompletionTime TEXT)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_transfers_route
+                    ON transfers (StartNode, EndNode)''')
+
+    return conn
+
+
+def _parse_time(timestr):
+
+    if timestr is None:
+        return None
+
+    return datetime.fromisoformat(timestr.replace("Z", "+00:00"))
+
+
+def record_transfer(task, ebid=None, stage=None, startnode=None, endnode=None,
+                    db_path=TRANSFER_METRICS_DB):
+    '''
+    Store the metrics of a finished transfer task.
+
+    Parameters
+    ----------
+    task : dict
+        The final task document.
+    ebid : int, optional
+        EBID of the track.
+    stage : str, optional
+        Name of the pipeline stage that made the transfer.
+    startnode, endnode : str, optional
+        Names of the nodes in `ENDPOINT_INFO`.
+    '''
+
+    request_time = _parse_time(task.get('request_time'))
+    completion_time = _parse_time(task.get('completion_time'))
+
+    if request_time is not None and completion_time is not None:
+        walltime = (completion_time - request_time).total_seconds()
+    else:
+        walltime = None
+
+    nbytes = task.get('bytes_transferred', 0) or 0
+
+    rate = task.get('effective_bytes_per_second', 0) or 0
+    if rate == 0 and walltime:
+        rate = nbytes / walltime
+
+    row = [task['task_id'], None if ebid is None else int(ebid), stage,
+           startnode, endnode, task['status'], nbytes,
+           task.get('files_transferred', 0), task.get('faults', 0),
+           rate / 1e6, walltime,
+           task.get('request_time'), task.get('completion_time')]
+
+    with _connect_db(db_path) as conn:
+        conn.execute(f"INSERT OR REPLACE INTO transfers VALUES "
+                     f"({','.join(['?'] * len(TRANSFER_METRIC_COLUMNS))})", row)
+    conn.close()
+
+    log.info(f"Transfer {task['task_id']} {startnode}->{endnode}: {nbytes / 1e9:.2f} GB "
+             f"in {walltime} s ({rate / 1e6:.1f} MB/s)")
+
+
+def load_transfer_metrics(db_path=TRANSFER_METRICS_DB, startnode=None, endnode=None,
+                          succeeded_only=False):
+    '''
+    Return the stored transfer metrics, optionally for one route.
+    '''
+
+    query = "SELECT * FROM transfers"
+
+    conditions = []
+    params = []
+    if startnode is not None:
+        conditions.append("StartNode = ?")
+        params.append(startnode)
+    if endnode is not None:
+        conditions.append("EndNode = ?")
+        params.append(endnode)
+    if succeeded_only:
+        conditions.append("Status = 'SUCCEEDED'")
+
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY CompletionTime"
+
+    with _connect_db(db_path) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def route_throughput(df=None, window=20, db_path=TRANSFER_METRICS_DB):
+    '''
+    Rolling median throughput of each route over its last `window` succeeded transfers.
+
+    Returns
+    -------
+    df_route : pandas.DataFrame
+        Indexed by (StartNode, EndNode), with the rolling 'Rate_MBs' and the
+        number of transfers used.
+    '''
+
+    if df is None:
+        df = load_transfer_metrics(db_path=db_path, succeeded_only=True)
+
+    df = df[(df['Status'] == 'SUCCEEDED') & (df['Rate_MBs'] > 0)]
+
+    recent = df.groupby(['StartNode', 'EndNode']).tail(window)
+
+    return recent.groupby(['StartNode', 'EndNode']).agg(Rate_MBs=('Rate_MBs', 'median'),
+                                                       num_transfers=('TaskID', 'count'))
+
+
+def summarize_transfer_metrics(df=None, by=['StartNode', 'EndNode', 'Hour'],
+                               db_path=TRANSFER_METRICS_DB):
+    '''
+    Throughput and failure statistics per route and hour of the day (UTC) the
+    transfers were requested.
+    '''
+
+    if df is None:
+        df = load_transfer_metrics(db_path=db_path)
+
+    df = df.assign(Hour=pd.to_datetime(df['RequestTime'], utc=True).dt.hour,
+                   Succeeded=df['Status'] == 'SUCCEEDED',
+                   GB=df['Bytes'] / 1e9,
+                   WallTime_hr=df['WallTime'] / 3600.)
+
+    summary = df.groupby(by).agg(num_transfers=('TaskID', 'count'),
+                                 frac_succeeded=('Succeeded', 'mean'),
+                                 GB_total=('GB', 'sum'),
+                                 Rate_MBs_median=('Rate_MBs', 'median'),
+                                 Rate_MBs_min=('Rate_MBs', 'min'),
+                                 WallTime_hr_median=('WallTime_hr', 'median'),
+                                 Faults_total=('Faults', 'sum'))
+
+    return summary
+
+
+def predict_transfer_time(nbytes, startnode, endnode, window=20,
+                          db_path=TRANSFER_METRICS_DB):
+    '''
+    Predict the wall time in seconds of transfers of `nbytes` on a route from its
+    rolling throughput. `nbytes` can be an array for many queued transfers.
+    Returns None when there are no previous transfers on the route.
+    '''
+
+    df_route = route_throughput(window=window, db_path=db_path)
+
+    if (startnode, endnode) not in df_route.index:
+        return None
+
+    rate = df_route.loc[(startnode, endnode), 'Rate_MBs'] * 1e6
+
+    return np.asarray(nbytes) / rate
@@ -11,12 +11,15 @@ REQUIRE python>=3.7 for asyncio.
 import asyncio
 import time
 from pathlib import Path
+import astropy.units as u
 
 from autodataingest.gsheet_tracker.gsheet_functions import (find_new_tracks)
-from autodataingest.globus_functions import globus_ebid_check_exists
+from autodataingest.globus_functions import globus_ebid_check_exists, get_deletion_queue
 
 from autodataingest.ingest_pipeline_functions import AutoPipeline
 
+from autodataingest.cluster_capacity import ClusterCapacityGate
+
 from autodataingest.logging import setup_logging
 log = setup_logging()
 
@@ -74,13 +77,27 @@ async def produce(queue, sleeptime=600, test_case_run_newest=False,
                 log.info(f"EBID {ebid} is still staging. Skipping.")
                 continue
 
+            this_pipe = AutoPipeline(ebid, sheetname=sheetname)
+
+            # Wait until the track fits on scratch with the other running tracks.
+            try:
+                is_admitted = CAPACITY_GATE.admit(ebid, data_size=this_pipe.data_size,
+                                                  num_jobs=3)
+            except Exception as err:
+                log.error(f"Encountered an error checking job/storage usage on {CLUSTERNAME}")
+                log.error(f"Error is: {err}")
+                is_admitted = False
+
+            if not is_admitted:
+                log.info(f"At job/storage limit. Skipping {ebid} for now.")
+                continue
+
             # Put a small gap between starting to consume processes
             await asyncio.sleep(sleeptime)
 
             EBID_QUEUE_LIST.append(ebid)
 
             # put the item in the queue
-            this_pipe = AutoPipeline(ebid, sheetname=sheetname)
             this_pipe.track_name = track_name
             await this_pipe.initial_status()
 
@@ -150,7 +167,8 @@ async def consume(queue):
                                 line_mem=CLUSTER_LINE_MEM,
                                 scheduler_cmd=CLUSTER_SCHEDCMD,
                                 reindex=False,
-                                casa_version=CASA_VERSION,)
+                                casa_version=CASA_VERSION,
+                                bundle_submission=CLUSTER_BUNDLE_SUBMISSION)
 
         log.info("Checking and waiting for job completion")
 
@@ -187,6 +205,9 @@ async def run(num_produce=1, num_consume=4,
     for c in consumers:
         c.cancel()
 
+    # Submit the deletions still waiting for their batch window.
+    await get_deletion_queue().close()
+
 
 if __name__ == "__main__":
 
@@ -226,6 +247,11 @@ if __name__ == "__main__":
 
     CLUSTER_SCHEDCMD = "sbatch"
 
+    # Upload and submit all jobs for a track in one call.
+    CLUSTER_BUNDLE_SUBMISSION = True
+
+    # Set these to None to estimate the time and memory from previous jobs
+    # (see job_accounting.estimate_job_resources).
     CLUSTER_SPLIT_JOBTIME = '12:00:00'
     CLUSTER_CONTINUUM_JOBTIME = '72:00:00'
     CLUSTER_LINE_JOBTIME = '72:00:00'
@@ -239,6 +265,17 @@ if __name__ == "__main__":
 
     NUM_CONSUMERS = 1
 
+    # Set limits allowed for new tracks to be started.
+    MIN_STORAGE = 3 * u.TB
+    MIN_NUMFILES = 1e5
+    MAX_NUMJOBS = 35
+
+    # Shared check of the scratch quota and job queue. Reservations are
+    # stored locally and shared with main_restarts.py.
+    CAPACITY_GATE = ClusterCapacityGate(min_storage=MIN_STORAGE,
+                                        min_numfiles=MIN_NUMFILES,
+                                        max_numjobs=MAX_NUMJOBS)
+
     uname = 'ekoch'
     sname = 'ualberta.ca'
     EMAILADDR = f"{uname}@{sname}"
@@ -5,13 +5,26 @@ from pathlib import Path
 import pandas as pd
 
 
-from autodataingest.ingest_pipeline_functions import AutoPipeline
+from autodataingest.ingest_pipeline_functions import AutoPipeline, set_job_stats_batch
+
+from autodataingest.globus_functions import get_deletion_queue
 
 from autodataingest.ssh_utils import setup_ssh_connection
 
-from autodataingest.gsheet_tracker.gsheet_functions import find_running_tracks
+from autodataingest.gsheet_tracker.gsheet_functions import (find_running_tracks,
+                                                            get_track_metadata,
+                                                            write_summary_table)
+
+from autodataingest.job_monitor import (SlurmJobWatcher, identify_completions,
+                                        FINISHED_STATES)
+
+from autodataingest.job_accounting import record_job_resources, summarize_job_times
 
-from autodataingest.job_monitor import get_slurm_job_monitor, identify_completions
+from autodataingest.submission_journal import finish_submissions
+
+from autodataingest.cluster_capacity import release_capacity
+
+from autodataingest.email_notifications.notification_watcher import get_notification_watcher
 
 from autodataingest.logging import setup_logging
 log = setup_logging()
@@ -25,44 +38,147 @@ def return_job_type(row):
         raise ValueError(f"Unable to interpret job type {row['JobType']}")
 
 
-async def produce(queue, sleeptime=60, longsleeptime=3600,
+def job_id_from_summary(job_summ):
+    '''
+    Job IDs are recorded in the sheet as CLUSTERNAME:JOBNUM, or
+    CLUSTERNAME:ARRAYJOBNUM_TASKNUM for job arrays.
+    '''
+    try:
+        return str(job_summ).split(":")[1]
+    except IndexError:
+        return None
+
+
+async def wait_for_next_poll(pollsleeptime):
+    '''
+    Wait `pollsleeptime`, or until a job end notification email arrives.
+    '''
+
+    try:
+        await get_notification_watcher().wait_for('job', finished_only=True,
+                                                  timeout=pollsleeptime)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def produce(queue, sleeptime=60, pollsleeptime=120, longsleeptime=3600,
                   clustername='cc-cedar',
                   sheetnames=['20A - OpLog Summary']):
     '''
     Check for new tracks from the google sheet.
+
+    The running tracks are read from the sheet every `longsleeptime`, while
+    the slurm job states are polled every `pollsleeptime`, or sooner when a job
+    end notification arrives. Only the jobs that changed state since the
+    previous poll are checked for completion.
     '''
 
     log.info(f"Checking job status from {clustername}")
 
+    watcher = SlurmJobWatcher(time_range_days=TIME_RANGE_DAYS)
+
+    running_tracks = dict.fromkeys(sheetnames)
+
+    last_sheet_check = None
+
     while True:
 
-        running_tracks = dict.fromkeys(sheetnames)
+        # Full check of the running tracks against the job table
+        # whenever the sheet is re-read
+        do_full_check = last_sheet_check is None or \
+            (time.time() - last_sheet_check) >= longsleeptime
 
-        for sheetname in sheetnames:
+        if do_full_check:
+
+            for sheetname in sheetnames:
+
+                sheet_running_tracks = find_running_tracks(sheetname=sheetname)
+
+                running_tracks[sheetname] = sheet_running_tracks
 
-            sheet_running_tracks = find_running_tracks(sheetname=sheetname)
+                await asyncio.sleep(120)
 
-            running_tracks[sheetname] = sheet_running_tracks
+            # Target, config and data size to store with the job usage
+            track_info = get_track_metadata(sheetnames=sheetnames)
 
-            await asyncio.sleep(120)
+            last_sheet_check = time.time()
 
-        cluster_key = 'cedar-robot-jobstatus'
-        connect = setup_ssh_connection(cluster_key)
-        df = get_slurm_job_monitor(connect, time_range_days=TIME_RANGE_DAYS)
+        connect = setup_ssh_connection('cedar-robot-jobstatus')
+        queue_connect = setup_ssh_connection('cedar-robot-queuestatus')
+        events = watcher.poll(connect, queue_connect=queue_connect)
         connect.close()
+        queue_connect.close()
+
+        finished_jobids = set([event.JobID for event in events
+                               if event.State in FINISHED_STATES])
+
+        if not do_full_check and len(finished_jobids) == 0:
+            await wait_for_next_poll(pollsleeptime)
+            continue
+
+        df = watcher.as_table()
+
+        df_finished = df[df['JobID'].isin(finished_jobids)]
+
+        # Keep the resource usage of all finished jobs.
+        record_job_resources(df_finished, track_info=track_info)
+
+        # Refresh the per target and config job times with the sheet check.
+        if do_full_check:
+            try:
+                write_summary_table(summarize_job_times(by=['Target', 'Configuration']).round(2),
+                                    worksheet_name=JOB_TIME_SUMMARY_SHEET)
+            except Exception:
+                log.exception("Unable to update the job time summary sheet.")
+
+        # The IDs as they are written in the sheet
+        finished_sheet_jobids = set(df_finished['JobID'].astype(str)) | \
+            set(df_finished['ArrayJobID']) - set([""])
+
+        # The next submission of these job types for the track is a new attempt.
+        # Array tasks are journaled by their ARRAYJOBID_TASKID.
+        finish_submissions(finished_sheet_jobids)
+
+        # Once the split has finished, the track's data is counted in the
+        # scratch quota and no longer needs a reservation.
+        for ebid in set([event.EBID for event in events
+                         if event.State in FINISHED_STATES and
+                         event.JobType == "import_and_split"]):
+            release_capacity(ebid)
 
         log.info("Checking for completed jobs")
 
+        # Finished jobs that no longer need to be kept in the watcher.
+        handled_jobids = set(df_finished.loc[df_finished['JobType'] == "import_and_split", 'JobID'])
+
         for sheetname in sheetnames:
 
             log.info(f"Job searches for {sheetname}")
 
-            df_comp, df_fail = identify_completions(df, running_tracks[sheetname])
+            if do_full_check:
+                these_tracks = running_tracks[sheetname]
+            else:
+                these_tracks = [this_track for this_track in running_tracks[sheetname]
+                                if job_id_from_summary(this_track[2]) in finished_sheet_jobids]
+
+            df_comp, df_fail, df_running = identify_completions(df, these_tracks)
+
+            log.info(f"{len(df_running)} jobs are still pending or running.")
+
+            # Remove the finished jobs to avoid re-processing them before the
+            # next sheet check.
+            done_summaries = set(df_comp['JobSummary']) | set(df_fail['JobSummary'])
+            running_tracks[sheetname] = [this_track for this_track in running_tracks[sheetname]
+                                         if this_track[2] not in done_summaries]
+
+            handled_jobids.update(df_comp['JobID'])
+            handled_jobids.update(df_fail['JobID'])
 
             if len(df_comp) > 0:
 
                 log.info(f"Found completions for: {df_comp['EBID']}")
 
+                comp_jobs = []
                 for index, row in df_comp.iterrows():
 
                     ebid = int(row['EBID'])
@@ -71,7 +187,15 @@ async def produce(queue, sleeptime=60, longsleeptime=3600,
 
                     auto_pipe = AutoPipeline(ebid, sheetname=sheetname)
                     auto_pipe.set_qa_queued_status(data_type=data_type)
-                    auto_pipe.set_job_stats(job_id, data_type)
+
+                    comp_jobs.append((auto_pipe, job_id, data_type))
+
+                # Write the job stats for all completions at once.
+                set_job_stats_batch(comp_jobs)
+
+                for auto_pipe, job_id, data_type in comp_jobs:
+
+                    ebid = auto_pipe.ebid
 
                     log.info(f"Adding to queue {ebid}:{data_type} for completed job {job_id}")
                     await queue.put([auto_pipe, data_type])
@@ -84,6 +208,7 @@ async def produce(queue, sleeptime=60, longsleeptime=3600,
 
                 log.info(f"Found failures for: {df_fail['EBID']}")
 
+                fail_jobs = []
                 for index, row in df_fail.iterrows():
 
                     ebid = int(row['EBID'])
@@ -97,22 +222,24 @@ async def produce(queue, sleeptime=60, longsleeptime=3600,
                     if row['JobType'] == "import_and_split":
                         auto_pipe.set_job_status('continuum', job_status)
                         auto_pipe.set_job_status('speclines', job_status)
-                        auto_pipe.set_job_stats(job_id, "import_and_split")
+                        fail_jobs.append((auto_pipe, job_id, "import_and_split"))
 
                     else:
                         data_type = return_job_type(row)
                         auto_pipe.set_job_status(data_type, job_status)
-                        auto_pipe.set_job_stats(job_id, data_type)
+                        fail_jobs.append((auto_pipe, job_id, data_type))
 
                     await asyncio.sleep(sleeptime)
+
+                set_job_stats_batch(fail_jobs)
             else:
                 log.info("No failures found.")
 
-            await asyncio.sleep(120)
+        watcher.evict(handled_jobids)
 
         log.info("Finished parsing job statuses.")
 
-        await asyncio.sleep(longsleeptime)
+        await wait_for_next_poll(pollsleeptime)
 
 
 async def consume(queue, sleeptime=60):
@@ -166,6 +293,9 @@ async def run(**produce_kwargs):
     # the consumer is still awaiting for an item, cancel it
     consumer.cancel()
 
+    # Submit the deletions still waiting for their batch window.
+    await get_deletion_queue().close()
+
 
 if __name__ == "__main__":
 
@@ -198,6 +328,9 @@ if __name__ == "__main__":
     # Time range to check for job completion
     TIME_RANGE_DAYS = 14
 
+    # Tab in the track sheet with the job times per target and config
+    JOB_TIME_SUMMARY_SHEET = 'Job Time Summary'
+
     while True:
 
         print("Starting new event loop")
@@ -22,6 +22,10 @@ from autodataingest.gsheet_tracker.gsheet_functions import (update_track_status)
 
 from autodataingest.ingest_pipeline_functions import AutoPipeline
 
+from autodataingest.globus_functions import get_deletion_queue
+
+from autodataingest.qa_build_service import QABuildService
+
 from autodataingest.logging import setup_logging
 log = setup_logging()
 
@@ -53,7 +57,7 @@ async def produce(queue, sleeptime=60, start_with_newest=False,
         await queue.put([AutoPipeline(ebid, sheetname=SHEETNAME), run_continuum, run_lines])
 
 
-async def consume(queue, sleeptime=60):
+async def consume(queue, qa_service, sleeptime=60):
     while True:
         # wait for an item from the producer
         auto_pipe, RUN_CONTINUUM, RUN_LINES = await queue.get()
@@ -95,8 +99,10 @@ async def consume(queue, sleeptime=60):
                     await auto_pipe.make_flagging_sheet(data_type=data_type)
 
                     # Create the final QA products and move to the webserver
+                    # The build runs in the QA service's process pool.
                     log.info(f"Creating QA products")
-                    has_completed = auto_pipe.make_qa_products(data_type=data_type)
+                    qa_result = await qa_service.build(auto_pipe, data_type)
+                    has_completed = qa_result.success
 
                     if has_completed:
                         log.info(f"Updating track status")
@@ -114,16 +120,33 @@ async def consume(queue, sleeptime=60):
         queue.task_done()
 
 
-async def run(**produce_kwargs):
+async def run(num_consumers=1, qa_max_workers=None, qa_max_io_jobs=2,
+              **produce_kwargs):
     queue = asyncio.Queue()
-    # schedule the consumer
-    consumer = asyncio.ensure_future(consume(queue))
+
+    qa_service = QABuildService(max_workers=qa_max_workers,
+                                max_io_jobs=qa_max_io_jobs)
+
+    # schedule the consumers. Each handles one track at a time while the
+    # QA builds are limited by the service's pool.
+    consumers = [asyncio.ensure_future(consume(queue, qa_service))
+                 for _ in range(num_consumers)]
     # run the producer and wait for completion
     await produce(queue, **produce_kwargs)
-    # wait until the consumer has processed all items
+    # wait until the consumers have processed all items
     await queue.join()
-    # the consumer is still awaiting for an item, cancel it
-    consumer.cancel()
+    # the consumers are still awaiting for an item, cancel them
+    for consumer in consumers:
+        consumer.cancel()
+
+    # Submit the deletions still waiting for their batch window.
+    await get_deletion_queue().close()
+
+    qa_timings = qa_service.timing_summary()
+    if len(qa_timings) > 0:
+        log.info(f"QA build timings (s):\n{qa_timings.to_string()}")
+
+    qa_service.shutdown()
 
 
 if __name__ == "__main__":
@@ -165,6 +188,12 @@ if __name__ == "__main__":
                'HVC']
 
 
+    # Number of tracks handled at once, and the limits on the parallel
+    # QA builds (CPU workers and concurrent product extraction/moves).
+    NUM_CONSUMERS = 4
+    QA_MAX_WORKERS = None
+    QA_MAX_IO_JOBS = 2
+
     MANUAL_EBID_LIST = []
 
     # ebid, continuum, lines
@@ -187,7 +216,10 @@ if __name__ == "__main__":
         loop.set_debug(True)
         loop.slow_callback_duration = 0.001
 
-        loop.run_until_complete(run(start_with_newest=start_with_newest,
+        loop.run_until_complete(run(num_consumers=NUM_CONSUMERS,
+                                    qa_max_workers=QA_MAX_WORKERS,
+                                    qa_max_io_jobs=QA_MAX_IO_JOBS,
+                                    start_with_newest=start_with_newest,
                                     ebid_list=MANUAL_EBID_LIST))
         loop.close()
 
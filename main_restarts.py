@@ -17,19 +17,15 @@ from autodataingest.gsheet_tracker.gsheet_functions import (find_rerun_status_tr
 
 from autodataingest.ingest_pipeline_functions import AutoPipeline
 
-from autodataingest.ssh_utils import setup_ssh_connection
+from autodataingest.globus_functions import get_deletion_queue
 
-from autodataingest.job_monitor import (number_of_active_jobs,
-                                        get_lustre_storage_avail,
-                                        get_slurm_job_monitor)
+from autodataingest.campaign_submission import campaign_job_submission
 
-from autodataingest.logging import setup_logging
-log = setup_logging()
 
+from autodataingest.cluster_capacity import ClusterCapacityGate
 
-def allow_newjobs_check(free_space, free_filenum, num_jobs_active):
-    return (free_space >= MIN_STORAGE) & (free_filenum >= MIN_NUMFILES) & \
-        (num_jobs_active < MAX_NUMJOBS)
+from autodataingest.logging import setup_logging
+log = setup_logging()
 
 
 async def produce(queue, sleeptime=600, start_with_newest=False,
@@ -111,26 +107,8 @@ async def produce(queue, sleeptime=600, start_with_newest=False,
 
         # Check the number of active jobs and storage usage.
         # Skip new runs until there are fewer jobs or more storage space.
-        cluster_key_status = 'cedar-robot-jobstatus'
-        cluster_key_quota = 'cedar-robot-lfsquota'
-
         try:
-            connect = setup_ssh_connection(cluster_key_status)
-
-            df = get_slurm_job_monitor(connect)
-            connect.close()
-
-            num_jobs_active = number_of_active_jobs(df)
-
-            # Get storage space usage
-            connect = setup_ssh_connection(cluster_key_quota)
-            free_space, free_filenum = get_lustre_storage_avail(connect,
-                                                                diskname='/scratch')
-            connect.close()
-
-            log.info(f"Free storage: {free_space} Free file num: {free_filenum}")
-            log.info(f"Jobs running on {CLUSTERNAME}: {num_jobs_active}")
-            allow_newjobs = allow_newjobs_check(free_space, free_filenum, num_jobs_active)
+            allow_newjobs = CAPACITY_GATE.has_capacity()
 
             if not allow_newjobs:
                 log.info("At job/storage limit. Will wait before starting new jobs.")
@@ -168,6 +146,9 @@ async def produce(queue, sleeptime=600, start_with_newest=False,
         if start_with_newest:
             all_rerun_statuses = all_rerun_statuses[::-1]
 
+        # Tracks to submit together as job arrays in campaign mode.
+        campaign_pipes = {'continuum': [], 'speclines': []}
+
         # Queue new jobs to run.
         for rerun_stat, this_sheetname in all_rerun_statuses:
 
@@ -181,14 +162,22 @@ async def produce(queue, sleeptime=600, start_with_newest=False,
 
             this_pipe = AutoPipeline(ebid, sheetname=this_sheetname)
 
-            # Disable new runs for restarts when allow_newjobs = False from above.
+            # Each restart submits an import/split and a pipeline job.
+            num_restarts = sum([this_job_type == "RESTART" for _, this_job_type in run_types])
+
+            allow_track = allow_newjobs and \
+                CAPACITY_GATE.admit(ebid, data_size=this_pipe.data_size,
+                                    num_jobs=2 * num_restarts,
+                                    new_track=False)
+
+            # Disable new runs for restarts when the track was not admitted.
             for this_run_type in run_types:
                 this_data_type, this_job_type = this_run_type
 
                 log.info(f'Found new track with ID {ebid} {this_data_type} {this_job_type}')
 
                 # Block new restarts if not allowing new jobs yet
-                if not allow_newjobs and this_job_type == "RESTART":
+                if not allow_track and this_job_type == "RESTART":
                     log.info(f"At job/storage limit. Will wait before starting new job.")
 
                     if this_data_type == 'continuum':
@@ -196,21 +185,51 @@ async def produce(queue, sleeptime=600, start_with_newest=False,
                     else:
                         this_pipe._allow_speclines_run = False
 
-            # Update number of active jobs manually.
-            num_jobs_active += len(run_types)
+            if CAMPAIGN_SUBMISSION:
+                for this_data_type, this_job_type in run_types:
+                    if allow_track and this_job_type == "RESTART":
+                        campaign_pipes[this_data_type].append(this_pipe)
 
-            # put the item in the queue
-            await queue.put(this_pipe)
+                EBID_QUEUE_LIST.remove(ebid)
 
-            # Put a small gap between starting to consume processes
-            await asyncio.sleep(sleeptime)
+            else:
+                # put the item in the queue
+                await queue.put(this_pipe)
+
+                # Put a small gap between starting to consume processes
+                await asyncio.sleep(sleeptime)
 
             # If we've exceeded our allow jobs limit, break this loop.
-            if not allow_newjobs_check(free_space, free_filenum, num_jobs_active):
+            if not CAPACITY_GATE.has_capacity():
                 log.info("Queue in the spreadsheet exceeded our job limits."
                          " Holding further job starts.")
                 break
 
+        for this_data_type, these_pipes in campaign_pipes.items():
+
+            if len(these_pipes) == 0:
+                continue
+
+            if this_data_type == 'continuum':
+                pipeline_time, pipeline_mem = CLUSTER_CONTINUUM_JOBTIME, CLUSTER_CONTINUUM_MEM
+            else:
+                pipeline_time, pipeline_mem = CLUSTER_LINE_JOBTIME, CLUSTER_LINE_MEM
+
+            try:
+                await campaign_job_submission(these_pipes,
+                                              data_type=this_data_type,
+                                              clustername=CLUSTERNAME,
+                                              reindex=REINDEX,
+                                              casa_version=CASA_VERSION,
+                                              split_time=CLUSTER_SPLIT_JOBTIME,
+                                              pipeline_time=pipeline_time,
+                                              split_mem=CLUSTER_SPLIT_MEM,
+                                              pipeline_mem=pipeline_mem,
+                                              max_running_tasks=MAX_NUMJOBS,
+                                              pipeline_branch=PIPELINE_BRANCHNAME)
+            except ValueError as err:
+                log.error(f"Failed to submit {this_data_type} restarts as job arrays: {err}")
+
         if test_case_run_newest:
             break
 
@@ -310,7 +329,8 @@ async def consume(queue, sleeptime=1800, sleeptime_finish=600):
                                                     line_mem=CLUSTER_LINE_MEM,
                                                     reindex=REINDEX,
                                                     casa_version=CASA_VERSION,
-                                                    pipeline_branch=PIPELINE_BRANCHNAME)
+                                                    pipeline_branch=PIPELINE_BRANCHNAME,
+                                                    bundle_submission=CLUSTER_BUNDLE_SUBMISSION)
 
                 await asyncio.sleep(sleeptime)
 
@@ -343,6 +363,9 @@ async def run(num_consume=4,
     for c in consumers:
         c.cancel()
 
+    # Submit the deletions still waiting for their batch window.
+    await get_deletion_queue().close()
+
 
 if __name__ == "__main__":
 
@@ -374,6 +397,14 @@ if __name__ == "__main__":
 
     CLUSTER_SCHEDCMD = "sbatch"
 
+    # Upload and submit all jobs for a track in one call.
+    CLUSTER_BUNDLE_SUBMISSION = True
+
+    # Submit all restarts found in the sheet together as job arrays.
+    CAMPAIGN_SUBMISSION = False
+
+    # Set these to None to estimate the time and memory from previous jobs
+    # (see job_accounting.estimate_job_resources).
     CLUSTER_SPLIT_JOBTIME = '8:00:00'
     CLUSTER_CONTINUUM_JOBTIME = '120:00:00'
     CLUSTER_LINE_JOBTIME = '120:00:00'
@@ -399,6 +430,12 @@ if __name__ == "__main__":
     MIN_NUMFILES = 1e5
     MAX_NUMJOBS = 35
 
+    # Shared check of the scratch quota and job queue. Reservations are
+    # stored locally and shared with main.py.
+    CAPACITY_GATE = ClusterCapacityGate(min_storage=MIN_STORAGE,
+                                        min_numfiles=MIN_NUMFILES,
+                                        max_numjobs=MAX_NUMJOBS)
+
     uname = 'ekoch'
     sname = 'ualberta.ca'
     EMAILADDR = f"{uname}@{sname}"
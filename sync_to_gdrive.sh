@@ -86,7 +86,7 @@ echo "Found files to upload: ${FILENAMES}"
 # Transfer to QA webserver
 echo "Transferring to QA server at $(date)"
 
-task_id="$(/home/datamanager/.local/bin/globus transfer $source_ep:projects/rrg-eros-ab/ekoch/VLAXL/calibrated/ $dest_ep:space/vlaxl/calibrated/ --jmespath 'task_id' --format=UNIX --batch < batch_files.txt)"
+task_id="$(/home/datamanager/.local/bin/globus transfer $source_ep:projects/rrg-eros-ab/ekoch/VLAXL/calibrated/ $dest_ep:space/vlaxl/calibrated/ --jmespath 'task_id' --format=UNIX --verify-checksum --batch < batch_files.txt)"
 
 echo "Waiting on 'globus transfer' task '$task_id'"
 /home/datamanager/.local/bin/globus task wait "$task_id" --polling-interval 300